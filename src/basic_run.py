@@ -1,35 +1,206 @@
-from datetime import datetime
-import numpy as np
-from besos import eppy_funcs as ef
-from eppy.modeleditor import IDF
-from attrdict import AttrDict
-from pathlib import Path
-import yaml
-import pandas as pd
-pd.set_option('display.max_columns', None)
 import os
-import matplotlib.pyplot as plt
-plt.style.use('bmh')
+from pathlib import Path
+from functools import partial
 
-from utils.data_utils import mtr2df
 from utils.idf_utils import build_model
-from config import idf_dict
-from config import weather_dict
+from utils.run_utils import RunExecutor
+from utils.pipeline_utils import RunPipeline
+from utils.cache_utils import SimulationCache
+from utils.sim_utils import get_simulator
+from utils import profile_utils
+from utils.profile_utils import span, profiled
 from dataclerk import DataClerk
 
 
-def execute_runs(cfg_files=[]):
+def collect_run(dataclerk, cfg) -> None:
+    '''
+    Gathers weather and output of the finished run cfg and writes them to the store of dataclerk
+    '''
+    dataclerk.curr_experiment = cfg.name
+    parse_run(dataclerk, cfg)
+    persist_run(dataclerk, cfg)
+
+
+def parse_run(dataclerk, cfg) -> None:
+    '''
+    Gathers weather and output of the finished run cfg into the experiments of dataclerk
+    '''
+    dataclerk.gather_and_store_weather(cfg)
+    dataclerk.gather_and_store_output(cfg)
+
+
+def persist_run(dataclerk, cfg) -> None:
+    '''
+    Reports the data gathered for run cfg and writes them to the store of dataclerk
+    '''
+    print('final report')
+    with span('report', run=cfg.name):
+        dataclerk.report(with_head=True, name=cfg.name)
+
+    dataclerk.to_store(name=cfg.name)
+
 
-    IDF.setiddname('C:\\EnergyPlusV9-0-1\\Energy+.idd')
+def start_stream(dataclerk, streams, cfg) -> None:
+    '''
+    Gathers the weather of cfg and starts ingesting its output while it is simulated;
+    called again when a run is retried, which discards what was ingested before
+    '''
+    dataclerk.curr_experiment = cfg.name
+    dataclerk.experiments[cfg.name].pop('data', None)
+    dataclerk.gather_and_store_weather(cfg)
+    streams[cfg.name] = dataclerk.stream_output(cfg)
 
-    dummy_file = 'dummy.idf'
-    idf_path = os.path.join(os.getcwd(), '..', 'data', 'epm')
-    weather_path = os.path.join(os.getcwd(), '..', 'data', 'weather')
-    dataclerk = DataClerk(out_path=os.path.join(os.getcwd(), 'saves'),
-                    idf_path=os.path.join(os.getcwd(), '..', 'data', 'epm'),
-                    weather_path=os.path.join(os.getcwd(), '..', 'data', 'weather'),
-                    year=2020
-                    )
+
+def finish_stream(dataclerk, streams, cfg) -> None:
+    '''
+    Ingests the rest of the output of the finished run cfg
+    '''
+    dataclerk.curr_experiment = cfg.name
+    dataclerk.finish_stream(cfg, streams.pop(cfg.name))
+
+    print('final report')
+    with span('report', run=cfg.name):
+        dataclerk.report(with_head=True)
+
+
+def simulate_run(cfg, simulator, sim_cache=None, on_built=None) -> None:
+    '''
+    Builds the model of run cfg and simulates it into cfg.out_dir, or takes its outputs from sim_cache
+
+    Args:
+        on_built(callable): called with cfg between building and simulating, e.g. to start streaming
+    '''
+    with span('build_model', run=cfg.name):
+        model = build_model(cfg, view=False)
+    if on_built is not None:
+        on_built(cfg)
+    with span('simulate', run=cfg.name, simulator=simulator.name):
+        if sim_cache is None:
+            simulator.run(model, cfg.out_dir)
+        elif sim_cache.run(model, cfg.out_dir, simulator=simulator):
+            print(f'Took outputs of {cfg.name} from simulation cache.')
+            profile_utils.count('sim_cache_hits', run=cfg.name)
+        else:
+            profile_utils.count('sim_cache_misses', run=cfg.name)
+
+
+@profiled('ingest_runs')
+def ingest_runs(cfg_files=[]):
+    '''
+    Collects the outputs of runs that were simulated before, without simulating again
+
+    Args:
+        cfg_files(Iterable[str or dict]): yaml files or generated configs of the runs,
+            their outputs are expected in the out_dir given by DataClerk.setup_cfg
+        profile(bool or str): time every stage, see utils.profile_utils.profiled
+    '''
+    dataclerk = DataClerk(year=2020)
+
+    for cfg_file in cfg_files:
+        cfg = dataclerk.setup_cfg(cfg_file)
+        if not os.path.isdir(cfg.out_dir):
+            print(f'No outputs of run {cfg.name} in {cfg.out_dir}; skipping.')
+            continue
+        collect_run(dataclerk, cfg)
+
+    return dataclerk
+
+
+@profiled('execute_runs')
+def execute_runs(cfg_files=[], workers=1, timeout=None, retries=0, use_sim_cache=True, idd_file=None,
+                 simulator=None, stream=False, pipeline=False, stage_workers=None):
+    '''
+    Simulates the runs defined in cfg_files and collects their results in a DataClerk
+
+    Args:
+        cfg_files(Iterable[str or dict]): yaml files or generated configs defining the runs,
+            e.g. utils.sweep_utils.expand_sweep(spec)
+        workers(int): number of simulations run in parallel; runs sequentially if 1
+        timeout(float): seconds after which a parallel run is killed, None for no limit
+        retries(int): number of additional attempts for failed parallel runs
+        use_sim_cache(bool): reuse the outputs of identical earlier runs instead of simulating
+        idd_file(str): EnergyPlus data dictionary, defaults to the IDD_FILE environment variable;
+            if neither is set besos locates the IDD of the installed EnergyPlus
+        simulator(str or simulator): backend running the models, see utils.sim_utils.get_simulator;
+            'local' writes deterministic synthetic outputs without EnergyPlus
+        stream(bool): ingest the meter output into the store while it is written,
+            rather than after each run
+        pipeline(bool): build, simulate, parse and persist runs in overlapping stages,
+            see utils.pipeline_utils.RunPipeline; workers runs are simulated at once
+        stage_workers(dict): workers of the other pipeline stages, e.g. {'build': 2}
+        profile(bool or str): time every stage of every run and print a summary at the end;
+            a path also saves the profile, see utils.profile_utils.profiled
+    '''
+    from eppy.modeleditor import IDF
+
+    dataclerk = DataClerk(year=2020)
+    simulator = get_simulator(simulator)
+
+    idd_file = idd_file or os.environ.get('IDD_FILE')
+    if idd_file is not None and IDF.getiddname() is None:
+        IDF.setiddname(idd_file)
+
+    sim_cache = None
+    if use_sim_cache:
+        sim_cache = SimulationCache(os.environ.get('SIM_CACHE_PATH') or 
+                                    os.path.join(dataclerk.out_path, '.simcache'))
+
+    collect = partial(collect_run, dataclerk)
+    streams = {}
+
+    def start(cfg):
+        start_stream(dataclerk, streams, cfg)
+        streams[cfg.name].start()
+
+    if pipeline:
+        if stream:
+            raise ValueError('Streaming is not supported by the pipeline; the parse stage ingests the outputs')
+
+        cfgs = (dataclerk.setup_cfg(cfg_file) for cfg_file in cfg_files)
+        runner = RunPipeline(stage_workers={'simulate': workers, **(stage_workers or {})},
+                             timeout=timeout,
+                             retries=retries,
+                             idd_file=idd_file,
+                             sim_cache=sim_cache,
+                             simulator=simulator)
+
+        runner.run(cfgs, parse=partial(parse_run, dataclerk), persist=partial(persist_run, dataclerk))
+
+        if runner.failed:
+            print(f'Failed runs: {runner.failed}')
+        if sim_cache is not None:
+            print(f'Simulation cache: {sim_cache.stats()}')
+
+        return dataclerk
+
+    if workers > 1:
+
+        cfgs = (dataclerk.setup_cfg(cfg_file) for cfg_file in cfg_files)
+        executor = RunExecutor(workers=workers, 
+                               timeout=timeout, 
+                               retries=retries,
+                               idd_file=idd_file,
+                               sim_cache=sim_cache,
+                               simulator=simulator)
+
+        print(f'Starting runs on {executor.workers} workers.')
+        if stream:
+            executor.run(cfgs,
+                         on_done=partial(finish_stream, dataclerk, streams),
+                         on_start=partial(start_stream, dataclerk, streams),
+                         on_poll=lambda cfg: streams[cfg.name].poll())
+            # runs that failed for good keep what was ingested, marked incomplete
+            for output in streams.values():
+                output.close(complete=False)
+        else:
+            executor.run(cfgs, on_done=collect)
+
+        if executor.failed:
+            print(f'Failed runs: {executor.failed}')
+        if sim_cache is not None:
+            print(f'Simulation cache: {sim_cache.stats()}')
+
+        return dataclerk
 
 
     for cfg_file in cfg_files:
@@ -37,30 +208,111 @@ def execute_runs(cfg_files=[]):
         print(f'Starting run {cfg_file}.')
 
         cfg = dataclerk.setup_cfg(cfg_file)
-        dataclerk.gather_and_store_weather(cfg)
 
-        model = build_model(cfg, view=False)
-        model.run(output_directory=cfg.out_dir)
+        simulate_run(cfg, simulator, sim_cache, on_built=start if stream else None)
         print(f'\n Done with run {cfg_file}\n')
 
-        dataclerk.gather_and_store_output(cfg)
-        # dataclerk.to_file()
+        if stream:
+            finish_stream(dataclerk, streams, cfg)
+        else:
+            collect(cfg)
 
-        print('final report')
-        dataclerk.report(with_head=True)
+    if sim_cache is not None:
+        print(f'Simulation cache: {sim_cache.stats()}')
+
+    return dataclerk
 
-        dataclerk.to_csv()
 
+@profiled('work_queue')
+def work_queue(queue_path, worker=None, max_runs=None, use_sim_cache=True, idd_file=None, simulator=None,
+               poll_interval=5., wait=True):
+    '''
+    Works off the runs of a queue on a shared filesystem, see utils.queue_utils.WorkQueue
+
+    Any number of workers, on any number of nodes sharing the queue and
+    the output directory, can drain the same queue. Every run is claimed,
+    simulated, parsed and written to the store by one worker; the run is
+    recorded as done only after its partition is in the store. Runs of
+    workers that died are taken over once their lease expired.
+
+    Args:
+        queue_path(str): directory of the queue
+        worker(str): name of this worker in the queue, defaults to host-pid
+        max_runs(int): stop after this many runs, None to work until the queue is drained
+        use_sim_cache(bool): reuse the outputs of identical earlier runs instead of simulating
+        idd_file(str): EnergyPlus data dictionary, see execute_runs
+        simulator(str or simulator): backend running the models, see utils.sim_utils.get_simulator
+        poll_interval(float): seconds to wait for runs held by other workers
+        wait(bool): wait for the runs held by other workers, which are claimed
+            again if their worker dies; stop as soon as nothing is pending if False
+        profile(bool or str): time every stage, see utils.profile_utils.profiled
+
+    Returns:
+        int: number of runs done by this worker
+    '''
+    import time
+    from eppy.modeleditor import IDF
+    from utils.queue_utils import WorkQueue, Heartbeat, worker_name
+
+    queue = WorkQueue(queue_path)
+    worker = worker or worker_name()
+
+    dataclerk = DataClerk(year=2020)
+    simulator = get_simulator(simulator)
+
+    idd_file = idd_file or os.environ.get('IDD_FILE')
+    if idd_file is not None and IDF.getiddname() is None:
+        IDF.setiddname(idd_file)
+
+    sim_cache = None
+    if use_sim_cache:
+        sim_cache = SimulationCache(os.environ.get('SIM_CACHE_PATH') or
+                                    os.path.join(dataclerk.out_path, '.simcache'))
+
+    done = 0
+    while max_runs is None or done < max_runs:
+
+        task = queue.claim(worker)
+        if task is None:
+            if not wait or queue.finished():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        print(f'{worker} starting run {task["id"]} (attempt {task["lease"]["attempt"]}).')
+        try:
+            with Heartbeat(queue, task):
+                cfg = dataclerk.setup_cfg(task.get('cfg_file') or task['cfg'])
+                simulate_run(cfg, simulator, sim_cache)
+                collect_run(dataclerk, cfg)
+        except KeyboardInterrupt:
+            queue.release(task)
+            raise
+        except Exception as error:
+            given_up = queue.fail(task, f'{type(error).__name__}: {error}')
+            print(f'Run {task["id"]} failed{" for good" if given_up else ""}: {error!r}')
+            dataclerk.experiments.pop(task['name'], None)
+            continue
+
+        path = dataclerk.store._partition(cfg.name, cfg.get('building_type'), cfg.get('location'))
+        rows = len(dataclerk.experiments[cfg.name]['data'])
+        if not queue.complete(task, {'rows': rows, 'partition': os.path.relpath(path, dataclerk.store.root)}):
+            print(f'Run {task["id"]} had been completed by another worker.')
+        # the results are in the store, the memory is kept for the next runs
+        del dataclerk.experiments[cfg.name]
+        done += 1
+
+    print(f'{worker} done with {done} runs.')
+    if sim_cache is not None:
+        print(f'Simulation cache: {sim_cache.stats()}')
+
+    return done
 
 
 if __name__ == '__main__':
 
     # Iterate over yml files in runs/ that define the runs
-    if not os.getcwd().endswith('src'):
-        os.chdir(os.path.join(os.getcwd(), 'src'))
-
-    buildings = ['office', 'school', 'apartment', 'hotel', 'hospital']
-    run_cfgs = os.listdir(os.path.join(os.getcwd(), 'runs'))
-    run_cfgs = [os.path.join(os.getcwd(), 'runs', run) for run in run_cfgs]
+    runs_dir = Path(__file__).resolve().parent / 'runs'
+    run_cfgs = sorted(str(run) for run in runs_dir.glob('*.yml'))
     execute_runs(cfg_files=run_cfgs[:1])
     
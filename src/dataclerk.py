@@ -1,25 +1,67 @@
 import os
 import sys
 import yaml
+import calendar
 from pathlib import Path
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from attrdict import AttrDict
 from itertools import product
 from datetime import datetime
-from pvlib.iotools import read_epw
-plt.style.use('bmh')
 
-from utils.data_utils import mtr2df
+from utils.data_utils import mtr2df, MTR2DF_VERSION
+from utils.sql_utils import sql2df
+from utils.eso_utils import eso2df
+from utils.epw_utils import read_epw, read_epw_header, EPW_COLUMNS
+from utils.cache_utils import FrameCache, file_hash
+from utils.store_utils import ExperimentStore
+from utils.registry_utils import ExperimentRegistry, compact, widen
+from utils.stream_utils import OutputStream
+from utils.time_utils import align, hour_of_year, keys_to_index, fields_to_index
+from utils.profile_utils import span
 from config import weather_dict
 from config import idf_dict
 
-from dotenv import load_dotenv, find_dotenv
 
-load_dotenv(find_dotenv())
-PROJECT_ROOT = os.environ.get('PROJECT_RROOT')
-sys.path.append(PROJECT_ROOT)
+# bump whenever the frame returned by read_epw_data changes
+EPW_PARSER_VERSION = 2
+
+# records of an epw file holding one (leap) year of hourly weather at most
+EPW_YEAR_RECORDS = 8784
+
+
+def read_epw_data(epw_path: str, columns=None) -> pd.DataFrame:
+    '''
+    returns the time series part of an epw file, only columns if given
+    '''
+    return read_epw(epw_path, columns=columns)[0]
+
+
+def load_env() -> None:
+    '''
+    loads the paths in .env into os.environ, keeping variables that are already set
+    '''
+    from dotenv import load_dotenv, find_dotenv
+
+    load_dotenv(find_dotenv())
+    project_root = os.environ.get('PROJECT_RROOT')
+    if project_root is not None and project_root not in sys.path:
+        sys.path.append(project_root)
+
+
+def saves_path() -> str:
+    '''
+    returns the absolute directory of run outputs, caches and the store: SAVES_PATH,
+    or the working directory if it is not set; call load_env first to include .env
+    '''
+    return os.path.abspath(os.environ.get('SAVES_PATH') or '.')
+
+
+def _absolute(path: str) -> str:
+    '''
+    returns path made absolute, None if it is not set
+    '''
+    return os.path.abspath(path) if path else None
 
 
 class DataClerk:
@@ -36,28 +78,50 @@ class DataClerk:
         - cfg (dict)
         - data (pandas.DataFrame)
 
+    The data of all experiments are held within a memory budget: they are
+    stored with compact dtypes, and the least recently used ones are
+    spilled to disk and loaded again when accessed (see ExperimentRegistry).
+
     Also stores paths to relevant directories
 
     Attributes:
-        experiments(dict): 
+        experiments(ExperimentRegistry): name -> experiment dict
         df(pd.DataFrame): Stores all time-based data
         data_dict(dict): Stores all data that were created during the simulation and are not cleary time dependent 
-        year(int): All data will be unified in its year
+        year(int): year of runs whose config has no start_year, see run_year
         weather_file(str): path to weather file used in the simulation
-        outpath(str): path where run outputs are stored
+        outpath(str): path where run outputs are stored, SAVES_PATH or the working directory
+        cache(FrameCache): on-disk cache of parsed output and weather files, None if disabled
+        store(ExperimentStore): columnar on-disk store of experiment data
+        _weather(dict): (epw file, drops, year) -> (file stamp, weather frame, location -> stored partition)
+            shared by all runs at a location
         _vars(List[str]): list of global variables
         _dirs(List[str]): list of current directories in the output directory
     '''
 
-    def __init__(self, year=2020):
+    def __init__(self, year=2020, use_cache=True, cache_size=2*1024**3, memory_budget=2*1024**3):
+
+        load_env()
+
+        # absolute, as the run workers change their working directory, see utils.run_utils.simulate
+        self.config_path = _absolute(os.environ.get('CONFIG_PATH'))
+        self.weather_path = _absolute(os.environ.get('WEATHER_PATH'))
+        self.idf_path = _absolute(os.environ.get('IDF_PATH'))
+        self.out_path = saves_path()
 
-        self.config_path = os.environ.get('CONFIG_PATH')
-        self.weather_path = os.environ.get('WEATHER_PATH')
-        self.idf_path = os.environ.get('IDF_PATH')
-        self.out_path = os.environ.get('SAVES_PATH')
+        self.cache = None
+        if use_cache:
+            cache_path = os.environ.get('CACHE_PATH') or os.path.join(self.out_path, '.cache')
+            self.cache = FrameCache(cache_path, max_bytes=cache_size)
 
-        self.experiments = {}
+        self.store = ExperimentStore(os.environ.get('STORE_PATH') or os.path.join(self.out_path, 'store'))
+
+        # MEMORY_BUDGET in .env overrides the default budget, in bytes
+        memory_budget = int(os.environ.get('MEMORY_BUDGET') or memory_budget)
+        spill_path = os.environ.get('SPILL_PATH') or os.path.join(self.out_path, '.spill')
+        self.experiments = ExperimentRegistry(spill_path, max_bytes=memory_budget)
         self.curr_experiment = None
+        self._weather = {}
 
         self.data_dict = {'simulations': [], 'quantities': set()}
         self.year = year
@@ -66,35 +130,44 @@ class DataClerk:
         self._dirs = os.listdir(self.out_path)
 
 
-    def setup_cfg(self, cfg_file : str) -> AttrDict:
+    def setup_cfg(self, cfg_file) -> AttrDict:
         '''
         Returns cfg AttrDict from yaml file. Also sets up the facilities to store results
         in self.experiments
+
+        Args:
+            cfg_file(str or dict): yaml file or config generated by utils.sweep_utils.expand_sweep
         '''
 
-        cfg = os.path.join(self.config_path, cfg_file)
+        if isinstance(cfg_file, dict):
+            cfg = AttrDict(cfg_file)
+            name = cfg['name']
+            # generated configs point to the spec of their sweep
+            source = cfg.get('sweep', {}).get('name', name) + '.yml'
 
-        if cfg_file.endswith('.yml') or cfg_file.endswith('.yaml'):
+        elif cfg_file.endswith('.yml') or cfg_file.endswith('.yaml'):
+            cfg = os.path.join(self.config_path, cfg_file)
             cfg = yaml.safe_load(Path(cfg).read_text())
             cfg = AttrDict(cfg)
+
+            if '/' in cfg_file: 
+                name = cfg_file.split('/')[-1]
+            elif '\\' in cfg_file:
+                name = cfg_file.split('\\')[-1]
+            else:
+                name = cfg_file
+            name = name.split('.')[0]
+            source = name + '.yml'
+
         else:
             raise NotImplementedError('Currently only yaml config files are supported')
 
-        if '/' in cfg_file: 
-            name = cfg_file.split('/')[-1]
-        elif '\\' in cfg_file:
-            name = cfg_file.split('\\')[-1]
-        else:
-            name = cfg_file
-        name = name.split('.')[0]
         cfg['name'] = name
         cfg['out_dir'] = os.path.join(self.out_path, name)
         cfg['idf_path'] = self.idf_path
         cfg['weather_path'] = self.weather_path
 
-        self.experiments[name] = AttrDict({})
-        self.experiments[name]['cfg_file'] = name + '.yml'
-        self.experiments[name]['cfg'] = cfg
+        self.experiments[name] = {'cfg_file': source, 'cfg': cfg}
 
         self.curr_experiment = name 
 
@@ -127,9 +200,9 @@ class DataClerk:
             print(df.head())
 
 
-    def report(self, all=False, with_head=False):
+    def report(self, all=False, with_head=False, name=None):
         '''
-        prints current self.df
+        prints current self.df, of experiment name instead of the current one if given
         '''
         print('Current data:')
 
@@ -138,7 +211,7 @@ class DataClerk:
         if all:
             keys = list(self.experiments)
         else: 
-            keys = [self.curr_experiment]
+            keys = [name or self.curr_experiment]
 
         for key in keys:
             df = self.experiments[key]['data']
@@ -149,6 +222,10 @@ class DataClerk:
             if with_head:
                 print(df.head())
 
+        usage = self.experiments.memory_usage().reindex(keys)
+        print(f'memory usage in MB (budget {self.experiments.max_bytes / 1024**2:.0f}MB):')
+        print((usage.bytes / 1024**2).round(1).to_string())
+
 
 
     def gather_and_store_output(self, cfg) -> None:
@@ -169,35 +246,142 @@ class DataClerk:
         print(cfg)
         path = os.path.join(self.out_path, cfg.out_dir)
 
-        files = os.listdir(path)
-        files = [os.path.join(path, file) for file in files]
-        file = [file for file in files if file.endswith('.mtr')][0]
+        # output_reader: sql reads the series in output_series (all meters if not given)
+        # from eplusout.sql, see build_model; eso reads them (all if not given) from
+        # eplusout.eso; mtr (default) parses the .mtr file
+        reader = cfg.get('output_reader', 'mtr')
+        year = self.run_year(cfg)
+        if reader == 'eso':
+            with span('parse_eso', run=cfg.name) as timer:
+                frames = self.gather_eso(os.path.join(path, 'eplusout.eso'), names=cfg.get('output_series'),
+                                         year=year)
+                timer.set(rows=sum(len(frame) for frame in frames.values()),
+                          columns=sum(len(frame.columns) for frame in frames.values()))
+
+            # series reported every timestep or hour join the experiment data, those
+            # of other frequencies are kept on their own grid in 'output_frames'
+            df = None
+            for frequency in ('TimeStep', 'Hourly'):
+                if frequency in frames:
+                    frame = frames.pop(frequency)
+                    df = frame if df is None else align(df, frame, year=year)
+            self.experiments[cfg.name]['output_frames'] = {
+                frequency: frame.add_prefix('output_') for frequency, frame in frames.items()}
+            if df is None:
+                return
+
+        elif reader == 'sql':
+            with span('parse_sql', run=cfg.name) as timer:
+                df = self.gather_sql(os.path.join(path, 'eplusout.sql'), names=cfg.get('output_series'), year=year)
+                timer.set(rows=len(df), columns=len(df.columns))
+
+        elif reader == 'mtr':
+            files = os.listdir(path)
+            files = [os.path.join(path, file) for file in files]
+            file = [file for file in files if file.endswith('.mtr')][0]
+
+            with span('parse_mtr', run=cfg.name) as timer:
+                df = self.gather_output(os.path.join(path, file), year=year)
+                timer.set(rows=len(df), columns=len(df.columns))
 
-        df = self.gather_output(os.path.join(path, file))
+        else:
+            raise ValueError(f'Unknown output_reader {reader!r} of {cfg.name}; choose mtr, sql or eso')
 
 
-        renames = {col: 'output_'+col for col in df.columns if ':' in col}
+        # report variables have no ':' in their names, unlike meters
+        renames = {col: 'output_'+col for col in df.columns if ':' in col or reader != 'mtr'}
         df.rename(columns=renames, inplace=True)
 
-        df['time_tuple'] = df.apply(lambda row: (row.name.month, 
-                                    row.name.day, row.name.hour), axis=1)            
+        with span('merge', run=cfg.name) as timer:
+            if exp_df is None:
+                exp_df = df
+            else:
+                exp_df = align(df, exp_df, year=year)
+
+            self.experiments[cfg.name]['data'] = exp_df
+            timer.set(rows=len(exp_df))
+
+
+    def run_year(self, cfg) -> int:
+        '''
+        returns the year the run of cfg starts in: its start_year, self.year if it has none
+        '''
+        return int(cfg.get('start_year') or self.year)
 
-        if exp_df is None:
-            exp_df = df
-        else:
-            exp_df = df.merge(exp_df, on='time_tuple', how='inner')
 
-        if not isinstance(exp_df.index[0], pd.Timestamp):
-            exp_df = self.index_as_timestamp(exp_df)
+    def gather_output(self, path: str = None, year=None) -> pd.DataFrame:
+        '''
+        obtains data from all .mtr files in path and returns them as a pd.DataFrame,
+        starting in year (self.year if None);
+        parsed files are taken from self.cache if their content has been seen before
+        '''
+        path = path or self.outpath
+        year = year or self.year
+        if self.cache is None:
+            return mtr2df(path, year=year)
 
-        self.experiments[cfg.name]['data'] = exp_df
+        return self.cache.cached(path, mtr2df, MTR2DF_VERSION, year=year)
 
 
-    def gather_output(self, path: str = None) -> pd.DataFrame:
+    def gather_eso(self, path: str, names=None, year=None) -> dict:
         '''
-        obtains data from all .mtr files in path and returns them as a pd.DataFrame
+        Reads the series names (meters or variables, all if None) from the eplusout.eso
+        at path and returns one frame per reporting frequency, see utils.eso_utils.eso2df
         '''
-        return  mtr2df(path or self.outpath)
+        return eso2df(path, names=None if names is None else list(names), year=year or self.year)
+
+
+    def gather_sql(self, path: str, names=None, year=None) -> pd.DataFrame:
+        '''
+        Reads the series names (meters or variables) from the eplusout.sql at path,
+        all meters if names is None. Only the requested series are queried, so
+        the file is not cached.
+        '''
+        year = year or self.year
+        if names is None:
+            return sql2df(path, year=year, meters_only=True)
+
+        return sql2df(path, names=list(names), year=year)
+
+
+    def stream_output(self, cfg, chunk_rows=1008, poll_interval=1.) -> OutputStream:
+        '''
+        Returns an OutputStream that appends the meter output of cfg to self.store
+        while the simulation is running. The weather gathered before by
+        gather_and_store_weather is stored once per location and referenced,
+        as by to_store. Use it as context manager around the simulation or
+        poll it, and call finish_stream once the run is done.
+
+        An eplusout.mtr left in cfg.out_dir by an earlier run is removed, so only
+        the output of the coming run is ingested.
+
+        Args:
+            cfg(AttrDict): current experiment config
+            chunk_rows(int): minimum number of timesteps appended to the store at once
+            poll_interval(float): seconds between polls when used as context manager
+        '''
+        filename = os.path.join(cfg.out_dir, 'eplusout.mtr')
+        if os.path.exists(filename):
+            os.remove(filename)
+
+        exp_dict = self.experiments.get(cfg.name, {})
+        data = exp_dict.get('data')
+        weather = self._weather_reference(cfg.location, exp_dict.get('weather'),
+                                          data.columns if data is not None else [])
+
+        return OutputStream(filename, self.store, cfg.name, cfg=cfg, weather=weather, year=self.run_year(cfg),
+                            chunk_rows=chunk_rows, poll_interval=poll_interval)
+
+
+    def finish_stream(self, cfg, stream: OutputStream) -> None:
+        '''
+        closes stream after the run of cfg succeeded and takes the stored data
+        into self.experiments, as gather_and_store_output would
+        '''
+        with span('finish_stream', run=cfg.name) as timer:
+            timer.set(rows=stream.close(), chunks=stream.chunks)
+            self.experiments[cfg.name]['data'] = self.store.read(cfg.name, building_type=cfg.get('building_type'),
+                                                                 location=cfg.get('location'))
 
 
     def gather_and_store_weather(self, cfg, drops=['data_source_unct']):
@@ -210,48 +394,137 @@ class DataClerk:
         '''
         
         try:
-            df = self.experiments[self.curr_experiment]['data']
+            df = self.experiments[cfg.name]['data']
         except KeyError:
             df = None
 
         # used to match weather data to simulation output data
         print(cfg.location)
-        epw_path = os.path.join(self.weather_path, weather_dict[cfg.location])
-        epw_df = self.gather_weather(epw_path)
-        epw_df['time_tuple'] = epw_df.apply(lambda row: (row.month, row.day, row.hour), axis=1)
-        epw_df = epw_df.drop(drops, axis=1)
+        with span('weather', run=cfg.name) as timer:
+            year = self.run_year(cfg)
+            epw_df = self.location_weather(cfg.location, drops=drops, year=year)
+            # referenced by to_store, which stores the weather once per location
+            self.experiments[cfg.name]['weather'] = self._weather_key(cfg.location, drops, year)
 
-        if df is None:
-            df = epw_df
-        else:
-            df = df.merge(epw_df, on='time_tuple', how='inner')
+            if df is None:
+                df = epw_df
+            else:
+                df = align(df, epw_df, year=year)
 
-        if not isinstance(df.index[0], pd.Timestamp):
-            df = self.index_as_timestamp(df)
-        
-        # add weekday if necessary
-        if not 'weekday' in df.columns:
-            df['weekday'] = df.index.map(lambda x: x.weekday())
+            # add weekday if necessary
+            if not 'weekday' in df.columns:
+                df['weekday'] = df.index.weekday
 
-        self.experiments[self.curr_experiment]['data'] = df
+            self.experiments[cfg.name]['data'] = df
+            timer.set(rows=len(df))
 
 
 
-    def gather_weather(self, epw_path : str, data=[]) -> pd.DataFrame:
+    def location_weather(self, location: str, drops=['data_source_unct'], year=None) -> pd.DataFrame:
         '''
-        adds weather data to self.df
+        Returns the timestamp indexed weather of location with a weekday column
+
+        The epw file is parsed once per location and only for the columns
+        not in drops; all later runs at the location share the frame until
+        the file changes, so it must not be modified in place. Files of one
+        year (typical years) are placed in year; files of several years
+        keep the years of their records.
+
+        Args:
+            location(str): key of config.weather_dict
+            drops(List[str]): name of columns that are not read
+            year(int): year of the runs, self.year if None
         '''
+        year = year or self.year
+        epw_path = os.path.join(self.weather_path, weather_dict[location])
+        stat = os.stat(epw_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        key = (epw_path, tuple(drops), year)
+
+        if key in self._weather and self._weather[key][0] == stamp:
+            return self._weather[key][1]
+
+        df = self.gather_weather(epw_path, columns=[col for col in EPW_COLUMNS if col not in drops])
+        df = self.index_as_timestamp(df, year=year)
+        df['weekday'] = df.index.weekday
+
+        self._weather[key] = (stamp, df, {})
+
+        return df
+
 
-        return read_epw(epw_path)[0]
+    def _weather_key(self, location: str, drops, year) -> tuple:
+        return (os.path.join(self.weather_path, weather_dict[location]), tuple(drops), year)
 
 
-    def index_as_timestamp(self, df):
+    def store_weather(self, location: str, key: tuple) -> str:
         '''
-        sets index to datetime type
+        Writes the weather parsed for key (see location_weather) to self.store
+        unless it is there already, keyed by the content of the epw file, its
+        columns and year
+
+        Returns:
+            str: path of the weather partition, see ExperimentStore.write_weather
+        '''
+        stamp, df, stored = self._weather[key]
+        if location in stored:
+            return stored[location]
+
+        epw_path, drops, year = key
+        digest = file_hash(epw_path)[:16]
+        years = 'native' if len(df) > EPW_YEAR_RECORDS else year
+        columns = '-'.join(sorted(drops)) or 'all'
+        stored[location] = self.store.write_weather(location, compact(df), f'{digest}-{years}-{columns}')
+
+        return stored[location]
+
+
+    def _weather_reference(self, location: str, key: tuple, columns) -> dict:
+        '''
+        returns the reference to the stored weather of key (see store_weather) for the
+        columns taken from it, as ExperimentStore.write expects; None if no weather was parsed
         '''
-        df['timestamp'] = df.apply(lambda row: 
-                pd.Timestamp(datetime(self.year, row.month, row.day, row.hour)), axis=1)
-        df.set_index('timestamp', inplace=True)
+        if key not in self._weather:
+            return None
+
+        return {'path': self.store_weather(location, key),
+                'columns': [col for col in self._weather[key][1].columns if col in columns]}
+
+
+    def weather_header(self, location: str) -> dict:
+        '''
+        returns the header of the epw file of location: coordinates and time zone,
+        design conditions, ground temperatures etc., see utils.epw_utils.read_epw_header
+        '''
+        return read_epw_header(os.path.join(self.weather_path, weather_dict[location]))
+
+
+    def gather_weather(self, epw_path : str, data=[], columns=None) -> pd.DataFrame:
+        '''
+        adds weather data to self.df, only columns of the epw file if given
+        parsed files are taken from self.cache if their content has been seen before
+        '''
+        if self.cache is None:
+            return read_epw_data(epw_path, columns=columns)
+
+        return self.cache.cached(epw_path, read_epw_data, EPW_PARSER_VERSION, columns=columns)
+
+
+    def index_as_timestamp(self, df, year=None):
+        '''
+        sets index to datetime type in year (self.year if None), computed from the
+        month, day and hour (1 to 24, hour ending) columns of an epw frame;
+        frames of more than one year keep the years of their records
+        '''
+        year = year or self.year
+        if len(df) > EPW_YEAR_RECORDS:
+            return df.set_axis(fields_to_index(df.year, df.month, df.day, df.hour - 1), axis=0)
+
+        if not calendar.isleap(year):
+            df = df.loc[~((df.month == 2) & (df.day == 29))]
+
+        keys = hour_of_year(df.month, df.day, df.hour, year)
+        df = df.set_axis(keys_to_index(keys, year), axis=0)
 
         return df
 
@@ -272,6 +545,9 @@ class DataClerk:
         if columns == 'all':
             columns = self.data_dict['quantities']
 
+        import matplotlib.pyplot as plt
+        plt.style.use('bmh')
+
         num_cols = len(columns)
 
         x = self.df.index
@@ -306,10 +582,43 @@ class DataClerk:
 
         if all:
             for name, exp_dict in self.experiments.items():
-                exp_dict['data'].to_csv(os.path.join(self.out_path, name+'.csv'))
+                with span('to_csv', run=name) as timer:
+                    widen(exp_dict['data']).to_csv(os.path.join(self.out_path, name+'.csv'))
+                    timer.set(rows=len(exp_dict['data']))
 
         else:
             name = self.curr_experiment
             exp_dict = self.experiments[name]
-            exp_dict['data'].to_csv(os.path.join(self.out_path, name+'.csv'))
-            
+            with span('to_csv', run=name) as timer:
+                widen(exp_dict['data']).to_csv(os.path.join(self.out_path, name+'.csv'))
+                timer.set(rows=len(exp_dict['data']))
+
+
+    def to_store(self, all=False, name=None):
+        '''
+        writes experimental data to self.store, partitioned by building type and location
+
+        Args:
+            all(bool): only current experiment if False
+            name(str): experiment written instead of the current one
+        '''
+
+        names = list(self.experiments) if all else [name or self.curr_experiment]
+
+        for name in names:
+            exp_dict = self.experiments[name]
+            df = widen(exp_dict['data'])
+            with span('to_store', run=name) as timer:
+                # the weather is stored once per location and referenced by the experiment
+                weather = self._weather_reference(exp_dict['cfg'].location, exp_dict.get('weather'), df.columns)
+                self.store.write(name, df, cfg=exp_dict['cfg'], weather=weather)
+                timer.set(rows=len(df))
+
+
+    def panel(self, names=None, columns=None, start=None, end=None, building_type=None, location=None):
+        '''
+        Returns the stored experiments (all, or names) as long-format panel with the weather
+        of every location held once, see ExperimentStore.read_panel and utils.panel_utils
+        '''
+        return self.store.read_panel(names=names, columns=columns, start=start, end=end,
+                                     building_type=building_type, location=location)
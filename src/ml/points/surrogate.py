@@ -0,0 +1,145 @@
+import os
+import joblib
+import numpy as np
+import pandas as pd
+
+from ml.points.training import weekend_indicator, WORKDAYS
+
+
+class SurrogateBundle:
+    '''
+    Point surrogate models of all targets of one experiment together with
+    the preprocessing they were trained with.
+
+    Inputs are given in raw units (as stored in the ExperimentStore); the
+    bundle standardizes them, evaluates every target model and returns
+    the predictions in raw units again. Rows are scored in chunks, so
+    millions of (weather, calendar, setpoint) rows can be passed at once.
+
+    Attributes:
+        models(dict): target -> fitted regressor
+        features(List[str]): feature columns in the order the models expect
+        targets(List[str]): target columns
+        scaling(dict): column -> (mean, std) used for standardization of features and targets
+        meta(dict): additional information, e.g. the training summary
+        workdays(List[int]): weekdays the models were trained to see as workdays, see weekend_indicator
+    '''
+
+    # features that are not observable at inference time and set to their mean
+    baseline_features = ['noise']
+
+    # bundles saved without workdays were trained with Tuesday to Saturday as workdays
+    workdays = [1, 2, 3, 4, 5]
+
+    def __init__(self, models, features, targets, scaling, meta=None, workdays=WORKDAYS):
+
+        self.models = models
+        self.features = list(features)
+        self.targets = list(targets)
+        self.scaling = scaling
+        self.meta = meta or {}
+        self.workdays = list(workdays)
+
+        self._mean = np.array([scaling.get(col, (0., 1.))[0] for col in self.features])
+        self._std = np.array([scaling.get(col, (0., 1.))[1] for col in self.features])
+
+
+    def save(self, path: str) -> None:
+        '''
+        writes the bundle to path
+        '''
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        joblib.dump(self, path)
+
+
+    @classmethod
+    def load(cls, path: str):
+        '''
+        reads a bundle written by SurrogateBundle.save
+        '''
+        return joblib.load(path)
+
+
+    def transform(self, X) -> np.ndarray:
+        '''
+        Returns the standardized feature matrix of raw inputs X
+
+        Args:
+            X(pd.DataFrame or np.ndarray): raw inputs; arrays must have the columns of self.features
+        '''
+        if isinstance(X, pd.DataFrame):
+            columns = []
+            for col in self.features:
+                if col in X.columns:
+                    values = X[col].to_numpy(dtype=float)
+                    if col == 'weekday':
+                        values = weekend_indicator(values, self.workdays)
+                elif col in self.baseline_features:
+                    values = np.full(len(X), self.scaling.get(col, (0., 1.))[0])
+                else:
+                    raise KeyError(f'Surrogate needs input column {col}')
+                columns.append(values)
+            X = np.column_stack(columns)
+        else:
+            X = np.array(X, dtype=float)
+            if 'weekday' in self.features:
+                i = self.features.index('weekday')
+                X[:, i] = weekend_indicator(X[:, i], self.workdays)
+
+        return (X - self._mean) / self._std
+
+
+    def predict(self, X, targets=None, chunk_size=2**18) -> np.ndarray:
+        '''
+        Predicts all targets for every row of X
+
+        Args:
+            X(pd.DataFrame or np.ndarray): raw inputs, see SurrogateBundle.transform
+            targets(List[str]): targets to be predicted, all if None
+            chunk_size(int): number of rows standardized and scored at once
+
+        Returns:
+            np.ndarray of shape (len(X), len(targets)) in raw target units
+        '''
+        targets = targets or self.targets
+        n_rows = len(X)
+        out = np.empty((n_rows, len(targets)))
+
+        for start in range(0, n_rows, chunk_size):
+            chunk = X.iloc[start:start+chunk_size] if isinstance(X, pd.DataFrame) \
+                else X[start:start+chunk_size]
+            features = self.transform(chunk)
+
+            for j, target in enumerate(targets):
+                out[start:start+chunk_size, j] = self.models[target].predict(features)
+
+        mean = np.array([self.scaling.get(target, (0., 1.))[0] for target in targets])
+        std = np.array([self.scaling.get(target, (0., 1.))[1] for target in targets])
+
+        return out * std + mean
+
+
+    def predict_frame(self, X, targets=None, **kwargs) -> pd.DataFrame:
+        '''
+        Same as SurrogateBundle.predict, returned as pd.DataFrame with one column per target
+        '''
+        targets = targets or self.targets
+        index = X.index if isinstance(X, pd.DataFrame) else None
+
+        return pd.DataFrame(self.predict(X, targets=targets, **kwargs), columns=targets, index=index)
+
+
+# bundles that were loaded in this process, keyed by (absolute path, modification time)
+_bundles = {}
+
+
+def load_bundle(path: str) -> SurrogateBundle:
+    '''
+    Returns the bundle stored at path, keeping it in memory for subsequent calls
+    so that optimization loops do not pay for deserialization
+    '''
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _bundles:
+        _bundles[key] = SurrogateBundle.load(path)
+
+    return _bundles[key]
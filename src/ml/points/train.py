@@ -1,73 +1,50 @@
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.metrics import r2_score
-from sklearn.model_selection import KFold
-from sklearn.model_selection import cross_val_score
-
-from tqdm import tqdm
 import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 plt.style.use('bmh')
 import os
-os.chdir(os.path.join(os.getcwd(), '..', '..'))
-
-run_name = 'run1_boiler'
-data = os.path.join(os.getcwd(), 'saves', run_name+'.csv')
-data = pd.read_csv(data, parse_dates=True, index_col=0)
-data['noise'] = pd.Series(np.random.normal(size=len(data)), index=data.index)
-data.drop(columns=['time_tuple', 'year', 'minute'], inplace=True)
+import sys
+from pathlib import Path
 
-workdays = [1, 2, 3, 4, 5]
-data['weekday'] = data.weekday.apply(lambda day: 0. if day in workdays else 1.)
+SRC = Path(__file__).resolve().parents[2]
+sys.path.append(str(SRC))
 
-# remove non-varying entries
-for feature in data.columns:
-    if feature == 'month':
-        continue
+from utils.store_utils import ExperimentStore
+from ml.points.training import prepare_data, train_surrogates, write_summary
+from ml.points.surrogate import SurrogateBundle
 
-    std = data[feature].to_numpy().std()
-    if std == 0.:
-        data.drop(columns=[feature], inplace=True)
-    else:
-        col = data[feature].to_numpy()
-        data[feature] =  pd.Series((col - col.mean()) / col.std(), index=data.index) 
+run_name = 'run1_boiler'
+store = ExperimentStore(os.path.join(SRC, 'saves', 'store'))
+data = store.read(run_name)
 
-targets = [col for col in data.columns if col.startswith('output')]
-features = [col for col in data.columns if not col.startswith('output')]
+data, features, targets, scaling = prepare_data(data)
 
 val_month = 11
 n_splits = 10
 
-for target in tqdm(targets):
-    print(f'Training model for target {target}.')
+# cross validation folds are blocked by month, all folds and targets are trained in parallel
+models, summary = train_surrogates(data, features, targets, 
+                                   estimator='hist', 
+                                   n_splits=n_splits, 
+                                   val_month=val_month)
 
-    # take November as testing data
-    X_val = data.loc[data.month == val_month][features]
-    y_val = data.loc[data.month == val_month][target]
-    X_traintest = data.loc[data.month != val_month][features]
-    y_traintest = data.loc[data.month != val_month][target]
+write_summary(summary, os.path.join(SRC, 'saves', run_name+'_training.json'))
 
-    cv = KFold(n_splits=n_splits, random_state=1, shuffle=True)
-    model = GradientBoostingRegressor()
+# keep models with their preprocessing for fast inference, see ml.points.surrogate.load_bundle
+bundle = SurrogateBundle(models, features, targets, scaling, meta={'run': run_name, 'training': summary})
+bundle.save(os.path.join(SRC, 'saves', 'surrogates', run_name+'.joblib'))
+print(f'Trained {len(targets)} targets in {summary["wall_time"]:.1f}s')
 
-    scores = cross_val_score(model, X_traintest, y_traintest, scoring='r2', cv=cv)
-    print('R2 score for {}-fold CV: {} ({})'.format(n_splits, np.mean(scores), np.std(scores)))
+for target in targets:
+    scores = summary['targets'][target]
+    print(f'Target {target}:')
+    print('R2 score for {}-fold CV: {} ({})'.format(summary['n_splits'], scores['cv_r2_mean'], scores['cv_r2_std']))
+    print(f'R2 on validation set: {scores["val_r2"]}')
 
-    X_val, y_val = X_traintest, y_traintest
-
-    model.fit(X_traintest, y_traintest)
-    pred = model.predict(X_val)
-    print(f'R2 on validation set: {r2_score(y_val, pred)}')
+    X_val = data.loc[data.month == val_month][features]
+    y_val = data.loc[data.month == val_month][target]
+    pred = models[target].predict(X_val.to_numpy())
 
     fig, ax = plt.subplots(1, 1, figsize=(16, 4))
-    pd.DataFrame({'ground truth': y_val, 'prediction': pred}).plot(ax=ax)
+    pd.DataFrame({'ground truth': y_val, 'prediction': pred}, index=y_val.index).plot(ax=ax)
     ax.legend()
-    ax.set_xlim(pd.Timestamp('2020-01-01'), pd.Timestamp('2020-03-01'))
     plt.show()
-    
-
-
-
-
-
-
@@ -0,0 +1,180 @@
+import json
+import time
+from itertools import product
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.metrics import r2_score
+from sklearn.model_selection import GroupKFold
+
+
+ESTIMATORS = {
+    'gbr': GradientBoostingRegressor,
+    'hist': HistGradientBoostingRegressor,
+}
+
+# columns of the experiment frames that are not used as features
+DROPS = ['year', 'minute']
+# weekdays (0 = Monday) that are workdays
+WORKDAYS = [0, 1, 2, 3, 4]
+
+
+def prepare_data(data: pd.DataFrame, noise=True, seed=None):
+    '''
+    Turns experiment data into standardized features and targets
+
+    Constant columns are removed, all others except 'month' are
+    standardized; weekday becomes a 0/1 weekend indicator.
+
+    Args:
+        data(pd.DataFrame): experiment data as read from the ExperimentStore
+        noise(bool): adds a standard normal 'noise' feature as a baseline
+        seed(int): seed of the noise feature
+
+    Returns:
+        data(pd.DataFrame): prepared data
+        features(List[str]): feature columns
+        targets(List[str]): target columns ('output_*')
+        scaling(dict): column -> (mean, std) used for standardization
+    '''
+    data = data.drop(columns=[col for col in DROPS if col in data.columns])
+
+    if noise:
+        data['noise'] = np.random.default_rng(seed).normal(size=len(data))
+
+    data['weekday'] = weekend_indicator(data.weekday)
+
+    scaling = {}
+    for feature in list(data.columns):
+        if feature == 'month':
+            continue
+
+        col = data[feature].to_numpy(dtype=float)
+        std = col.std()
+        if std == 0.:
+            data = data.drop(columns=[feature])
+        else:
+            scaling[feature] = (float(col.mean()), float(std))
+            data[feature] = (col - col.mean()) / std
+
+    targets = [col for col in data.columns if col.startswith('output')]
+    features = [col for col in data.columns if not col.startswith('output')]
+
+    return data, features, targets, scaling
+
+
+def weekend_indicator(weekday, workdays=WORKDAYS) -> np.ndarray:
+    '''
+    maps weekdays (0 = Monday) to 0 for workdays and 1 for Saturday and Sunday
+    '''
+    return (~np.isin(np.asarray(weekday), workdays)).astype(float)
+
+
+def blocked_splits(blocks: np.ndarray, n_splits: int) -> list:
+    '''
+    Returns cross validation splits that keep each block (e.g. month) in one fold,
+    so that the test data are never interleaved hour by hour with the training data
+    '''
+    n_splits = min(n_splits, len(np.unique(blocks)))
+    return list(GroupKFold(n_splits=n_splits).split(blocks, groups=blocks))
+
+
+def _fit_score(estimator, X, Y, i, train, test):
+    '''
+    fits a copy of estimator on X[train] to target i and returns its r2 on X[test],
+    or the fitted model if test is None
+    '''
+    start = time.perf_counter()
+    y = Y[:, i]
+    model = clone(estimator).fit(X[train], y[train])
+
+    if test is None:
+        return model, time.perf_counter() - start
+    return r2_score(y[test], model.predict(X[test])), time.perf_counter() - start
+
+
+def train_surrogates(data: pd.DataFrame, features: list, targets: list,
+                     estimator='hist', n_splits=10, val_month=11,
+                     blocks='month', n_jobs=-1, **estimator_kwargs):
+    '''
+    Trains one model per target with blocked cross validation, in parallel over
+    all (target, fold) pairs and the final fits.
+
+    Features and targets are converted to one numpy array each before the
+    tasks are dispatched; joblib memory maps arrays of that size into the
+    workers instead of pickling them for every task.
+
+    Args:
+        data(pd.DataFrame): prepared data, see prepare_data
+        features(List[str]): feature columns
+        targets(List[str]): target columns
+        estimator(str): 'hist' (HistGradientBoostingRegressor) or 'gbr' (GradientBoostingRegressor)
+        n_splits(int): number of cross validation folds
+        val_month(int): month held out for validation, None to validate on the training data
+        blocks(str): column defining the blocks kept together in cross validation
+        n_jobs(int): number of worker processes, -1 for all cores
+        estimator_kwargs: passed to the estimator
+
+    Returns:
+        models(dict): target -> model fitted on all but val_month
+        summary(dict): machine readable wall clock time and per target scores
+    '''
+    start = time.perf_counter()
+    base = ESTIMATORS[estimator](**estimator_kwargs)
+
+    X = np.ascontiguousarray(data[features].to_numpy(dtype=np.float64))
+    Y = np.ascontiguousarray(data[targets].to_numpy(dtype=np.float64))
+
+    is_val = (data.month == val_month).to_numpy() if val_month is not None \
+        else np.zeros(len(data), dtype=bool)
+    traintest = np.flatnonzero(~is_val)
+    val = np.flatnonzero(is_val) if is_val.any() else traintest
+
+    splits = blocked_splits(data[blocks].to_numpy()[traintest], n_splits)
+
+    # cross validation tasks of all targets, followed by the final fit of each target
+    tasks = [(i, traintest[train], traintest[test])
+             for i, (train, test) in product(range(len(targets)), splits)]
+    tasks += [(i, traintest, None) for i in range(len(targets))]
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_score)(base, X, Y, i, train, test) for i, train, test in tasks
+    )
+
+    models = {}
+    summary = {'estimator': estimator,
+               'estimator_kwargs': estimator_kwargs,
+               'n_splits': len(splits),
+               'val_month': val_month,
+               'features': features,
+               'targets': {}}
+
+    for target in targets:
+        summary['targets'][target] = {'cv_r2': [], 'fit_time': 0.}
+
+    for (i, _, test), (result, fit_time) in zip(tasks, results):
+        entry = summary['targets'][targets[i]]
+        entry['fit_time'] += fit_time
+        if test is None:
+            models[targets[i]] = result
+            entry['val_r2'] = float(r2_score(Y[val, i], result.predict(X[val])))
+        else:
+            entry['cv_r2'].append(float(result))
+
+    for entry in summary['targets'].values():
+        entry['cv_r2_mean'] = float(np.mean(entry['cv_r2']))
+        entry['cv_r2_std'] = float(np.std(entry['cv_r2']))
+
+    summary['wall_time'] = time.perf_counter() - start
+
+    return models, summary
+
+
+def write_summary(summary: dict, path: str) -> None:
+    '''
+    writes the summary returned by train_surrogates as json
+    '''
+    with open(path, 'w') as file:
+        json.dump(summary, file, indent=2)
@@ -0,0 +1,433 @@
+'''
+Command line entry point of the simulation, data and surrogate pipeline
+
+    python -m stes run runs/run1.yml --workers 4
+    python -m stes run --sweep sweeps/setpoints.yml --workers 8 --timeout 3600
+    python -m stes run --sweep sweeps/buildings.yml --simulator local --latency 0.5
+    python -m stes run --sweep sweeps/setpoints.yml --workers 8 --stream
+    python -m stes run --sweep sweeps/setpoints.yml --workers 8 --profile batch.trace.json
+    python -m stes ingest runs/run1.yml
+    python -m stes queue submit /shared/queue --sweep sweeps/setpoints.yml
+    python -m stes queue work /shared/queue
+    python -m stes queue status /shared/queue --watch 60
+    python -m stes train run1_boiler
+    python -m stes predict saves/surrogates/run1_boiler.joblib inputs.csv -o predictions.csv
+    python -m stes storage run1_boiler sweeps/storage.yml -o storage.csv
+    python -m stes bench --scale medium
+    python -m stes check-startup
+
+Installing the package (pip install -e .) provides the same commands as
+`stes run ...` and so on.
+
+Only argparse is imported at module level. Every subcommand imports the
+subsystems it needs when it is invoked, so `stes --help` and processes
+that only parse outputs do not load EnergyPlus, plotting or machine
+learning libraries. check-startup measures this and fails if the startup
+time exceeds its budget or a heavy library is imported too early.
+'''
+import os
+import sys
+import argparse
+
+
+# seconds the CLI may add to the bare interpreter startup
+STARTUP_BUDGET = 0.15
+
+# libraries that must only be imported by the subcommands that use them
+HEAVY_MODULES = ['besos', 'eppy', 'matplotlib', 'pvlib', 'sklearn', 'joblib']
+
+# modules that are imported by processes which only parse and store outputs
+LIGHT_IMPORTS = ['stes', 'dataclerk', 'basic_run', 'utils.run_utils', 'utils.pipeline_utils',
+                 'utils.queue_utils', 'utils.idf_utils']
+
+
+def _cfg_files(args):
+    '''
+    returns the run configs given as files and the configs of all sweeps, lazily
+    '''
+    from itertools import chain
+
+    sweeps = []
+    if args.sweep:
+        from utils.sweep_utils import expand_sweep
+        sweeps = [expand_sweep(spec) for spec in args.sweep]
+
+    return chain(args.cfgs, *sweeps)
+
+
+def _saves_path() -> str:
+    '''
+    returns the directory of outputs and the store as DataClerk uses it, see dataclerk.saves_path
+    '''
+    from dataclerk import load_env, saves_path
+
+    load_env()
+    return saves_path()
+
+
+def _simulator(args):
+    '''
+    returns the simulator chosen by --simulator, --latency and --sqlite
+    '''
+    from utils.sim_utils import get_simulator
+
+    kwargs = {}
+    if args.simulator == 'local':
+        latency = args.latency or [0.]
+        kwargs = {'latency': latency[0] if len(latency) == 1 else tuple(latency), 'sqlite': args.sqlite}
+
+    return get_simulator(args.simulator, **kwargs)
+
+
+def cmd_run(args) -> int:
+    from basic_run import execute_runs
+
+    execute_runs(cfg_files=_cfg_files(args),
+                 workers=args.workers,
+                 timeout=args.timeout,
+                 retries=args.retries,
+                 use_sim_cache=not args.no_sim_cache,
+                 idd_file=args.idd,
+                 simulator=_simulator(args),
+                 stream=args.stream,
+                 pipeline=args.pipeline,
+                 stage_workers=_stage_workers(args.stage_workers),
+                 profile=args.profile)
+    return 0
+
+
+def _stage_workers(pairs) -> dict:
+    '''
+    parses the stage=workers pairs of --stage-workers
+    '''
+    workers = {}
+    for pair in pairs or []:
+        stage, _, number = pair.partition('=')
+        if not number.isdigit():
+            raise SystemExit(f'--stage-workers expects stage=workers, got {pair}')
+        workers[stage] = int(number)
+
+    return workers
+
+
+def cmd_ingest(args) -> int:
+    from basic_run import ingest_runs
+
+    ingest_runs(cfg_files=_cfg_files(args), profile=args.profile)
+    return 0
+
+
+def cmd_queue(args) -> int:
+    from utils.queue_utils import WorkQueue
+
+    if args.action == 'submit':
+        queue = WorkQueue(args.path, lease_seconds=args.lease, max_attempts=args.max_attempts)
+        ids = queue.submit(_cfg_files(args))
+        print(f'Submitted {len(ids)} runs to {args.path}')
+        return 0
+
+    if args.action == 'work':
+        from basic_run import work_queue
+
+        work_queue(args.path,
+                   worker=args.worker,
+                   max_runs=args.max_runs,
+                   use_sim_cache=not args.no_sim_cache,
+                   idd_file=args.idd,
+                   simulator=_simulator(args),
+                   wait=not args.no_wait,
+                   profile=args.profile)
+        return 0
+
+    import time
+
+    queue = WorkQueue(args.path)
+    while True:
+        status = queue.report()
+        if not args.watch or queue.finished():
+            return 1 if status['failed'] else 0
+        time.sleep(args.watch)
+
+
+def cmd_train(args) -> int:
+    from utils.store_utils import ExperimentStore
+    from ml.points.training import prepare_data, train_surrogates, write_summary
+    from ml.points.surrogate import SurrogateBundle
+
+    saves_path = _saves_path()
+    store = ExperimentStore(os.environ.get('STORE_PATH') or os.path.join(saves_path, 'store'))
+    data = store.read(args.experiment)
+
+    data, features, targets, scaling = prepare_data(data, seed=args.seed)
+    models, summary = train_surrogates(data, features, targets,
+                                       estimator=args.estimator,
+                                       n_splits=args.n_splits,
+                                       val_month=args.val_month,
+                                       n_jobs=args.n_jobs)
+
+    write_summary(summary, os.path.join(saves_path, args.experiment+'_training.json'))
+
+    bundle = SurrogateBundle(models, features, targets, scaling,
+                             meta={'run': args.experiment, 'training': summary})
+    path = args.output or os.path.join(saves_path, 'surrogates', args.experiment+'.joblib')
+    bundle.save(path)
+
+    print(f'Trained {len(targets)} targets in {summary["wall_time"]:.1f}s, saved to {path}')
+    for target in targets:
+        scores = summary['targets'][target]
+        print(f'{target}: cv r2 {scores["cv_r2_mean"]:.3f} ({scores["cv_r2_std"]:.3f}), '
+              f'validation r2 {scores["val_r2"]:.3f}')
+    return 0
+
+
+def cmd_predict(args) -> int:
+    import pandas as pd
+    from ml.points.surrogate import load_bundle
+
+    bundle = load_bundle(args.bundle)
+    X = pd.read_csv(args.inputs, index_col=0)
+
+    pred = bundle.predict_frame(X, targets=args.targets, chunk_size=args.chunk_size)
+    pred.to_csv(args.output or sys.stdout)
+    return 0
+
+
+def cmd_storage(args) -> int:
+    import time
+    import yaml
+    from pathlib import Path
+    from utils.store_utils import ExperimentStore
+    from utils.storage_utils import experiment_loads, storage_candidates, simulate_storage
+
+    store = ExperimentStore(os.environ.get('STORE_PATH') or os.path.join(_saves_path(), 'store'))
+    loads = experiment_loads(store.read(args.experiment),
+                             demand=args.demand,
+                             demand_efficiency=args.demand_efficiency,
+                             supply=args.supply,
+                             temperature=args.temperature)
+    candidates = storage_candidates(yaml.safe_load(Path(args.spec).read_text()))
+
+    start = time.perf_counter()
+    results = simulate_storage(loads['supply'], loads['demand'], candidates,
+                               temperature=loads['temperature'] if args.temperature else None)
+    print(f'Simulated {len(candidates)} storage candidates over {len(loads)} hours '
+          f'in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    results = candidates.join(results)
+    results.to_csv(args.output or sys.stdout)
+    return 0
+
+
+def cmd_bench(args) -> int:
+    from utils import bench_utils
+
+    saves_path = _saves_path()
+    results_dir = args.results or os.environ.get('BENCH_PATH') or os.path.join(saves_path, 'benchmarks')
+
+    params = {key: getattr(args, key) for key in ['timestep', 'meters', 'variables', 'years']
+              if getattr(args, key) is not None}
+    results = bench_utils.run_benchmarks(args.workdir or os.path.join(results_dir, 'data'),
+                                         scale=args.scale, cases=args.cases,
+                                         repeats=args.repeats, **params)
+
+    baseline = bench_utils.load_baseline(results_dir, results)
+    bench_utils.report(results, baseline)
+    print(f'Results written to {bench_utils.save_results(results, results_dir)}')
+
+    regressions = bench_utils.compare(results, baseline, args.tolerance) if baseline else []
+    for regression in regressions:
+        print(f'Regression: {regression}')
+    return int(bool(regressions) and args.fail_on_regression)
+
+
+def cmd_check_startup(args) -> int:
+    failures = check_startup(budget=args.budget, repeats=args.repeats)
+    for failure in failures:
+        print(failure)
+    return int(bool(failures))
+
+
+def check_startup(budget=STARTUP_BUDGET, repeats=5) -> list:
+    '''
+    Measures the startup overhead of the CLI and the modules used by output parsing processes
+
+    Args:
+        budget(float): seconds `stes --help` may take longer than the bare interpreter
+        repeats(int): the fastest of this many runs is compared to budget
+
+    Returns:
+        List[str]: descriptions of all violations, empty if the budget is met and
+            every module in LIGHT_IMPORTS imports without the HEAVY_MODULES
+    '''
+    import time
+    import subprocess
+
+    src = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src, os.environ.get('PYTHONPATH')])))
+
+    def fastest(cmd):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    failures = []
+
+    overhead = fastest([sys.executable, '-m', 'stes', '--help']) - fastest([sys.executable, '-c', 'pass'])
+    print(f'stes --help: {1000*overhead:.0f}ms on top of the interpreter (budget {1000*budget:.0f}ms)')
+    if overhead > budget:
+        failures.append(f'Startup of stes takes {overhead:.3f}s, more than the budget of {budget:.3f}s')
+
+    for module in LIGHT_IMPORTS:
+        code = (f'import sys, {module}; '
+                f'print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+        proc = subprocess.run([sys.executable, '-c', code], env=env, cwd=src,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            failures.append(f'Could not import {module}: {lines[-1] if lines else proc.returncode}')
+            continue
+        heavy = proc.stdout.split()
+        if heavy:
+            failures.append(f'Importing {module} imports {", ".join(heavy)}')
+
+    return failures
+
+
+def build_parser() -> argparse.ArgumentParser:
+
+    parser = argparse.ArgumentParser(prog='stes', description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, func, help in [('run', cmd_run, 'simulate runs and store their results'),
+                             ('ingest', cmd_ingest, 'store the results of runs simulated before')]:
+        cmd = commands.add_parser(name, help=help)
+        cmd.add_argument('cfgs', nargs='*', help='run config yaml files')
+        cmd.add_argument('--sweep', action='append', help='sweep spec yaml file, may be repeated')
+        cmd.add_argument('--profile', nargs='?', const=True,
+                         help='print the time spent in every stage; saved as Chrome trace '
+                              'if a path ending with .trace.json is given, as JSON otherwise')
+        cmd.set_defaults(func=func)
+
+        if name == 'run':
+            cmd.add_argument('-w', '--workers', type=int, default=1,
+                             help='number of simulations run in parallel')
+            cmd.add_argument('--timeout', type=float, help='seconds after which a run is killed')
+            cmd.add_argument('--retries', type=int, default=0,
+                             help='additional attempts for failed runs')
+            cmd.add_argument('--no-sim-cache', action='store_true',
+                             help='simulate even if identical runs are cached')
+            cmd.add_argument('--idd', help='EnergyPlus data dictionary, default $IDD_FILE')
+            cmd.add_argument('--simulator', choices=['energyplus', 'local'],
+                             help='simulator backend, default $STES_SIMULATOR or energyplus')
+            cmd.add_argument('--latency', type=float, nargs='+',
+                             help='seconds per local run, or lower and upper bound')
+            cmd.add_argument('--sqlite', action='store_true',
+                             help='local simulator also writes eplusout.sql')
+            cmd.add_argument('--stream', action='store_true',
+                             help='store meter output while the simulations are running')
+            cmd.add_argument('--pipeline', action='store_true',
+                             help='overlap model building, simulation, parsing and storing of runs')
+            cmd.add_argument('--stage-workers', nargs='+', metavar='STAGE=N',
+                             help='workers of the pipeline stages build, parse and persist, e.g. build=2')
+
+    cmd = commands.add_parser('queue', help='run batches from a queue on a shared filesystem')
+    actions = cmd.add_subparsers(dest='action', required=True)
+    cmd.set_defaults(func=cmd_queue)
+
+    action = actions.add_parser('submit', help='add runs to a queue, created if needed')
+    action.add_argument('path', help='directory of the queue')
+    action.add_argument('cfgs', nargs='*', help='run config yaml files')
+    action.add_argument('--sweep', action='append', help='sweep spec yaml file, may be repeated')
+    action.add_argument('--lease', type=float, default=600.,
+                        help='seconds without heartbeat after which a run is taken over, for new queues')
+    action.add_argument('--max-attempts', type=int, default=3,
+                        help='attempts per run before it is given up, for new queues')
+
+    action = actions.add_parser('work', help='simulate and store runs of a queue until it is drained')
+    action.add_argument('path', help='directory of the queue')
+    action.add_argument('--worker', help='name of the worker, default host-pid')
+    action.add_argument('--max-runs', type=int, help='stop after this many runs')
+    action.add_argument('--no-wait', action='store_true',
+                        help='stop once nothing is pending, without waiting for runs of other workers')
+    action.add_argument('--no-sim-cache', action='store_true',
+                        help='simulate even if identical runs are cached')
+    action.add_argument('--idd', help='EnergyPlus data dictionary, default $IDD_FILE')
+    action.add_argument('--simulator', choices=['energyplus', 'local'],
+                        help='simulator backend, default $STES_SIMULATOR or energyplus')
+    action.add_argument('--latency', type=float, nargs='+',
+                        help='seconds per local run, or lower and upper bound')
+    action.add_argument('--sqlite', action='store_true', help='local simulator also writes eplusout.sql')
+    action.add_argument('--profile', nargs='?', const=True,
+                        help='print the time spent in every stage, see stes run --profile')
+
+    action = actions.add_parser('status', help='print progress, throughput and running runs of a queue')
+    action.add_argument('path', help='directory of the queue')
+    action.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='print again every SECONDS until the queue is drained')
+
+    cmd = commands.add_parser('train', help='train point surrogates of a stored experiment')
+    cmd.add_argument('experiment', help='name of the experiment in the store')
+    cmd.add_argument('--estimator', default='hist', choices=['hist', 'gbr'])
+    cmd.add_argument('--n-splits', type=int, default=10, help='cross validation folds')
+    cmd.add_argument('--val-month', type=int, default=11, help='month held out for validation')
+    cmd.add_argument('--n-jobs', type=int, default=-1, help='worker processes, -1 for all cores')
+    cmd.add_argument('--seed', type=int, help='seed of the noise feature')
+    cmd.add_argument('-o', '--output', help='bundle file, default $SAVES_PATH/surrogates/<experiment>.joblib')
+    cmd.set_defaults(func=cmd_train)
+
+    cmd = commands.add_parser('predict', help='predict targets with a surrogate bundle')
+    cmd.add_argument('bundle', help='bundle written by stes train')
+    cmd.add_argument('inputs', help='csv file with one column per feature, index in the first column')
+    cmd.add_argument('-o', '--output', help='csv file of the predictions, default stdout')
+    cmd.add_argument('--targets', nargs='+', help='targets to be predicted, all if omitted')
+    cmd.add_argument('--chunk-size', type=int, default=2**18, help='rows scored at once')
+    cmd.set_defaults(func=cmd_predict)
+
+    cmd = commands.add_parser('storage', help='simulate storage candidates on the loads of a stored experiment')
+    cmd.add_argument('experiment', help='name of the experiment in the store')
+    cmd.add_argument('spec', help='yaml file with grid and sample of the storage parameters')
+    cmd.add_argument('-o', '--output', help='csv file of the candidates and their results, default stdout')
+    cmd.add_argument('--demand', nargs='+', default=['output_Gas:Facility'],
+                     help='output columns whose sum is the heat demand')
+    cmd.add_argument('--demand-efficiency', type=float, default=0.8,
+                     help='converts the demand columns to heat')
+    cmd.add_argument('--supply', default='ghi', help='irradiance column supplying the storage')
+    cmd.add_argument('--temperature', default='temp_air',
+                     help='outdoor temperature column of the controls, empty to omit')
+    cmd.set_defaults(func=cmd_storage)
+
+    cmd = commands.add_parser('bench', help='benchmark the data path on synthetic outputs and weather')
+    cmd.add_argument('--scale', default='small', choices=['small', 'medium', 'large'])
+    cmd.add_argument('--timestep', type=int, help='minutes per output timestep')
+    cmd.add_argument('--meters', type=int, help='number of meters in eplusout.mtr')
+    cmd.add_argument('--variables', type=int, help='number of variables in eplusout.eso')
+    cmd.add_argument('--years', type=int, help='number of simulated years')
+    cmd.add_argument('--cases', nargs='+', help='cases to run, all if omitted')
+    cmd.add_argument('--repeats', type=int, default=3, help='timed calls per case')
+    cmd.add_argument('--results', help='directory of stored results, default $BENCH_PATH')
+    cmd.add_argument('--workdir', help='directory of the synthetic data, default <results>/data')
+    cmd.add_argument('--tolerance', type=float, default=0.25,
+                     help='slowdown relative to the last result counted as regression')
+    cmd.add_argument('--fail-on-regression', action='store_true', help='exit with 1 on regressions')
+    cmd.set_defaults(func=cmd_bench)
+
+    cmd = commands.add_parser('check-startup', help='check the startup time budget')
+    cmd.add_argument('--budget', type=float, default=STARTUP_BUDGET,
+                     help='seconds on top of the interpreter startup')
+    cmd.add_argument('--repeats', type=int, default=5)
+    cmd.set_defaults(func=cmd_check_startup)
+
+    return parser
+
+
+def main(argv=None) -> int:
+
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the project are imported relative to src, as by the scripts run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+eppy = pytest.importorskip('eppy')
+
+from utils.idf_utils import IDFTemplateCache
+
+
+IDD = os.path.join(os.path.dirname(eppy.__file__), 'resources', 'iddfiles', 'Energy+V9_0_1.idd')
+PROTOTYPE = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'epm', 'smalloffice.idf')
+
+
+@pytest.fixture(scope='module')
+def template():
+    from eppy.modeleditor import IDF
+
+    if IDF.getiddname() is None:
+        IDF.setiddname(IDD)
+    return IDF(PROTOTYPE)
+
+
+def fields(model):
+    return {key: [list(obj) for obj in objs] for key, objs in model.model.dt.items()}
+
+
+def test_clone_objects_point_to_the_clone(template):
+    model = IDFTemplateCache.clone(template)
+
+    assert all(bunch.theidf is model for bunches in model.idfobjects.values() for bunch in bunches)
+
+
+def test_edits_through_clone_leave_template_unchanged(template):
+    before = fields(template)
+    model = IDFTemplateCache.clone(template)
+
+    zone = model.idfobjects['ZONE'][0]
+    zone.Name = 'Edited zone'
+    zone.theidf.newidfobject('ZONE', Name='Added zone')
+    model.removeidfobject(model.idfobjects['ZONE'][1])
+    schedule = model.idfobjects['SCHEDULE:COMPACT'][0]
+    schedule[schedule.fieldnames[-1]] = '99'
+    model.idfobjects['RUNPERIOD'][0].Begin_Month = 6
+
+    assert fields(template) == before
+    assert model.getobject('ZONE', 'Edited zone') is zone
+    assert template.getobject('ZONE', 'Edited zone') is None
+    assert template.getobject('ZONE', 'Added zone') is None
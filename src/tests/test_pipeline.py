@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+eppy = pytest.importorskip('eppy')
+
+import config
+from basic_run import execute_runs
+from utils.sim_utils import LocalSimulator
+
+
+IDD = os.path.join(os.path.dirname(eppy.__file__), 'resources', 'iddfiles', 'Energy+V9_0_1.idd')
+DATA = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
+
+
+def cfgs(n):
+    for i in range(n):
+        yield {'name': f'r{i}', 'building_type': 'small', 'location': 'greatfalls',
+               'start_year': 2020, 'start_month': 1, 'start_day': 1,
+               'end_year': 2020, 'end_month': 1, 'end_day': 3,
+               'building_config': [{'Output_Meter': {'Key_Name': 'Gas:Facility', 'Reporting_Frequency': 'Hourly'}}],
+               'json_update': {'idf.Building..North_Axis': 10 * i}}
+
+
+@pytest.mark.parametrize('pipeline', [True, False])
+def test_runs_with_relative_saves_path(tmp_path, monkeypatch, pipeline):
+    # outputs go to the working directory, which the workers leave for their scratch directories
+    monkeypatch.chdir(tmp_path)
+    for key in ['SAVES_PATH', 'STORE_PATH', 'CACHE_PATH', 'SPILL_PATH', 'SIM_CACHE_PATH']:
+        monkeypatch.setenv(key, '')
+    monkeypatch.setenv('IDF_PATH', os.path.join(DATA, 'epm'))
+    monkeypatch.setenv('WEATHER_PATH', os.path.join(DATA, 'weather'))
+    monkeypatch.setitem(config.idf_dict, 'small', 'smalloffice.idf')
+
+    dataclerk = execute_runs(cfgs(3), workers=2, idd_file=IDD, use_sim_cache=False,
+                             simulator=LocalSimulator(), pipeline=pipeline)
+
+    assert [(meta['experiment'], meta['rows']) for meta in dataclerk.store.experiments()] == \
+        [('r0', 72), ('r1', 72), ('r2', 72)]
+    for name in ['r0', 'r1', 'r2']:
+        assert os.path.isfile(tmp_path / name / 'eplusout.mtr')
+    # no directories of attempts are left behind
+    assert not [entry for entry in os.listdir(tmp_path) if entry.endswith('.attempt')]
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from utils import synth_utils
+from utils.data_utils import mtr2df
+from utils.eso_utils import eso2df
+from utils.sql_utils import sql2df
+
+
+NAMES = synth_utils.meter_names(3)
+DAILY = synth_utils.meter_names(5)[3:]
+
+
+@pytest.fixture(scope='module')
+def two_years(tmp_path_factory):
+    '''
+    the same 15-minute output of a run over 2020 and 2021 as .mtr and .sql file
+    '''
+    directory = tmp_path_factory.mktemp('two_years')
+    kwargs = dict(timestep=15, years=2, year=2020, daily_names=DAILY)
+    mtr = synth_utils.write_report(str(directory / 'eplusout.mtr'), NAMES, **kwargs)
+    sql = synth_utils.write_sql(str(directory / 'eplusout.sql'), NAMES, meters=NAMES + DAILY, **kwargs)
+    return mtr, sql
+
+
+@pytest.mark.parametrize('start, end', [
+    ('2021-03-01', '2021-03-03'),
+    ('2020-12-31 22:00', '2021-01-01 01:15'),
+    (None, '2020-01-01 00:30'),
+    ('2021-12-31 23:45', None),
+])
+def test_windows_of_all_readers_agree(two_years, start, end):
+    mtr, sql = two_years
+    expected = synth_utils.timesteps(15, 2, 2020)
+    if start is not None:
+        expected = expected[expected >= pd.Timestamp(start)]
+    if end is not None:
+        expected = expected[expected <= pd.Timestamp(end)]
+
+    from_mtr = mtr2df(mtr, start=start, end=end, year=2020)
+    from_sql = sql2df(sql, names=NAMES, start=start, end=end, year=2020)
+    from_eso = eso2df(mtr, names=NAMES, start=start, end=end, year=2020)['TimeStep']
+
+    assert list(from_sql.index) == list(expected)
+    pd.testing.assert_frame_equal(from_mtr[from_sql.columns], from_sql, check_freq=False)
+    pd.testing.assert_frame_equal(from_eso, from_sql, check_freq=False)
+
+
+def test_daily_window_spans_years(two_years):
+    mtr, _ = two_years
+
+    daily = eso2df(mtr, names=DAILY, start='2020-12-31 12:00', end='2021-01-02', year=2020)['Daily']
+
+    assert list(daily.index) == list(pd.to_datetime(['2020-12-31', '2021-01-01', '2021-01-02']))
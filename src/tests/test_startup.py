@@ -0,0 +1,11 @@
+import stes
+
+
+def test_startup_within_budget():
+    '''
+    stes --help stays within STARTUP_BUDGET and every module of
+    LIGHT_IMPORTS imports, without pulling in any of HEAVY_MODULES
+    '''
+    failures = stes.check_startup()
+
+    assert not failures, '\n'.join(failures)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.storage_utils import simulate_storage
+
+
+def reference(supply, demand, temperature, capacity, supply_scale=1., demand_scale=1.,
+              charge_power=np.inf, discharge_power=np.inf, charge_efficiency=1., discharge_efficiency=1.,
+              loss_rate=0., initial_soc=0., min_soc=0., max_soc=1., charge_above=-np.inf,
+              discharge_below=np.inf):
+    '''
+    the energy balance of one candidate, one hourly step at a time
+    '''
+    stored = initial_soc * capacity
+    totals = dict(charged=0., discharged=0., losses=0., spilled=0., unmet=0., initial=stored)
+    for s, d, temp in zip(supply * supply_scale, demand * demand_scale, temperature):
+        direct = min(s, d)
+        surplus, deficit = s - direct, d - direct
+
+        loss = stored * loss_rate
+        stored -= loss
+
+        charge = 0.
+        if temp >= charge_above:
+            charge = min(surplus, charge_power, max(max_soc * capacity - stored, 0.) / charge_efficiency)
+        stored += charge * charge_efficiency
+
+        release = 0.
+        if temp < discharge_below:
+            release = min(deficit, discharge_power, max(stored - min_soc * capacity, 0.) * discharge_efficiency)
+        stored -= release / discharge_efficiency
+
+        totals['charged'] += charge
+        totals['discharged'] += release
+        totals['losses'] += loss
+        totals['spilled'] += surplus - charge
+        totals['unmet'] += deficit - release
+    totals['final'] = stored
+
+    return totals
+
+
+@pytest.fixture(scope='module')
+def loads():
+    '''
+    two weeks of hourly supply peaking at noon, a steady demand and a daily temperature swing
+    '''
+    hours = np.arange(14 * 24)
+    rng = np.random.default_rng(0)
+    supply = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0, None) * rng.uniform(0.5, 1.5, len(hours))
+    demand = rng.uniform(0.2, 0.6, len(hours))
+    temperature = 5 + 8 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi)
+    return supply, demand, temperature
+
+
+def candidates():
+
+    return pd.DataFrame({
+        'capacity': [2., 5., 5., 10., 3.],
+        'supply_scale': [1., 2., 1.5, 3., 2.],
+        'charge_power': [np.inf, 0.8, 1., 2., 0.5],
+        'discharge_power': [np.inf, 0.5, 1., 0.3, 0.4],
+        'charge_efficiency': [1., 0.9, 0.95, 0.8, 0.85],
+        'discharge_efficiency': [1., 0.85, 0.9, 0.95, 0.8],
+        'loss_rate': [0., 0.01, 0.002, 0.005, 0.02],
+        'initial_soc': [0., 0.5, 0.2, 1., 0.3],
+        'min_soc': [0., 0.1, 0.2, 0., 0.1],
+        'max_soc': [1., 0.9, 1., 0.95, 0.8],
+        'charge_above': [-np.inf, -np.inf, 4., 0., -np.inf],
+        'discharge_below': [np.inf, np.inf, 10., np.inf, 8.],
+    })
+
+
+def test_matches_scalar_reference(loads):
+    supply, demand, temperature = loads
+    params = candidates()
+
+    results = simulate_storage(supply, demand, params, temperature=temperature, chunk_size=2)
+
+    for i, row in params.iterrows():
+        expected = reference(supply, demand, temperature, **row.to_dict())
+        for key, value in expected.items():
+            assert results.loc[i, key] == pytest.approx(value, rel=1e-9, abs=1e-9), (i, key)
+
+
+def test_energy_balance(loads):
+    supply, demand, temperature = loads
+    params = candidates()
+
+    results = simulate_storage(supply, demand, params, temperature=temperature)
+
+    change = results['final'] - results['initial']
+    balance = (results['charged'] * params['charge_efficiency']
+               - results['discharged'] / params['discharge_efficiency'] - results['losses'])
+    np.testing.assert_allclose(change, balance, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(results['direct'] + results['discharged'] + results['unmet'], results['demand'])
+    np.testing.assert_allclose(results['direct'] + results['charged'] + results['spilled'], results['supply'])
+
+
+@pytest.mark.parametrize('key', ['charge_efficiency', 'discharge_efficiency'])
+@pytest.mark.parametrize('value', [0., -0.5])
+def test_rejects_non_positive_efficiencies(loads, key, value):
+    supply, demand, _ = loads
+
+    with pytest.raises(ValueError, match=key):
+        simulate_storage(supply, demand, capacity=[1., 2.], **{key: [0.9, value]})
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.store_utils import ExperimentStore
+
+
+CFG = {'building_type': 'small', 'location': 'greatfalls'}
+
+
+def frame(scale=1.):
+    index = pd.date_range('2020-01-01', periods=24, freq='h', name='timestamp')
+    return pd.DataFrame({'output_Gas:Facility': scale * np.arange(24.)}, index=index)
+
+
+def test_rewrite_replaces_partition(tmp_path):
+    store = ExperimentStore(str(tmp_path))
+    store.write('r0', frame(), cfg=CFG)
+    path = store.write('r0', frame(2.), cfg=CFG)
+
+    pd.testing.assert_frame_equal(store.read('r0'), frame(2.), check_freq=False)
+    # the old partition renamed aside is removed once the new one is in place
+    assert os.listdir(os.path.dirname(path)) == ['experiment=r0']
+    assert [meta['experiment'] for meta in store.experiments()] == ['r0']
+
+
+def test_read_many_without_matches(tmp_path):
+    store = ExperimentStore(str(tmp_path))
+    store.write('r0', frame(), cfg=CFG)
+
+    df = store.read_many(location='tucson', columns=['output_Gas:Facility'])
+
+    assert df.empty
+    assert list(df.columns) == ['output_Gas:Facility', 'experiment', 'building_type', 'location']
+    assert isinstance(df['experiment'].dtype, pd.CategoricalDtype)
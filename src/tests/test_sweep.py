@@ -0,0 +1,36 @@
+import os
+from itertools import islice
+
+import pytest
+
+eppy = pytest.importorskip('eppy')
+
+import config
+from attrdict import AttrDict
+from utils.idf_utils import build_model
+from utils.sweep_utils import expand_sweep
+
+
+IDD = os.path.join(os.path.dirname(eppy.__file__), 'resources', 'iddfiles', 'Energy+V9_0_1.idd')
+SOURCE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(os.path.dirname(SOURCE), 'data')
+
+
+@pytest.mark.parametrize('spec', ['buildings.yml', 'setpoints.yml'])
+def test_shipped_sweeps_build(monkeypatch, spec):
+    from eppy.modeleditor import IDF
+
+    if IDF.getiddname() is None:
+        IDF.setiddname(IDD)
+    # the repository ships one prototype and one weather file, which stand in for all of them
+    for building_type in list(config.idf_dict):
+        monkeypatch.setitem(config.idf_dict, building_type, 'smalloffice.idf')
+    for location in list(config.weather_dict):
+        monkeypatch.setitem(config.weather_dict, location, 'greatfalls.epw')
+
+    for cfg in islice(expand_sweep(spec, config_path=os.path.join(SOURCE, 'sweeps')), 2):
+        cfg = AttrDict(cfg, idf_path=os.path.join(DATA, 'epm'), weather_path=os.path.join(DATA, 'weather'))
+        model = build_model(cfg, view=False)
+
+        meters = [obj.Key_Name for obj in model.idfobjects['OUTPUT:METER:METERFILEONLY']]
+        assert {'Gas:Facility', 'Electricity:Facility'} <= set(meters)
@@ -0,0 +1,381 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import subprocess
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+
+import numpy as np
+
+from utils import synth_utils
+
+
+# scales of the synthetic data; every parameter can be overridden individually
+SCALES = {
+    'small': {'timestep': 60, 'meters': 10, 'variables': 10, 'years': 1},
+    'medium': {'timestep': 10, 'meters': 50, 'variables': 50, 'years': 1},
+    'large': {'timestep': 5, 'meters': 100, 'variables': 200, 'years': 1},
+}
+
+CASES = ['mtr2df', 'eso2df', 'sql2df', 'gather_weather', 'gather_weather_cached', 'align',
+         'gather_and_store', 'build_model', 'edit_eppy', 'edit_index', 'write_idf',
+         'to_csv', 'to_store', 'store_read', 'storage']
+
+# name under which the synthetic weather and building are registered in config
+BENCH_NAME = 'benchmark'
+
+
+def measure(func, repeats=3, setup=None) -> dict:
+    '''
+    Times func and records the peak memory it allocates
+
+    func is called repeats times, each call preceded by setup if given;
+    the fastest call is reported. One additional call runs under
+    tracemalloc, which also traces numpy and pandas buffers, to obtain
+    the peak memory without slowing down the timed calls.
+
+    Args:
+        func(callable): returns the number of rows it processed
+        repeats(int): number of timed calls
+        setup(callable): called before every call of func, not timed
+
+    Returns:
+        dict: seconds (fastest), mean_seconds, rows, rows_per_s, peak_mb
+    '''
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        rows = func()
+        times.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = min(times)
+    return {'seconds': seconds,
+            'mean_seconds': sum(times) / len(times),
+            'rows': rows,
+            'rows_per_s': rows / seconds if seconds > 0 else None,
+            'peak_mb': peak / 1024**2}
+
+
+def generate(workdir: str, timestep=60, meters=10, variables=10, years=1, year=2020, seed=0) -> dict:
+    '''
+    Writes the synthetic run outputs and weather of one scale into workdir,
+    unless they were written before; eplusout.sql holds the meters and
+    variables of eplusout.mtr and eplusout.eso
+
+    Returns:
+        dict: 'out_dir', 'mtr', 'eso', 'sql' and 'epw' -> paths
+    '''
+    name = f'ts{timestep}_m{meters}_v{variables}_y{years}_{year}_s{seed}'
+    directory = os.path.join(workdir, name)
+    paths = {'out_dir': os.path.join(directory, 'output'),
+             'mtr': os.path.join(directory, 'output', 'eplusout.mtr'),
+             'eso': os.path.join(directory, 'output', 'eplusout.eso'),
+             'sql': os.path.join(directory, 'output', 'eplusout.sql'),
+             'epw': os.path.join(directory, 'weather', BENCH_NAME + '.epw')}
+
+    if all(os.path.exists(paths[key]) for key in ['mtr', 'eso', 'sql', 'epw']):
+        return paths
+
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(paths['epw']), exist_ok=True)
+    synth_utils.write_outputs(paths['out_dir'], meters=meters, variables=variables,
+                              timestep=timestep, years=years, year=year, seed=seed)
+    names = synth_utils.meter_names(meters)
+    synth_utils.write_sql(paths['sql'], names + synth_utils.variable_names(variables), timestep, years, year,
+                          seed=seed, meters=names)
+    synth_utils.write_epw(paths['epw'], years=years, year=year, seed=seed)
+    print(f'Generated synthetic data {name} in {time.perf_counter() - start:.1f}s')
+
+    return paths
+
+
+@contextmanager
+def _environ(**variables):
+    '''
+    sets environment variables for the duration of the with block
+    '''
+    old = {key: os.environ.get(key) for key in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _idf_edits(model) -> dict:
+    '''
+    returns a json_update (see eppy.json_functions.updateidf) raising every real
+    field without upper bound of the named objects of model by one percent
+    '''
+    edits = {}
+    for key, comms in zip(model.model.dtls, model.idd_info):
+        for bunch in model.idfobjects[key]:
+            obj = bunch['obj']
+            if len(obj) < 2 or not isinstance(obj[1], str) or not obj[1]:
+                continue
+            for position, (field, value) in enumerate(zip(bunch['objls'], obj)):
+                comm = comms[position] if position < len(comms) else {}
+                bounded = 'maximum' in comm or 'maximum<' in comm
+                if position > 1 and comm.get('type') == ['real'] and not bounded and isinstance(value, (int, float)):
+                    edits[f'idf.{obj[0]}.{obj[1]}.{field}'] = round(value * 1.01, 6)
+
+    return edits
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(workdir: str, scale='small', cases=None, repeats=3, idf_file=None, **params) -> dict:
+    '''
+    Benchmarks the data path on synthetic outputs and weather
+
+    Cases:
+        mtr2df: parsing eplusout.mtr
+        eso2df: reading all series of eplusout.eso, see utils.eso_utils.eso2df
+        sql2df: reading all series of eplusout.sql, see utils.sql_utils.sql2df
+        gather_weather: parsing the epw file (cache disabled)
+        gather_weather_cached: the same, taken from a warm FrameCache
+        align: joining output and weather frames on their timestamps
+        gather_and_store: DataClerk.gather_and_store_weather and _output of one run
+        build_model: copying and configuring a prototype building (needs besos and an IDD)
+        edit_eppy: copying the prototype and changing every numeric field of its named
+            objects through eppy.json_functions.updateidf
+        edit_index: the same edits through utils.edit_utils.EditPlan
+        write_idf: writing the prototype with utils.edit_utils.write_idf
+        to_csv: DataClerk.to_csv of the merged experiment
+        to_store: DataClerk.to_store of the merged experiment
+        store_read: reading the experiment back from the ExperimentStore
+        storage: simulating 1000 storage candidates on the loads of the merged experiment
+
+    Args:
+        workdir(str): directory for synthetic data, caches and the store
+        scale(str): key of SCALES
+        cases(List[str]): cases to run, all if None
+        repeats(int): timed calls per case
+        idf_file(str): prototype building for build_model, defaults to data/epm/smalloffice.idf
+        params: overrides of timestep, meters, variables, years, year and seed
+
+    Returns:
+        dict: commit, machine, parameters and the measurements of every case;
+            cases that cannot run in this environment are reported with 'skipped'
+    '''
+    import config
+    from dataclerk import DataClerk
+    from utils.time_utils import align
+    from utils.eso_utils import eso2df
+    from utils.sql_utils import sql2df
+
+    params = dict(SCALES[scale], **params)
+    paths = generate(workdir, **params)
+    cases = cases or CASES
+    year = params.get('year', 2020)
+
+    config.weather_dict.setdefault(BENCH_NAME, BENCH_NAME + '.epw')
+    idf_file = idf_file or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        '..', '..', 'data', 'epm', 'smalloffice.idf')
+    config.idf_dict.setdefault(BENCH_NAME, os.path.abspath(idf_file))
+
+    saves = os.path.join(workdir, 'saves')
+    os.makedirs(saves, exist_ok=True)
+    env = {'SAVES_PATH': saves,
+           'WEATHER_PATH': os.path.dirname(paths['epw']),
+           'IDF_PATH': os.path.dirname(os.path.abspath(idf_file)),
+           'CONFIG_PATH': workdir,
+           'CACHE_PATH': os.path.join(workdir, '.cache'),
+           'STORE_PATH': os.path.join(workdir, 'store')}
+
+    cfg = {'name': 'bench', 'building_type': BENCH_NAME, 'location': BENCH_NAME,
+           'start_year': year, 'start_month': 1, 'start_day': 1,
+           'end_year': year, 'end_month': 12, 'end_day': 31,
+           'building_config': [{'Output_Meter': {'Key_Name': 'Electricity:Facility',
+                                                 'Reporting_Frequency': 'hourly'}}]}
+
+    results = {}
+    with _environ(**env), redirect_stdout(io.StringIO()):
+
+        clerk = DataClerk(year=year, use_cache=False)
+        cached = DataClerk(year=year)
+        run_cfg = clerk.setup_cfg(dict(cfg))
+        run_cfg['out_dir'] = paths['out_dir']
+
+        output = clerk.gather_output(paths['mtr'])
+        weather = clerk.index_as_timestamp(clerk.gather_weather(paths['epw']))
+        cached.gather_weather(paths['epw'])
+
+        def gather_and_store():
+            clerk.experiments['bench'].pop('data', None)
+            clerk.curr_experiment = 'bench'
+            clerk.gather_and_store_weather(run_cfg)
+            clerk.gather_and_store_output(run_cfg)
+            return len(clerk.experiments['bench']['data'])
+
+        def build():
+            from utils.idf_utils import build_model
+            model = build_model(run_cfg)
+            return len(model.idfobjects)
+
+        json_update = {}
+
+        def edits():
+            from utils.idf_utils import template_cache
+            if not json_update:
+                json_update.update(_idf_edits(template_cache.get(idf_file)))
+            return json_update
+
+        def edit_eppy(json_update):
+            import eppy.json_functions as json_functions
+            from utils.idf_utils import template_cache
+            json_functions.updateidf(template_cache.get(idf_file), json_update)
+            return len(json_update)
+
+        def edit_index(json_update):
+            from utils.idf_utils import template_cache
+            from utils.edit_utils import EditIndex, EditPlan
+            plan = EditPlan(template_cache.index(idf_file, EditIndex)).update(json_update)
+            plan.apply(template_cache.get(idf_file))
+            return plan.edits
+
+        def write():
+            from utils.idf_utils import template_cache
+            from utils.edit_utils import write_idf
+            model = template_cache.get(idf_file)
+            write_idf(model, os.path.join(workdir, 'bench.idf'))
+            return sum(len(objs) for objs in model.model.dt.values())
+
+        def storage():
+            from utils.storage_utils import experiment_loads, simulate_storage
+            loads = experiment_loads(clerk.experiments['bench']['data'])
+            capacity = np.linspace(1e3, 1e5, 1000)
+            simulate_storage(loads['supply'], loads['demand'], capacity=capacity, supply_scale=50.,
+                             loss_rate=2e-4, discharge_below=15., temperature=loads['temperature'])
+            return len(loads) * len(capacity)
+
+        benchmarks = {
+            'mtr2df': lambda: len(clerk.gather_output(paths['mtr'])),
+            'eso2df': lambda: sum(len(df) for df in eso2df(paths['eso'], year=year).values()),
+            'sql2df': lambda: len(sql2df(paths['sql'], year=year)),
+            'gather_weather': lambda: len(clerk.gather_weather(paths['epw'])),
+            'gather_weather_cached': lambda: len(cached.gather_weather(paths['epw'])),
+            'align': lambda: len(align(output, weather, year=year)),
+            'gather_and_store': gather_and_store,
+            'build_model': build,
+            'edit_eppy': lambda: edit_eppy(edits()),
+            'edit_index': lambda: edit_index(edits()),
+            'write_idf': write,
+            'to_csv': lambda: clerk.to_csv() or len(clerk.experiments['bench']['data']),
+            'to_store': lambda: clerk.to_store() or len(clerk.experiments['bench']['data']),
+            'store_read': lambda: len(clerk.store.read('bench')),
+            'storage': storage,
+        }
+
+        gather_and_store()
+        for case in cases:
+            try:
+                results[case] = measure(benchmarks[case], repeats=repeats)
+            except (ImportError, OSError) as e:
+                results[case] = {'skipped': f'{type(e).__name__}: {e}'}
+
+    return {'commit': _git_commit(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'machine': {'node': platform.node(), 'processor': platform.processor(),
+                        'cpus': os.cpu_count(), 'python': sys.version.split()[0]},
+            'scale': scale,
+            'params': params,
+            'repeats': repeats,
+            'cases': results}
+
+
+def save_results(results: dict, results_dir: str) -> str:
+    '''
+    writes results of run_benchmarks to results_dir and returns the path
+    '''
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = results['created'].replace(':', '').replace('-', '')
+    path = os.path.join(results_dir, f'{stamp}_{(results["commit"] or "nocommit")[:8]}.json')
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    return path
+
+
+def load_baseline(results_dir: str, results: dict) -> dict:
+    '''
+    Returns the latest stored results measured with the same parameters on
+    the same machine as results, None if there are none
+    '''
+    if not os.path.isdir(results_dir):
+        return None
+
+    for file in sorted(os.listdir(results_dir), reverse=True):
+        if not file.endswith('.json'):
+            continue
+        with open(os.path.join(results_dir, file)) as f:
+            baseline = json.load(f)
+        if (baseline['params'] == results['params']
+                and baseline['machine']['node'] == results['machine']['node']
+                and baseline['created'] != results['created']):
+            return baseline
+
+    return None
+
+
+def compare(results: dict, baseline: dict, tolerance=0.25) -> list:
+    '''
+    Returns descriptions of all cases that are slower or use more memory than
+    in baseline by more than the fraction tolerance
+    '''
+    regressions = []
+    for case, current in results['cases'].items():
+        previous = baseline['cases'].get(case)
+        if previous is None or 'skipped' in current or 'skipped' in previous:
+            continue
+        for key in ['seconds', 'peak_mb']:
+            if current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f'{case}: {key} {previous[key]:.3f} -> {current[key]:.3f} '
+                                   f'(commit {(baseline["commit"] or "?")[:8]})')
+
+    return regressions
+
+
+def report(results: dict, baseline: dict = None) -> None:
+    '''
+    prints one line per case, with the change relative to baseline if given
+    '''
+    print(f'Benchmark {results["scale"]} {results["params"]} at {(results["commit"] or "?")[:8]}')
+    print(f'{"case":<24}{"seconds":>10}{"rows/s":>14}{"peak MB":>10}{"vs. base":>10}')
+
+    for case, result in results['cases'].items():
+        if 'skipped' in result:
+            print(f'{case:<24}  skipped ({result["skipped"]})')
+            continue
+
+        change = ''
+        previous = (baseline or {}).get('cases', {}).get(case, {})
+        if previous.get('seconds'):
+            change = f'{100 * (result["seconds"] / previous["seconds"] - 1):+.0f}%'
+
+        print(f'{case:<24}{result["seconds"]:>10.3f}{result["rows_per_s"] or 0:>14,.0f}'
+              f'{result["peak_mb"]:>10.1f}{change:>10}')
@@ -0,0 +1,407 @@
+import os
+import json
+import shutil
+import hashlib
+from abc import ABC, abstractmethod
+from datetime import timezone, timedelta
+import numpy as np
+import pandas as pd
+
+
+def file_hash(filename, chunk_size=2**20):
+    '''
+    Returns the sha256 hex digest of the contents of a file
+
+    Args:
+        filename(str): file to be hashed
+        chunk_size(int): number of bytes read at once
+    '''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def model_hash(model) -> str:
+    '''
+    Returns the sha256 hex digest of all field values of an eppy model
+
+    Equivalent to hashing model.idfstr() for cache keys, but reads the
+    field lists directly instead of formatting every field with its
+    comment and unit, which takes tens of seconds for large models.
+    '''
+    digest = hashlib.sha256()
+    for key in model.model.dtls:
+        for obj in model.model.dt[key]:
+            digest.update('\x1f'.join(str(value) for value in obj).encode())
+            digest.update(b'\x1e')
+
+    return digest.hexdigest()
+
+
+class DiskCache(ABC):
+    '''
+    Size bounded directory of cache entries with least recently used eviction.
+
+    Subclasses decide what an entry is (a file or a directory) via _entries.
+    File modification times serve as access times.
+
+    Attributes:
+        cache_dir(str): directory holding the cache entries
+        max_bytes(int): size limit of the cache directory
+        hits(int): number of lookups served from disk
+        misses(int): number of lookups without an entry
+        evictions(int): number of entries removed to respect max_bytes
+    '''
+
+    def __init__(self, cache_dir, max_bytes):
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def evict(self) -> None:
+        '''
+        Removes least recently used entries until the cache fits into max_bytes
+        '''
+        entries = self._entries()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            self.evictions += 1
+
+
+    def clear(self) -> None:
+        '''
+        Removes all entries from the cache
+        '''
+        for _, _, path in self._entries():
+            self._remove(path)
+
+
+    def stats(self) -> dict:
+        '''
+        Returns hit/miss counters and the current size of the cache
+        '''
+        entries = self._entries()
+        lookups = self.hits + self.misses
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries)}
+
+
+    @abstractmethod
+    def _entries(self) -> list:
+        '''
+        Returns (access time, size in bytes, path) of all entries
+        '''
+
+
+    def _remove(self, path) -> None:
+        os.remove(path)
+
+
+
+class FrameCache(DiskCache):
+    '''
+    On-disk cache for DataFrames parsed from simulation output and weather files.
+
+    Entries are keyed by the content hash of the source file together with
+    the name and version of the parser (and its keyword arguments), so an
+    entry is reused as long as neither the file nor the parser changed.
+    Each frame is stored column by column as an uncompressed .npz archive.
+    Once the cache directory exceeds max_bytes, the least recently used
+    entries are removed.
+    '''
+
+    suffix = '.npz'
+
+    def __init__(self, cache_dir, max_bytes=2*1024**3):
+
+        super().__init__(cache_dir, max_bytes)
+
+
+    def key(self, filename, parser, version, **kwargs) -> str:
+        '''
+        Returns the cache key of a file as parsed by parser
+
+        Args:
+            filename(str): source file
+            parser(str): name of the parsing function
+            version(int or str): version of the parsing function
+            kwargs: arguments passed to the parser that change its output
+        '''
+        digest = hashlib.sha256()
+        digest.update(file_hash(filename).encode())
+        digest.update(f'{parser}:{version}'.encode())
+        digest.update(json.dumps(kwargs, sort_keys=True, default=str).encode())
+
+        return digest.hexdigest()
+
+
+    def cached(self, filename, parser, version, **kwargs) -> pd.DataFrame:
+        '''
+        Returns parser(filename, **kwargs), reading it from the cache if possible
+
+        Args:
+            filename(str): source file
+            parser(callable): function parsing filename into a pd.DataFrame
+            version(int or str): version of the parser; bump when its output changes
+            kwargs: passed on to parser
+        '''
+        key = self.key(filename, parser.__name__, version, **kwargs)
+
+        df = self.get(key)
+        if df is None:
+            df = parser(filename, **kwargs)
+            self.put(key, df)
+
+        return df
+
+
+    def get(self, key):
+        '''
+        Returns the frame stored under key or None if there is no such entry
+        '''
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                df = self._from_arrays(archive)
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            self.misses += 1
+            return None
+
+        # mark entry as recently used
+        os.utime(path)
+        self.hits += 1
+
+        return df
+
+
+    def put(self, key, df) -> None:
+        '''
+        Stores df under key and evicts old entries if the size limit is exceeded
+        '''
+        path = self._path(key)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as file:
+            np.savez(file, **self._to_arrays(df))
+        os.replace(tmp, path)
+
+        self.evict()
+
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+
+    @staticmethod
+    def _to_arrays(df) -> dict:
+        '''
+        Splits df into one array per column plus the index and json metadata
+        '''
+        index = df.index
+        meta = {'columns': [str(col) for col in df.columns],
+                'index_name': index.name,
+                'datetime_index': isinstance(index, pd.DatetimeIndex),
+                'utc_offset': None}
+
+        if meta['datetime_index'] and index.tz is not None:
+            meta['utc_offset'] = index[0].utcoffset().total_seconds()
+            index = index.tz_convert(None)
+
+        arrays = {'__meta__': np.array(json.dumps(meta)),
+                  '__index__': np.asarray(index)}
+        for i, col in enumerate(df.columns):
+            values = df[col].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays[f'col_{i}'] = values
+
+        return arrays
+
+
+    @staticmethod
+    def _from_arrays(archive) -> pd.DataFrame:
+        '''
+        Inverse of FrameCache._to_arrays
+        '''
+        meta = json.loads(str(archive['__meta__']))
+
+        index = archive['__index__']
+        if meta['datetime_index']:
+            index = pd.DatetimeIndex(index)
+            if meta['utc_offset'] is not None:
+                tz = timezone(timedelta(seconds=meta['utc_offset']))
+                index = index.tz_localize('UTC').tz_convert(tz)
+        index = pd.Index(index, name=meta['index_name'])
+
+        data = {col: archive[f'col_{i}'] for i, col in enumerate(meta['columns'])}
+
+        return pd.DataFrame(data, index=index)
+
+
+
+class SimulationCache(DiskCache):
+    '''
+    Content addressed cache of EnergyPlus output directories.
+
+    A run is identified by the hash of the fully built model (its field
+    values after runperiod, outputs and json updates were applied), the
+    contents of the weather file, the simulator version and the run
+    options. On a hit the stored output files are copied into the output
+    directory and the simulation is skipped. Each entry is a directory;
+    the least recently used ones are removed once max_bytes is exceeded.
+    '''
+
+    def __init__(self, cache_dir, max_bytes=20*1024**3):
+
+        super().__init__(cache_dir, max_bytes)
+
+
+    def key(self, model, simulator=None, **run_kwargs) -> str:
+        '''
+        Returns the cache key of running model with run_kwargs
+
+        Args:
+            model(IDF): fully built model with its weather file attached
+            simulator: backend from utils.sim_utils, EnergyPlus if None
+            run_kwargs: options passed to model.run apart from output_directory
+        '''
+        version = simulator.version(model) if simulator is not None else simulator_version(model)
+
+        digest = hashlib.sha256()
+        digest.update(model_hash(model).encode())
+        digest.update(file_hash(model.epw).encode() if model.epw else b'')
+        digest.update(version.encode())
+        digest.update(json.dumps(run_kwargs, sort_keys=True, default=str).encode())
+
+        return digest.hexdigest()
+
+
+    def run(self, model, output_directory: str, simulator=None, **run_kwargs) -> bool:
+        '''
+        Fills output_directory with the results of model.run, simulating only on a miss
+
+        Args:
+            model(IDF): fully built model with its weather file attached
+            output_directory(str): where the EnergyPlus outputs are placed
+            simulator: backend from utils.sim_utils, EnergyPlus if None
+            run_kwargs: passed on to model.run
+
+        Returns:
+            bool: True if the outputs were taken from the cache
+        '''
+        key = self.key(model, simulator=simulator, **run_kwargs)
+
+        if self.restore(key, output_directory):
+            return True
+
+        if simulator is None:
+            model.run(output_directory=output_directory, **run_kwargs)
+        else:
+            simulator.run(model, output_directory, **run_kwargs)
+        self.store(key, output_directory)
+
+        return False
+
+
+    def restore(self, key, output_directory) -> bool:
+        '''
+        Copies the outputs stored under key into output_directory, returns False on a miss
+        '''
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return False
+
+        shutil.copytree(path, output_directory, dirs_exist_ok=True)
+
+        # mark entry as recently used
+        os.utime(path)
+        self.hits += 1
+
+        return True
+
+
+    def store(self, key, output_directory) -> None:
+        '''
+        Stores the files in output_directory under key
+        '''
+        path = os.path.join(self.cache_dir, key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.copytree(output_directory, tmp)
+
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # a concurrent run of the same model stored it first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+
+    def record(self, hit: bool) -> None:
+        '''
+        Counts a lookup done by a copy of this cache in a worker process
+        '''
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, file))
+                       for root, _, files in os.walk(path) for file in files)
+            entries.append((os.stat(path).st_mtime, size, path))
+
+        return entries
+
+
+    def _remove(self, path) -> None:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def simulator_version(model) -> str:
+    '''
+    Returns the EnergyPlus version a model is run with, as given by its IDD
+    and the ENERGYPLUS_VERSION environment variable if set
+    '''
+    idd_version = '.'.join(str(part) for part in getattr(model, 'idd_version', None) or ())
+
+    return f'{idd_version}:{os.environ.get("ENERGYPLUS_VERSION", "")}'
+
@@ -1,23 +1,45 @@
-import matplotlib.pyplot as plt
-plt.style.use('bmh')
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from tqdm import tqdm
+from datetime import datetime, timedelta
 import os
 
-def mtr2df(filename, twoweeks=False, do_plot=False):
+from utils.time_utils import fields_to_index
+
+# report codes in the data dictionary that describe time records rather than meters
+MTR_TIME_CODES = {1, 2, 3, 4, 5, 6}
+
+# bump whenever the frame returned by mtr2df changes; invalidates cached results
+MTR2DF_VERSION = 3
+
+
+def mtr2df(filename, start=None, end=None, twoweeks=False, do_plot=False, year=2020):
     '''
     Reads the .mtr output file (usually 'eplusout.mtr')
     of a besos simulation
 
+    The record stream is split by report code into one column per meter
+    in a single pass over the file; the timestamp index is built in one
+    vectorized step afterwards. Reading stops as soon as a timestep
+    starting after 'end' is encountered.
+
     Parameters
     ----------
     filename : str
         mtr file to be read
+    start : pd.Timestamp or str
+        if given, timesteps before start are skipped
+    end : pd.Timestamp or str
+        if given, timesteps starting after end are not read, i.e. end
+        is inclusive as in utils.sql_utils.sql2df
     twoweeks : bool
         if true only reads the data for the first two weeks
+        (shorthand for end = first timestep + 14 days)
     do_plot : bool
         if true, plots the data obtained from an .mtr file
+    year : int
+        year assigned to the timestamps of the first year of every
+        environment (.mtr files carry no year); runs spanning several
+        years continue into the following years
 
     
     Returns
@@ -27,69 +49,76 @@ def mtr2df(filename, twoweeks=False, do_plot=False):
 
     '''
 
-    file = open(filename, 'r')
-    lines = file.readlines()
+    start_key = _window_key(start, year)
+    end_key = _window_key(end, year)
 
-    df = pd.DataFrame()
+    columns = {}
+    sparse = set()
+    with open(filename, 'r') as file:
 
-    columns = []
-
-    # determine end of preamble
-    for i, line in enumerate(lines):
-        
-        if line.startswith('End of Data'):
-            separation = i+1
-            break
-
-    preamble = lines[:separation]
-    for line in preamble[::-1]:
-        line = line.partition(',')
-        indicator = line[0]
-        try:
-            indicator = int(indicator)
-            if indicator == 6:
+        # data dictionary: maps report code to meter name
+        for line in file:
+            if line.startswith('End of Data'):
                 break
 
-            col = line[-1]
-            if ',' in col:
-                col = col.partition(',')[-1]
+            _add_dictionary_entry(line, columns, sparse)
 
-            if col.endswith('\n'):
-                col = col[:-1]
-            columns.append(col)
+        values = {code: [] for code in columns}
+        rows = {code: [] for code in sparse}
+        months, days, hours, minutes, years = [], [], [], [], []
 
-        except ValueError:
-            continue
-    
-    lines = lines[separation+1:]
-    columns = columns[::-1]
-    len_data = len(lines) // (len(columns) + 1)
-    num_cols = len(columns) + 1
+        n_rows = 0
+        active = start_key is None
+        # years since the start of the environment, counted up when the dates wrap into the next year
+        wraps, last_day = 0, None
+        for line in file:
+            code, _, rest = line.partition(',')
 
-    df = pd.DataFrame(columns=['timestamp']+columns)
+            if code == '2':
+                date = rest.split(',')
+                month = int(date[1])
+                day = int(date[2])
+                hour = int(date[4]) - 1
+                if last_day is not None and month * 32 + day < last_day:
+                    wraps += 1
+                last_day = month * 32 + day
+                key = _time_key(wraps, month, day, hour * 60 + int(float(date[5])))
 
-    if twoweeks: 
-        len_data = 24 * 14
+                if twoweeks and end_key is None:
+                    first = datetime(year + wraps, month, day) + timedelta(days=14)
+                    end_key = _window_key(first, year) - 1
 
-    for i in tqdm(range(len_data)):
-        date = lines[i * num_cols].split(',')
-        month = int(date[2])
-        day = int(date[3])
-        hour = int(date[5]) - 1
-        weekday = date[-1]
-        date = pd.Timestamp(datetime(2020, month, day, hour, 0, 0))
+                if end_key is not None and key > end_key:
+                    break
+                active = start_key is None or key >= start_key
+                if not active:
+                    continue
 
-        row = {'timestamp': date} 
-        for j, col in enumerate(columns):
-            line = lines[i * num_cols + j + 1].split(',')[-1]
-            row[col] = float(line)
+                months.append(month)
+                days.append(day)
+                hours.append(hour)
+                minutes.append(date[5])
+                years.append(year + wraps)
+                n_rows += 1
 
-        df = df.append(row, ignore_index=True)
+            elif code == '1':
+                # a new environment starts in the first year again
+                wraps, last_day = 0, None
 
-    df = df.set_index('timestamp')
+            elif active and n_rows > 0:
+                column = values.get(code)
+                if column is None:
+                    continue
+                column.append(rest)
+                if code in sparse:
+                    rows[code].append(n_rows)
+
+    df = _build_frame(columns, sparse, values, rows, months, days, hours, minutes, years)
 
 
     if do_plot:
+        import matplotlib.pyplot as plt
+
         print('Obtained data:')
         _, ax = plt.subplots(1, 1, figsize=(16, 4))
         ax.set_title('Power flow in: ', filename)
@@ -101,6 +130,247 @@ def mtr2df(filename, twoweeks=False, do_plot=False):
     return df
 
 
+def _add_dictionary_entry(line, columns, sparse) -> None:
+    '''
+    adds the meter defined by a data dictionary line to columns (and sparse if
+    it is reported less often than every timestep); time records are ignored
+    '''
+    code, _, rest = line.partition(',')
+    try:
+        code = int(code)
+    except ValueError:
+        return
+    if code in MTR_TIME_CODES:
+        return
+
+    col = rest.partition(',')[-1].rstrip('\n')
+    columns[str(code)] = col
+    if not col.endswith(('!Hourly', '!TimeStep', '!Each Call')):
+        sparse.add(str(code))
+
+
+class MtrTail:
+    '''
+    Incremental reader of an .mtr file that is still being written.
+
+    Every call of read parses the lines appended since the previous call
+    and returns the timesteps that are complete, i.e. followed by the next
+    timestep record or the end of data; the last timestep is held back
+    until then, so daily meters written after it are not missed. Partially
+    written lines are kept until their end arrives. If the file is replaced
+    or truncated (a new run started), the reader starts over and counts a
+    reset; if it is moved away, the file opened before is read on. The frames have the same columns and index as those of mtr2df.
+
+    Attributes:
+        filename(str): path of the .mtr file, which need not exist yet
+        year(int): year assigned to the timestamps
+        rows(int): number of timesteps returned since the last reset
+        resets(int): number of times the file was replaced
+        finished(bool): the end of data has been read
+    '''
+
+    def __init__(self, filename: str, year=2020):
+
+        self.filename = filename
+        self.year = year
+        self.resets = 0
+        self._start()
+
+
+    def _start(self):
+
+        self._file = None
+        self._inode = None
+        self._position = 0
+        self._partial = b''
+        self._in_dictionary = True
+        self.columns = {}
+        self.sparse = set()
+        self.rows = 0
+        self.finished = False
+        # year of the latest timestep, counted up when the dates wrap into the next year
+        self._year = self.year
+        self._last_key = None
+        self._clear()
+
+
+    def _clear(self):
+
+        self._values = {code: [] for code in self.columns}
+        self._rows = {code: [] for code in self.sparse}
+        self._time = ([], [], [], [], [])
+
+
+    def read(self, final=False) -> pd.DataFrame:
+        '''
+        Returns the complete timesteps appended since the last call, None if there are none
+
+        Args:
+            final(bool): the writer has exited, so the last timestep is complete as well
+        '''
+        if not self._open():
+            return None
+
+        chunk = self._file.read()
+        self._position += len(chunk)
+        lines = (self._partial + chunk).split(b'\n')
+        self._partial = lines.pop()
+        if final and self._partial:
+            lines.append(self._partial)
+            self._partial = b''
+
+        months, days, hours, minutes, years = self._time
+        for line in lines:
+            line = line.decode().rstrip('\r')
+            if self._in_dictionary:
+                if line.startswith('End of Data Dictionary'):
+                    self._in_dictionary = False
+                    self._clear()
+                    months, days, hours, minutes, years = self._time
+                else:
+                    _add_dictionary_entry(line, self.columns, self.sparse)
+                continue
+
+            code, _, rest = line.partition(',')
+            if code == '2':
+                date = rest.split(',')
+                months.append(int(date[1]))
+                days.append(int(date[2]))
+                hours.append(int(date[4]) - 1)
+                minutes.append(date[5])
+                key = months[-1] * 32 + days[-1]
+                if self._last_key is not None and key < self._last_key:
+                    self._year += 1
+                self._last_key = key
+                years.append(self._year)
+            elif code == '1':
+                # a new environment starts in the first year again
+                self._year, self._last_key = self.year, None
+            elif line.startswith('End of Data'):
+                self.finished = True
+            elif months:
+                column = self._values.get(code)
+                if column is None:
+                    continue
+                column.append(rest)
+                if code in self.sparse:
+                    self._rows[code].append(len(months))
+
+        return self._take(len(months) if final or self.finished else len(months) - 1)
+
+
+    def _take(self, n: int) -> pd.DataFrame:
+        '''
+        removes the first n buffered timesteps and returns them as frame
+        '''
+        if n <= 0:
+            return None
+
+        rows = {code: [row for row in records if row <= n] for code, records in self._rows.items()}
+        values = {code: records[:len(rows[code]) if code in self.sparse else n]
+                  for code, records in self._values.items()}
+        time_fields = [fields[:n] for fields in self._time]
+
+        df = _build_frame(self.columns, self.sparse, values, rows, *time_fields)
+
+        for code, records in self._values.items():
+            taken = len(rows[code]) if code in self.sparse else n
+            del records[:taken]
+        for code, records in self._rows.items():
+            self._rows[code] = [row - n for row in records if row > n]
+        for fields in self._time:
+            del fields[:n]
+        self.rows += n
+
+        return df
+
+
+    def _open(self) -> bool:
+        '''
+        opens the file once it exists and starts over if it was replaced or truncated
+        '''
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            # moved away once complete, e.g. by RunExecutor; the open file is read to its end
+            return self._file is not None
+
+        if self._file is not None:
+            replaced = (stat.st_ino, stat.st_dev) != self._inode
+            if not replaced and stat.st_size >= self._position:
+                return True
+            self._file.close()
+            self.resets += 1
+            self._start()
+
+        self._file = open(self.filename, 'rb')
+        self._inode = (stat.st_ino, stat.st_dev)
+        return True
+
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _build_frame(columns, sparse, values, rows, months, days, hours, minutes, years) -> pd.DataFrame:
+    '''
+    Builds the timestamp indexed frame of parsed .mtr records
+
+    Args:
+        columns(dict): report code -> meter name
+        sparse(set): codes of meters reported less often than every timestep
+        values(dict): code -> value fields of its records
+        rows(dict): sparse code -> (one based) row of each of its records
+        months, days, hours, minutes(list): time fields of every timestep record
+        years(int or array-like): year of every timestep record, or one year for all
+    '''
+    n_rows = len(months)
+    years = np.full(n_rows, years) if np.isscalar(years) else years
+    timestamps = fields_to_index(years, months, days, hours, minutes)
+
+    data = {}
+    for code, col in columns.items():
+        records = values[code]
+        if records and ',' in records[0]:
+            # lower frequencies append min/max fields after the value
+            records = [record.partition(',')[0] for record in records]
+        column = np.array(records, dtype=float)
+
+        if code not in sparse:
+            data[col] = column
+        else:
+            # meter reports at a lower frequency than the timestep
+            data[col] = np.full(n_rows, np.nan)
+            data[col][np.asarray(rows[code], dtype=np.int64) - 1] = column
+
+    return pd.DataFrame(data, index=timestamps)
+
+
+def _window_key(date, year: int):
+    '''
+    Encodes a date as integer key to compare against the start of the time
+    records of .mtr and .eso files without building timestamps, see _time_key
+
+    Args:
+        date(pd.Timestamp or str): bound of the window, None for none
+        year(int): year of the first records of the run
+    '''
+    if date is None:
+        return None
+    date = pd.Timestamp(date)
+    return _time_key(date.year - year, date.month, date.day, date.hour * 60 + date.minute)
+
+
+def _time_key(wraps: int, month: int, day: int, minute: int) -> int:
+    '''
+    Encodes (years since the first year of the run, month, day, minute of day) as
+    integer key ordered like the timestamps, also for runs spanning several years
+    '''
+    return ((wraps * 13 + month) * 32 + day) * 1440 + minute
+
+
 
 if __name__ == '__main__':
     filename = os.path.join(os.getcwd(), 'src', 'dump', 'eplusout.mtr')
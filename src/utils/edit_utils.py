@@ -0,0 +1,401 @@
+# eppy is imported where it is needed, see utils.idf_utils
+
+
+# values accepted by numeric fields flagged autosizable / autocalculatable in the IDD
+_AUTO_VALUES = {'autosize': 'autosizable', 'autocalculate': 'autocalculatable'}
+
+
+class EditIndex:
+    '''
+    Positions of the classes, objects and fields of a model, for edits by position.
+
+    The index is built once per prototype building, see IDFTemplateCache.index,
+    and maps (class, object name, field) to the object's position in
+    model.model.dt[class] and the field's position in the object's field list.
+    Those positions are the same in every copy of the prototype, so edits
+    resolved once (see EditPlan) are written into any number of copies
+    without looking up objects by name or fields through eppy's attribute
+    access. Field names are those eppy uses, e.g. 'Begin_Day_of_Month'.
+
+    Attributes:
+        idd(list): IDD description of every class, shared with the model (model.idd_info)
+        classes(dict): upper class name -> position in model.model.dtls and idd
+        names(dict): upper class name -> {upper object name -> position of the first
+            object of that name}; the name is the first field, as for IDF.getobject
+        counts(dict): upper class name -> number of objects in the model
+    '''
+
+    def __init__(self, model):
+
+        self.idd = model.idd_info
+        self.classes = {key.upper(): i for i, key in enumerate(model.model.dtls)}
+        self.names = {}
+        self.counts = {}
+        self._fields = {}
+        self._defaults = {}
+        self._data = model.model
+
+        for key, objs in model.model.dt.items():
+            names = {}
+            for i, obj in enumerate(objs):
+                if len(obj) > 1:
+                    names.setdefault(str(obj[1]).upper(), i)
+            self.names[key.upper()] = names
+            self.counts[key.upper()] = len(objs)
+
+
+    def fields(self, key: str) -> dict:
+        '''
+        returns field name -> position in the field list of objects of class key
+        '''
+        key = key.upper()
+        if key not in self._fields:
+            from eppy.bunchhelpers import makefieldname
+
+            comms = self.idd[self.classes[key]]
+            self._fields[key] = {makefieldname(comm['field'][0]): position
+                                 for position, comm in enumerate(comms) if position and 'field' in comm}
+
+        return self._fields[key]
+
+
+    def position(self, key: str, field: str) -> int:
+        '''
+        returns the position of field in objects of class key, None if the class has no such field;
+        field names match regardless of case
+        '''
+        fields = self.fields(key)
+        if field in fields:
+            return fields[field]
+
+        lower = field.lower()
+        return next((position for name, position in fields.items() if name.lower() == lower), None)
+
+
+    def default(self, key: str) -> list:
+        '''
+        returns a new field list of class key holding the IDD defaults, as IDF.newidfobject
+        '''
+        key = key.upper()
+        if key not in self._defaults:
+            from eppy.modeleditor import newrawobject
+            self._defaults[key] = newrawobject(self._data, self.idd, key)
+
+        return list(self._defaults[key])
+
+
+    def check(self, key: str, position: int, value) -> str:
+        '''
+        Returns why value does not fit the field at position of class key according to
+        the IDD (type, bounds, choices), None if it does. An empty value always fits.
+        '''
+        comm = self.idd[self.classes[key.upper()]][position]
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return None
+
+        kind = comm.get('type', [''])[0].lower()
+        if kind in ('real', 'integer'):
+            if isinstance(value, str) and value.strip().lower() in _AUTO_VALUES:
+                if _AUTO_VALUES[value.strip().lower()] in comm:
+                    return None
+                return f'{value!r} is not allowed'
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                return f'{value!r} is not a number'
+            if kind == 'integer' and number != int(number):
+                return f'{value!r} is not an integer'
+
+            for bound, outside in (('minimum', number < _bound(comm, 'minimum')),
+                                   ('minimum>', number <= _bound(comm, 'minimum>')),
+                                   ('maximum', number > _bound(comm, 'maximum')),
+                                   ('maximum<', number >= _bound(comm, 'maximum<'))):
+                if outside:
+                    return f'{value!r} violates {bound} {comm[bound][0]}'
+
+        elif kind == 'choice':
+            choices = comm.get('key', [])
+            if str(value).strip().lower() not in {choice.lower() for choice in choices}:
+                return f'{value!r} is none of {choices}'
+
+        return None
+
+
+def _bound(comm: dict, bound: str) -> float:
+    '''
+    returns the numeric bound of an IDD field, nan (never violated) if it has none
+    '''
+    try:
+        return float(comm[bound][0])
+    except (KeyError, IndexError, ValueError):
+        return float('nan')
+
+
+class EditPlan:
+    '''
+    Edits of copies of one prototype building, resolved by an EditIndex and
+    validated against the IDD before any model is touched.
+
+    Edits are collected with set, set_fields, add and update, each resolved
+    to a position once. Edits of objects of the prototype are written by
+    position into every model the plan is applied to; objects the plan
+    creates are assembled as field lists up front and only appended.
+    Invalid edits (unknown classes or fields, values of the wrong type,
+    out of bounds or none of the choices) are collected and reported all
+    at once by validate, which apply calls first, so a faulty variant
+    fails before its model is changed.
+
+    Example:
+        plan = EditPlan(template_cache.index(idf_file, EditIndex))
+        plan.set('RUNPERIOD', '', 'Begin_Month', 6)
+        plan.add('OUTPUT:METER', Key_Name='Electricity:Facility', Reporting_Frequency='hourly')
+        plan.update({'idf.Lights.Core_ZN_Lights.Watts_per_Zone_Floor_Area': 8.})
+        plan.apply(model)
+
+    Attributes:
+        index(EditIndex): index of the prototype
+        errors(List[str]): descriptions of the invalid edits
+        edits(int): number of valid field edits
+    '''
+
+    def __init__(self, index: EditIndex):
+
+        self.index = index
+        self.errors = []
+        self.edits = 0
+
+        # (class, object position) -> {field position: value} for objects of the prototype
+        self._sets = {}
+        # (class, field list) of the objects created, in order
+        self._new = []
+        # class -> {upper name: position in self._new}, and the first created object per class
+        self._new_names = {}
+        self._new_first = {}
+
+
+    def set(self, key: str, name: str, field: str, value) -> 'EditPlan':
+        '''
+        Sets field of the object name of class key to value, as eppy.json_functions.updateidf:
+        an empty name stands for the first object of the class, and an object that
+        does not exist is created (named name, if given)
+        '''
+        key = key.upper()
+        position = self._position(key, field, value, f'{key}.{name}.{field}')
+        if position is None:
+            return self
+
+        target = self._target(key, name)
+        if target is None:
+            return self
+
+        self._write(target, position, value)
+        self.edits += 1
+
+        return self
+
+
+    def set_fields(self, key: str, name: str, fields: dict) -> 'EditPlan':
+        '''
+        sets several fields of one object, see set
+        '''
+        for field, value in fields.items():
+            self.set(key, name, field, value)
+
+        return self
+
+
+    def add(self, key: str, **fields) -> 'EditPlan':
+        '''
+        Creates an object of class key holding the IDD defaults and fields, as IDF.newidfobject
+        '''
+        key = key.upper()
+        if key not in self.index.classes:
+            self.errors.append(f'{key}: no such class in the IDD')
+            return self
+
+        positions = {field: self._position(key, field, value, f'{key}.{field}') for field, value in fields.items()}
+        if any(position is None for position in positions.values()):
+            return self
+
+        target = self._create(key)
+        for field, value in fields.items():
+            self._write(target, positions[field], value)
+            self.edits += 1
+
+        return self
+
+
+    def update(self, json_update: dict) -> 'EditPlan':
+        '''
+        Adds the edits of a dict in the format of eppy.json_functions.updateidf,
+        'idf.<class>.<object name>.<field>' -> value; other keys are ignored
+        '''
+        for key, value in json_update.items():
+            if not key.startswith('idf.'):
+                continue
+            _, key_class, name, field = _key_elements(key)
+            self.set(key_class, name, field, value)
+
+        return self
+
+
+    def count(self, key: str) -> int:
+        '''
+        returns the number of objects of class key once the plan is applied
+        '''
+        key = key.upper()
+        return self.index.counts.get(key, 0) + sum(1 for new_key, _ in self._new if new_key == key)
+
+
+    def validate(self) -> None:
+        '''
+        raises a ValueError describing all invalid edits, if there are any
+        '''
+        if self.errors:
+            raise ValueError(f'{len(self.errors)} invalid IDF edits:\n  ' + '\n  '.join(self.errors))
+
+
+    def apply(self, model):
+        '''
+        Writes the edits into model, which must be the indexed prototype or a copy of it;
+        objects may have been appended to it, but none removed
+
+        Returns:
+            model(IDF)
+        '''
+        from eppy.modeleditor import obj2bunch
+
+        self.validate()
+
+        dt = model.model.dt
+        for (key, i), values in self._sets.items():
+            obj = dt[key][i]
+            length = max(values) + 1
+            if len(obj) < length:
+                obj.extend([''] * (length - len(obj)))
+            for position, value in values.items():
+                obj[position] = value
+
+        for key, obj in self._new:
+            model.idfobjects[key].append(obj2bunch(model.model, model.idd_info, list(obj)))
+
+        return model
+
+
+    def _position(self, key: str, field: str, value, label: str) -> int:
+        '''
+        returns the position of field in class key if value fits it, else records the error
+        '''
+        if key not in self.index.classes:
+            self.errors.append(f'{label}: no such class in the IDD')
+            return None
+
+        position = self.index.position(key, field)
+        if position is None:
+            self.errors.append(f'{label}: {key} has no field {field}')
+            return None
+
+        problem = self.index.check(key, position, value)
+        if problem is not None:
+            self.errors.append(f'{label}: {problem}')
+            return None
+
+        return position
+
+
+    def _target(self, key: str, name: str):
+        '''
+        returns (key, position, False) of an object of the prototype, (key, position in
+        self._new, True) of a created one; creates the object if there is none of that name
+        '''
+        if not name:
+            if self.index.counts.get(key):
+                return (key, 0, False)
+            if key in self._new_first:
+                return (key, self._new_first[key], True)
+            return self._create(key)
+
+        if name.upper() in self.index.names.get(key, {}):
+            return (key, self.index.names[key][name.upper()], False)
+        if name.upper() in self._new_names.get(key, {}):
+            return (key, self._new_names[key][name.upper()], True)
+
+        position = self.index.position(key, 'Name')
+        if position is None:
+            self.errors.append(f'{key}.{name}: no such object, and {key} has no Name to create it with')
+            return None
+
+        target = self._create(key)
+        self._write(target, position, name)
+
+        return target
+
+
+    def _create(self, key: str):
+        '''
+        appends an object of class key holding the IDD defaults to the objects created
+        '''
+        self._new.append((key, self.index.default(key)))
+        self._new_first.setdefault(key, len(self._new) - 1)
+
+        return (key, len(self._new) - 1, True)
+
+
+    def _write(self, target, position: int, value) -> None:
+        '''
+        records value for the field at position of target, see _target
+        '''
+        key, i, new = target
+        if not new:
+            self._sets.setdefault((key, i), {})[position] = value
+            return
+
+        obj = self._new[i][1]
+        if len(obj) <= position:
+            obj.extend([''] * (position + 1 - len(obj)))
+        obj[position] = value
+
+        # objects created are found by their name, the first field, as in IDF.getobject
+        if position == 1:
+            self._new_names.setdefault(key, {})[str(value).upper()] = i
+
+
+def _key_elements(key: str) -> list:
+    '''
+    splits 'idf.<class>.<name>.<field>' like eppy.json_functions.key2elements;
+    names may contain dots, and may be quoted to make that explicit
+    '''
+    words = key.split('.')
+    name = '.'.join(words[2:-1])
+    if name.startswith("'") and name.endswith("'"):
+        name = name[1:-1]
+
+    return words[:2] + [name, words[-1]]
+
+
+def write_idf(model, path: str) -> str:
+    '''
+    Writes the field values of model to path as IDF input of EnergyPlus
+
+    Produces the text of eppy's 'nocomment' output (one field per line,
+    no field comments), assembled in a single pass over the field lists.
+    IDF.saveas formats a comment with name and unit for every field, which
+    takes seconds even for small prototypes.
+
+    Returns:
+        str: path
+    '''
+    parts = []
+    for key in model.model.dtls:
+        for obj in model.model.dt[key]:
+            if len(obj) == 1:
+                parts.append(f'     {obj[0]};\n\n')
+                continue
+            parts.append(f'{obj[0]},\n')
+            parts.extend(f'     {value},\n' for value in obj[1:-1])
+            parts.append(f'     {obj[-1]};\n\n')
+
+    with open(path, 'w', encoding='latin-1') as file:
+        file.write(''.join(parts))
+
+    return path
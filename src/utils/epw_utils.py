@@ -0,0 +1,177 @@
+from datetime import timezone, timedelta
+import numpy as np
+import pandas as pd
+
+
+# columns of the data records, named as by pvlib.iotools.read_epw
+EPW_COLUMNS = ['year', 'month', 'day', 'hour', 'minute', 'data_source_unct',
+               'temp_air', 'temp_dew', 'relative_humidity', 'atmospheric_pressure',
+               'etr', 'etrn', 'ghi_infrared', 'ghi', 'dni', 'dhi',
+               'global_hor_illum', 'direct_normal_illum', 'diffuse_horizontal_illum',
+               'zenith_luminance', 'wind_direction', 'wind_speed', 'total_sky_cover',
+               'opaque_sky_cover', 'visibility', 'ceiling_height',
+               'present_weather_observation', 'present_weather_codes', 'precipitable_water',
+               'aerosol_optical_depth', 'snow_depth', 'days_since_last_snowfall', 'albedo',
+               'liquid_precipitation_depth', 'liquid_precipitation_quantity']
+
+# columns with decimals; all other numeric columns are integers
+FLOAT_COLUMNS = {'temp_air', 'temp_dew', 'wind_speed', 'visibility', 'aerosol_optical_depth',
+                 'albedo', 'liquid_precipitation_depth', 'liquid_precipitation_quantity'}
+
+# text column of the data source and uncertainty flags
+FLAG_COLUMN = 'data_source_unct'
+
+# columns the timestamps are computed from
+TIME_COLUMNS = ['year', 'month', 'day', 'hour']
+
+# number of header lines before the data records
+HEADER_LINES = 8
+
+LOCATION_FIELDS = ['city', 'state-prov', 'country', 'data_type', 'WMO_code',
+                   'latitude', 'longitude', 'TZ', 'altitude']
+
+
+def _number(field: str):
+    '''
+    returns field as float, or stripped as it is if it is no number
+    '''
+    try:
+        return float(field)
+    except ValueError:
+        return field.strip()
+
+
+def _parse_header(lines: list) -> dict:
+    '''
+    Parses the eight header lines of an epw file
+
+    Returns:
+        dict: the LOCATION fields (keys as returned by pvlib) and
+            design_conditions, typical_extreme_periods, ground_temperatures,
+            holidays_daylight_savings, comments and data_periods
+    '''
+    records = {}
+    for line in lines:
+        fields = line.rstrip('\r\n').split(',')
+        records[fields[0].strip().upper()] = fields[1:]
+
+    location = records.get('LOCATION', [])
+    meta = {'loc': 'LOCATION'}
+    for key, field in zip(LOCATION_FIELDS, location):
+        meta[key] = field.strip() if key in ('city', 'state-prov', 'country', 'data_type', 'WMO_code') \
+            else float(field)
+
+    fields = records.get('DESIGN CONDITIONS', ['0'])
+    design = {'count': int(fields[0] or 0), 'source': fields[1].strip() if len(fields) > 1 else ''}
+    section = None
+    for field in fields[2:]:
+        if field.strip() in ('Heating', 'Cooling', 'Extremes'):
+            section = design.setdefault(field.strip().lower(), [])
+        elif section is not None:
+            section.append(_number(field))
+    meta['design_conditions'] = design
+
+    fields = records.get('TYPICAL/EXTREME PERIODS', ['0'])
+    meta['typical_extreme_periods'] = [
+        {'name': name.strip(), 'type': kind.strip(), 'start': start.strip(), 'end': end.strip()}
+        for name, kind, start, end in zip(*[iter(fields[1:1 + 4 * int(fields[0] or 0)])] * 4)]
+
+    # per depth: depth, soil conductivity, density, specific heat and 12 monthly temperatures
+    fields = records.get('GROUND TEMPERATURES', ['0'])
+    ground = []
+    for i in range(int(fields[0] or 0)):
+        depth = [_number(field) for field in fields[1 + 16 * i: 17 + 16 * i]]
+        ground.append({'depth': depth[0],
+                       'conductivity': depth[1] if depth[1] != '' else None,
+                       'density': depth[2] if depth[2] != '' else None,
+                       'specific_heat': depth[3] if depth[3] != '' else None,
+                       'temperatures': depth[4:16]})
+    meta['ground_temperatures'] = ground
+
+    fields = records.get('HOLIDAYS/DAYLIGHT SAVINGS', ['No', '0', '0', '0'])
+    meta['holidays_daylight_savings'] = {
+        'leap_year_observed': fields[0].strip().lower() == 'yes',
+        'dst_start': fields[1].strip(),
+        'dst_end': fields[2].strip(),
+        'holidays': [(name.strip(), day.strip())
+                     for name, day in zip(*[iter(fields[4:4 + 2 * int(fields[3] or 0)])] * 2)]}
+
+    meta['comments'] = [','.join(records.get(f'COMMENTS {i}', [])).strip() for i in (1, 2)]
+
+    fields = records.get('DATA PERIODS', ['0', '1'])
+    meta['data_periods'] = {
+        'records_per_hour': int(fields[1] or 1),
+        'periods': [{'name': name.strip(), 'start_weekday': weekday.strip(),
+                     'start': start.strip(), 'end': end.strip()}
+                    for name, weekday, start, end in zip(*[iter(fields[2:2 + 4 * int(fields[0] or 0)])] * 4)]}
+
+    return meta
+
+
+def read_epw_header(filename: str) -> dict:
+    '''
+    Returns the header metadata of an epw file: location, design conditions,
+    typical and extreme periods, ground temperatures, holidays and data periods
+    '''
+    with open(filename, encoding='latin-1') as file:
+        lines = [file.readline() for _ in range(HEADER_LINES)]
+
+    return _parse_header(lines)
+
+
+def read_epw(filename: str, columns=None):
+    '''
+    Reads the data records of an epw file into numpy arrays
+
+    Only the requested columns are converted; the data source flags are
+    only read if they are requested. Returns the same frame and metadata
+    as pvlib.iotools.read_epw: integer columns are int64, the others
+    float64, and the index holds the start of every interval in the year
+    of the records and the time zone of the file.
+
+    Args:
+        filename(str): epw file
+        columns(List[str]): names in EPW_COLUMNS to be returned, all if None
+
+    Returns:
+        data(pd.DataFrame): requested columns
+        meta(dict): header metadata, see read_epw_header
+    '''
+    columns = list(EPW_COLUMNS if columns is None else columns)
+    unknown = [col for col in columns if col not in EPW_COLUMNS]
+    if unknown:
+        raise ValueError(f'Unknown epw columns {unknown}; choose from {EPW_COLUMNS}')
+
+    numeric = sorted(set(columns) - {FLAG_COLUMN} | set(TIME_COLUMNS), key=EPW_COLUMNS.index)
+    usecols = [EPW_COLUMNS.index(col) for col in numeric]
+
+    with open(filename, encoding='latin-1') as file:
+        meta = _parse_header([file.readline() for _ in range(HEADER_LINES)])
+        start = file.tell()
+        try:
+            values = np.loadtxt(file, delimiter=',', usecols=usecols, ndmin=2)
+        except ValueError:
+            # empty fields, as left by some converters, become nan
+            file.seek(start)
+            values = np.genfromtxt(file, delimiter=',', usecols=usecols, ndmin=2)
+
+        flags = None
+        if FLAG_COLUMN in columns:
+            file.seek(start)
+            flags = np.loadtxt(file, delimiter=',', usecols=EPW_COLUMNS.index(FLAG_COLUMN),
+                               dtype=str, ndmin=1, comments=None)
+
+    arrays = {}
+    for i, col in enumerate(numeric):
+        array = values[:, i]
+        if col not in FLOAT_COLUMNS and np.isfinite(array).all():
+            array = array.astype(np.int64)
+        arrays[col] = array
+
+    index = pd.to_datetime(pd.DataFrame({'year': arrays['year'], 'month': arrays['month'],
+                                         'day': arrays['day'], 'hour': arrays['hour'] - 1}))
+    index = pd.DatetimeIndex(index).tz_localize(timezone(timedelta(hours=meta.get('TZ', 0.))))
+
+    data = {col: flags if col == FLAG_COLUMN else arrays[col] for col in columns}
+
+    return pd.DataFrame(data, index=index, columns=columns), meta
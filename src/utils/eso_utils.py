@@ -0,0 +1,318 @@
+import re
+import numpy as np
+import pandas as pd
+
+from utils.data_utils import _time_key, _window_key
+from utils.time_utils import fields_to_index
+
+
+# report codes of the time records, by the frequency of the series that follow them
+ESO_TIME_CODES = {'1': 'Environment', '2': 'TimeStep', '3': 'Daily', '4': 'Monthly', '5': 'RunPeriod', '6': 'Annual'}
+
+# frequencies whose series follow a code 2 record
+STEP_FREQUENCIES = ('Each Call', 'TimeStep', 'Hourly')
+
+# order in which the frames of eso2df are returned, finest first
+FREQUENCY_ORDER = ['Each Call', 'TimeStep', 'Hourly', 'Daily', 'Monthly', 'RunPeriod', 'Annual']
+
+
+def eso_dictionary(filename: str) -> pd.DataFrame:
+    '''
+    Reads the data dictionary at the top of an .eso (or .mtr) file
+
+    Returns:
+        pd.DataFrame: one row per series with its report code, column name
+            (as in mtr2df, e.g. 'SPACE1-1,Zone Mean Air Temperature [C] !TimeStep'),
+            key (empty for meters), name, units and frequency
+    '''
+    rows = []
+    with open(filename, 'r') as file:
+        for line in file:
+            if line.startswith('End of Data'):
+                break
+            entry = _parse_entry(line)
+            if entry is not None:
+                rows.append(entry)
+
+    return pd.DataFrame(rows, columns=['code', 'column', 'key', 'name', 'units', 'frequency'])
+
+
+def _parse_entry(line: str):
+    '''
+    returns (code, column, key, name, units, frequency) of a data dictionary line, None for time records
+    '''
+    code, _, rest = line.partition(',')
+    if code in ESO_TIME_CODES or not code.isdigit():
+        return None
+
+    column = rest.partition(',')[-1].rstrip('\n')
+    head, _, frequency = column.partition(' !')
+    key, _, variable = head.rpartition(',')
+    name, _, units = variable.rpartition(' [')
+
+    # lower frequencies list their min/max fields after the frequency
+    return code, column, key, name, units.rstrip(']'), frequency.partition(' [')[0]
+
+
+def _matches(request: str, column: str, key: str, name: str) -> bool:
+    '''
+    a requested series matches its full column name, the name without
+    frequency, its variable or meter name alone or key,name
+    '''
+    return request in (column, column.partition(' !')[0], name, f'{key},{name}')
+
+
+def eso2df(filename: str, names=None, start=None, end=None, year=2020, environment=None) -> dict:
+    '''
+    Reads selected series of the .eso output (usually 'eplusout.eso') of an EnergyPlus run
+
+    The data dictionary is read first; the records are then read in one
+    pass in which only the report codes of the requested series are kept
+    and all other records skipped without being parsed. Time records are
+    only parsed if a requested record follows them. Every frequency gets
+    a frame of its own:
+
+        - 'Each Call', 'TimeStep', 'Hourly': indexed by the start of the interval
+        - 'Daily', 'Monthly': indexed by the first day of the period
+        - 'RunPeriod': indexed by the number of the run period
+        - 'Annual': indexed by the calendar year
+
+    Parameters
+    ----------
+    filename : str
+        eso (or mtr) file to be read
+    names : List[str]
+        series to be read, either full column names ('SPACE1-1,Zone Mean Air
+        Temperature [C] !TimeStep'), without frequency, key,name or only the
+        variable or meter name; all if None
+    start, end : pd.Timestamp or str
+        if given, only timesteps starting from start until end (inclusive, to the
+        minute, as in utils.sql_utils.sql2df) and the days from the day of start
+        until end are read; monthly and longer periods are not windowed
+    year : int
+        year assigned to the timestamps of the first year of every
+        environment (.eso files carry no year); runs spanning several
+        years continue into the following years
+    environment : int or str
+        only read this environment (sizing periods and run periods, in file
+        order from 0, or a part of its title such as 'RUN PERIOD 1'); all if None
+
+    Returns
+    ----------
+    frames : dict
+        frequency -> pd.DataFrame of its requested series, finest frequency first
+    '''
+    series = dictionary = eso_dictionary(filename)
+    if names is not None:
+        missing = [request for request in names if not any(
+            _matches(request, column, key, name)
+            for column, key, name in zip(series.column, series.key, series.name))]
+        if missing:
+            raise KeyError(f'Series {missing} not in {filename}')
+        series = series[[any(_matches(request, column, key, name) for request in names)
+                         for column, key, name in zip(series.column, series.key, series.name)]]
+
+    wanted = dict(zip(series.code, series.column))
+    frequencies = dict(zip(series.code, series.frequency))
+    values = {code: [] for code in wanted}
+    # position in times of the time record each value belongs to
+    positions = {code: [] for code in wanted}
+
+    # time records preceding a requested record: (report code, fields, years since the start of its environment)
+    times = []
+    start_key, end_key = _window_key(start, year), _window_key(end, year)
+    windowed = start_key is not None or end_key is not None
+
+    # appenders of the values and their time record positions per code
+    appenders = {code: (values[code].append, positions[code].append) for code in wanted}
+
+    n_environment = -1
+    selected = environment is None
+    last, row, inside = None, None, True
+    # years since the start of the environment, counted up when the dates wrap into the next year
+    wraps, last_day = 0, None
+    with open(filename, 'r') as file:
+        for line in file:
+            if line.startswith('End of Data'):
+                break
+
+        # the pattern only pays off if most records are skipped
+        selective = len(wanted) <= len(dictionary) // 4
+        for code, rest in _records(file, list(wanted) + list(ESO_TIME_CODES), selective=selective):
+            append = appenders.get(code)
+            if append is not None:
+                if last is None or not (selected and inside):
+                    continue
+                if row is None:
+                    times.append(last)
+                    row = len(times) - 1
+                append[0](rest)
+                append[1](row)
+
+            elif code == '1':
+                n_environment += 1
+                selected = environment is None or _is_environment(environment, n_environment, rest)
+                last = None
+                wraps, last_day = 0, None
+
+            else:
+                fields = rest.split(',')
+                day = _day_key(code, fields)
+                if day is not None:
+                    if last_day is not None and day < last_day:
+                        wraps += 1
+                    last_day = day
+
+                # only stored once a requested record follows
+                last, row = (code, rest, wraps), None
+                if windowed and code in ('2', '3'):
+                    inside = _inside(code, fields, wraps, start_key, end_key)
+                elif windowed:
+                    # monthly and longer periods are not windowed
+                    inside = True
+
+    frames = {}
+    for frequency in FREQUENCY_ORDER:
+        codes = [code for code in wanted if frequencies[code] == frequency]
+        if codes:
+            frames[frequency] = _build_frame(frequency, codes, wanted, values, positions, times, year)
+
+    print(f'Done with file {filename}!')
+
+    return frames
+
+
+def _records(file, codes, selective=True, block_size=2**24):
+    '''
+    Yields (code, fields) of the records of file with one of codes, until 'End of Data'
+
+    The file is read in blocks. If selective, the blocks are searched for
+    the lines of codes by a compiled pattern, so all other records are
+    skipped without creating a Python string per line; otherwise, when
+    most records are requested, the blocks are split into lines.
+    '''
+    # longest first, so that e.g. 12 is not read as 1
+    pattern = re.compile(r'\n(%s),([^\n]*)' % '|'.join(sorted(codes, key=len, reverse=True)))
+    codes = set(codes)
+
+    tail = ''
+    while True:
+        block = file.read(block_size)
+        if not block:
+            block, tail = tail, ''
+            if not block:
+                return
+        else:
+            # complete lines only, the rest is prepended to the next block
+            block, cut, rest = (tail + block).rpartition('\n')
+            block, tail = block + cut, rest
+
+        end = block.find('End of Data')
+        if end >= 0:
+            block = block[:end]
+
+        if selective:
+            # every line of the block, including the first, starts after a newline
+            for match in pattern.finditer('\n' + block):
+                yield match.group(1), match.group(2)
+        else:
+            for line in block.split('\n'):
+                code, _, rest = line.partition(',')
+                if code in codes:
+                    yield code, rest
+
+        if end >= 0:
+            return
+
+
+def _is_environment(environment, number: int, title: str) -> bool:
+    '''
+    tells whether the environment with number and title (its code 1 record) is the requested one
+    '''
+    if isinstance(environment, str):
+        return environment.upper() in title.partition(',')[0].upper()
+    return environment == number
+
+
+def _day_key(code: str, fields: list):
+    '''
+    returns the (month, day) key of a timestep, daily or monthly time record, by which the
+    dates wrapping into the next year are found; monthly records count as the end of the month
+    '''
+    if code in ('2', '3'):
+        return int(fields[1]) * 32 + int(fields[2])
+    if code == '4':
+        return int(fields[1]) * 32 + 32
+    return None
+
+
+def _inside(code: str, fields: list, wraps: int, start_key, end_key) -> bool:
+    '''
+    tells whether the period of a code 2 (timestep) or code 3 (daily) time record lies in the window
+    '''
+    month, day = int(fields[1]), int(fields[2])
+    # timesteps by the start of their interval, days by their midnight
+    minute = (int(fields[4]) - 1) * 60 + int(float(fields[5])) if code == '2' else 0
+    key = _time_key(wraps, month, day, minute)
+
+    if start_key is not None and key < (start_key if code == '2' else start_key - start_key % 1440):
+        return False
+    return end_key is None or key <= end_key
+
+
+def _time_index(frequency: str, records: list, year: int) -> pd.Index:
+    '''
+    builds the index of a frame from the time records of its rows
+    '''
+    fields = [rest.rstrip('\n').split(',') for _, rest, _ in records]
+
+    if frequency in STEP_FREQUENCIES or frequency in ('Daily', 'Monthly'):
+        months = np.array([int(field[1]) for field in fields], dtype=np.int64)
+        if frequency == 'Monthly':
+            days = np.ones(len(fields), dtype=np.int64)
+        else:
+            days = np.array([int(field[2]) for field in fields], dtype=np.int64)
+        # counted while reading, as the records outside a window are skipped
+        years = year + np.array([wraps for _, _, wraps in records], dtype=np.int64)
+
+        if frequency not in STEP_FREQUENCIES:
+            return fields_to_index(years, months, days)
+        hours = np.array([int(field[4]) - 1 for field in fields], dtype=np.int64)
+        minutes = np.array([float(field[5]) for field in fields])
+        return fields_to_index(years, months, days, hours, minutes)
+
+    if frequency == 'Annual':
+        return pd.Index([int(field[0]) for field in fields], name='year')
+
+    return pd.RangeIndex(len(fields), name='period')
+
+
+def _build_frame(frequency, codes, columns, values, positions, times, year) -> pd.DataFrame:
+    '''
+    Builds the frame of the series codes reported at frequency
+
+    Args:
+        columns(dict): code -> column name
+        values(dict): code -> value fields of its records
+        positions(dict): code -> position in times of the time record of each value
+        times(list): time records (report code, fields, years) followed by requested records
+    '''
+    rows_of = {code: np.asarray(positions[code], dtype=np.int64) for code in codes}
+    rows = np.unique(np.concatenate(list(rows_of.values())))
+    index = _time_index(frequency, [times[row] for row in rows], year)
+
+    data = {}
+    for code in codes:
+        records = values[code]
+        if records and ',' in records[0]:
+            # lower frequencies append min/max fields after the value
+            records = [record.partition(',')[0] for record in records]
+        column = np.array(records, dtype=float)
+        if len(column) != len(rows):
+            # reported for some of the rows only, e.g. in some of the environments
+            sparse = np.full(len(rows), np.nan)
+            sparse[np.searchsorted(rows, rows_of[code])] = column
+            column = sparse
+        data[columns[code]] = column
+
+    return pd.DataFrame(data, index=index)
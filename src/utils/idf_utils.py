@@ -1,34 +1,192 @@
 import os
+import time
+import copy
 import pandas as pd
 from datetime import datetime
-from besos import eppy_funcs as ef, sampling
-import eppy.json_functions as json_functions
 import numpy as np
-from eppy.modeleditor import IDF
 pd.set_option('display.max_columns', None)
-import matplotlib.pyplot as plt
-plt.style.use('bmh')
 
-print(os.getcwd())
-
-from utils.data_utils import mtr2df
+from utils.schedule_utils import ScheduleIndex
+from utils.edit_utils import EditIndex, EditPlan
 from config import idf_dict
 from config import weather_dict
 
+# besos and eppy are imported where they are needed; importing them takes
+# longer than anything else in this module and processes that only handle
+# outputs never use them
+
+class IDFTemplateCache:
+    '''
+    Parses every prototype building once per process and hands out
+    independent copies of it.
+
+    Copies share the IDD metadata with the template but own their field
+    values, so edits on one copy (runperiod, outputs, json updates) do
+    not leak into the template or into other copies. Copying is orders of
+    magnitude cheaper than parsing the IDF file again.
+
+    Attributes:
+        templates(dict): parsed models keyed by (abs. IDF path, mtime, IDD file)
+        indexes(dict): indexes built from the templates, see IDFTemplateCache.index
+        parses(int): number of IDF files parsed
+        clones(int): number of copies handed out
+        parse_time(float): total seconds spent parsing
+        clone_time(float): total seconds spent copying
+    '''
+
+    def __init__(self):
+
+        self.templates = {}
+        self.indexes = {}
+
+        self.parses = 0
+        self.clones = 0
+        self.parse_time = 0.
+        self.clone_time = 0.
+
+
+    def get(self, idf_file: str, weather_file: str = None):
+        '''
+        Returns an independent copy of the model in idf_file with weather_file attached
+
+        Args:
+            idf_file(str): path to the prototype IDF
+            weather_file(str): path to the epw file used when running the model
+        '''
+        template = self.templates.get(self._key(idf_file))
+
+        if template is None:
+            from besos import eppy_funcs as ef
+
+            start = time.perf_counter()
+            template = ef.get_building(idf_file)
+            self.parse_time += time.perf_counter() - start
+            self.parses += 1
+
+            # the IDD is only known for sure after the first parse
+            self.templates[self._key(idf_file)] = template
+
+        start = time.perf_counter()
+        model = self.clone(template)
+        self.clone_time += time.perf_counter() - start
+        self.clones += 1
+
+        # eppy writes a temporary copy next to idfname when running;
+        # keep it in the current working directory as before
+        model.idfname = os.path.basename(idf_file)
+        model.idfabsname = os.path.abspath(model.idfname)
+        model.epw = weather_file
+
+        return model
+
+
+    def index(self, idf_file: str, builder):
+        '''
+        Returns builder(template) for the template of idf_file, built only once.
+        Used for indexes such as ScheduleIndex that are valid for all copies.
+        '''
+        if self._key(idf_file) not in self.templates:
+            self.get(idf_file)
+
+        key = (self._key(idf_file), builder)
+        if key not in self.indexes:
+            self.indexes[key] = builder(self.templates[self._key(idf_file)])
+
+        return self.indexes[key]
+
+
+    @staticmethod
+    def clone(template):
+        '''
+        Returns a copy of template that owns all field values but shares the IDD
+
+        The objects of the copy point to the copy (EpBunch.theidf), so edits
+        through them, e.g. surface functions or getrange, never reach the template.
+        '''
+        from eppy.idf_msequence import Idf_MSequence
+        from eppy.EPlusInterfaceFunctions.structures import CaseInsensitiveDict
+
+        model = copy.copy(template)
+        model.model = copy.copy(template.model)
+        model.model.dtls = list(template.model.dtls)
+        model.model.dt = {}
+        model.idfobjects = CaseInsensitiveDict()
+
+        for key, bunches in template.idfobjects.items():
+            objs = []
+            new_bunches = []
+            for bunch in bunches.list1:
+                new_bunch = type(bunch).__new__(type(bunch))
+                dict.update(new_bunch, bunch)
+                new_bunch['obj'] = list(bunch['obj'])
+                new_bunch['objls'] = list(bunch['objls'])
+                new_bunch['__functions'] = dict(bunch['__functions'])
+                # not all versions of eppy rebind it in Idf_MSequence
+                new_bunch['theidf'] = model
+
+                objs.append(new_bunch['obj'])
+                new_bunches.append(new_bunch)
+
+            model.model.dt[key] = objs
+            model.idfobjects[key] = Idf_MSequence(new_bunches, objs, model)
+
+        return model
+
+
+    def stats(self) -> dict:
+        '''
+        Returns counters and timings of parsing and copying
+        '''
+        return {'templates': len(self.templates),
+                'parses': self.parses,
+                'clones': self.clones,
+                'parse_time': self.parse_time,
+                'clone_time': self.clone_time,
+                'mean_clone_time': self.clone_time / self.clones if self.clones else 0.}
+
+
+    def report(self) -> None:
+        '''
+        prints build time statistics
+        '''
+        stats = self.stats()
+        print(f'Parsed {stats["parses"]} IDF files in {stats["parse_time"]:.2f}s, '
+              f'handed out {stats["clones"]} copies in {stats["clone_time"]:.2f}s '
+              f'({1000*stats["mean_clone_time"]:.1f}ms each).')
+
+
+    @staticmethod
+    def _key(idf_file):
+        from eppy.modeleditor import IDF
+        return (os.path.abspath(idf_file), os.path.getmtime(idf_file), IDF.getiddname())
+
+
+# process wide cache of parsed prototype buildings
+template_cache = IDFTemplateCache()
+
+
 def build_model(config : dict, view=False, json_update=None):
     '''
     builds an energyplus model from config file to be executed via
     'model.run()'
 
+    The prototype building is parsed only once per process, see IDFTemplateCache.
+    Runperiod, outputs and json_update are collected in one EditPlan, validated
+    against the IDD and written into the copy by position, see utils.edit_utils
+
     Args:
         config(AttrDict): model configuration
         view(bool): if True plots the current model
-        json_update(dict): updates idf using eppy.json_functions.update_idf
+        json_update(dict): updates idf as eppy.json_functions.updateidf,
+            defaults to config.json_update
     '''
 
 
     idf_file = os.path.join(config.idf_path, idf_dict[config.building_type])
-    model = ef.get_building(idf_file)
+    weather_file = os.path.join(config.weather_path, weather_dict[config.location])
+    print('using weather file')
+    print(weather_file)
+    model = template_cache.get(idf_file, weather_file)
 
     if view:
         model.view()
@@ -40,16 +198,8 @@ def build_model(config : dict, view=False, json_update=None):
                                 config.end_month, 
                                 config.end_day))
 
-    set_runperiod(model, start=start, end=end)
-
-    hold_file = 'hold_model.idf'
-    model.saveas(hold_file)
-    weather_file = os.path.join(config.weather_path, weather_dict[config.location])
-    print('using weather file')
-    print(weather_file)
-    model = IDF(hold_file, weather_file)
-
-    os.remove(hold_file)
+    plan = EditPlan(template_cache.index(idf_file, EditIndex))
+    plan.set_fields('RUNPERIOD', '', runperiod_fields(start=start, end=end))
 
     # set output for model
     for datum_dict in config.building_config:
@@ -58,47 +208,44 @@ def build_model(config : dict, view=False, json_update=None):
         
         # each iteration adds output quantity
         datum = list(datum_dict)[0]
-        datum = datum.replace('_', ':')
+        plan.add(datum.replace('_', ':'), **datum_dict[datum])
 
-        newobj = model.newidfobject(datum)
-        for key, item in datum_dict[list(datum_dict)[0]].items():
-            setattr(newobj, key, item)
+    # read by DataClerk through utils.sql_utils.sql2df instead of the .mtr file
+    if config.get('output_reader') == 'sql' and not plan.count('OUTPUT:SQLITE'):
+        plan.add('OUTPUT:SQLITE', Option_Type='SimpleAndTabular')
 
+    # dimensions generated by utils.sweep_utils.expand_sweep
+    json_update = json_update or config.get('json_update')
     if json_update is not None:
-        json_functions.updateidf(model, json_update)
+        plan.update(json_update)
+
+    plan.apply(model)
+
+    if config.get('setpoint_factor') is not None:
+        index = template_cache.index(idf_file, ScheduleIndex)
+        scale_temp_setpoints(model, config.setpoint_factor, index=index)
 
     return model
 
 
-def scale_temp_setpoints(model, factor):
+def scale_temp_setpoints(model, factor, index=None):
     '''
-    Iterates over all idfobjects in 'SCHEDULE:COMPACT'.
-    If the schedule ist temperature based, all temperature values
-    are multiplied by factor
+    Multiplies all values of temperature based 'SCHEDULE:COMPACT' objects by factor
+
+    The current values of model are scaled, so edits made before (e.g. by
+    json_update in build_model) are scaled rather than overwritten.
 
     Args:
         model(IDF): EP model subject to change
         factor(float): factor by which temperature should be changed
+        index(ScheduleIndex): index of model or of the template it was copied from;
+            built from model if None
     
     Returns:
         model(IDF)
     '''
-    schedule = model.idfobjects['SCHEDULE:COMPACT']
-
-    for object in schedule:
-        
-        if not object.Schedule_Type_Limits_Name == 'Temperature':
-            continue
-
-        for field in object['objls'][:110]:
-            value = getattr(object, field)
-            if len(value) > 0:
-                try:
-                    setattr(object, field, str(factor*float(value)))
-                except ValueError:
-                    pass
-
-    model.idfobjects['SCHEDULE:COMPACT'] = schedule
+    index = index or ScheduleIndex(model)
+    index.apply(model, index.transform(scale=factor, values=index.read(model)))
 
     return model
 
@@ -126,6 +273,33 @@ def scale_temp_setpoints(model, factor):
     return model
 
 
+def setpoint_variants(idf_file, scales=(1.,), offsets=(0.,), mask=None, weather_file=None):
+    '''
+    Yields one copy of the prototype in idf_file per (scale, offset) pair with
+    its temperature schedules transformed accordingly. The schedules are
+    indexed once and all variants are computed in a single array operation.
+
+    Args:
+        idf_file(str): path to the prototype IDF
+        scales(array-like): factors applied to the temperature values
+        offsets(array-like): offsets added after scaling, broadcast against scales
+        mask(np.ndarray): values to be transformed, see ScheduleIndex.mask; all if None
+        weather_file(str): epw attached to the variants
+    '''
+    index = template_cache.index(idf_file, ScheduleIndex)
+
+    scales, offsets = np.broadcast_arrays(np.asarray(scales, dtype=float), 
+                                          np.asarray(offsets, dtype=float))
+    values = index.values[None, :] * scales.reshape(-1, 1) + offsets.reshape(-1, 1)
+    if mask is not None:
+        values = np.where(mask[None, :], values, index.values[None, :])
+
+    for variant in values:
+        model = template_cache.get(idf_file, weather_file)
+        index.apply(model, variant)
+        yield model
+
+
 def set_runperiod(building, 
                   start=None, 
                   end=None, 
@@ -152,6 +326,31 @@ def set_runperiod(building,
     ----------
     -
 
+    '''
+    fields = runperiod_fields(start=start, end=end,
+                              start_year=start_year, start_month=start_month, start_day=start_day,
+                              end_year=end_year, end_month=end_month, end_day=end_day)
+
+    EditPlan(EditIndex(building)).set_fields('RUNPERIOD', '', fields).apply(building)
+
+
+def runperiod_fields(start=None, 
+                     end=None, 
+                     start_year=None,
+                     start_month=None,
+                     start_day=None,
+                     end_year=None,
+                     end_month=None,
+                     end_day=None,
+                     ) -> dict:
+    '''
+    Returns the fields of the 'RUNPERIOD' object setting the runperiod,
+    arguments as for set_runperiod
+
+    Returns
+    ----------
+    dict : field name -> value
+
     '''
 
     # Obtain start as pd.Timestamp
@@ -196,12 +395,15 @@ def set_runperiod(building,
     else:
         end = pd.Timestamp(datetime(end_year, end_month, end_day))
 
-    # set the respective quantities in the model
+    # the respective quantities of the model
+    fields = {}
     for date, obj in zip([start, end], ['Begin', 'End']):
         
-        building.__dict__['idfobjects']['RUNPERIOD'][0][obj+'_Year'] = date.year
-        building.__dict__['idfobjects']['RUNPERIOD'][0][obj+'_Month'] = date.month
-        building.__dict__['idfobjects']['RUNPERIOD'][0][obj+'_Day_of_Month'] = date.day
+        fields[obj+'_Year'] = date.year
+        fields[obj+'_Month'] = date.month
+        fields[obj+'_Day_of_Month'] = date.day
+
+    return fields
 
 
 def show_runperiod(building):
@@ -223,6 +425,8 @@ def show_runperiod(building):
 
 if __name__ == '__main__':
 
+    from besos import eppy_funcs as ef
+
     weather_path = os.path.join(os.getcwd(), '..', 'data', 'weather')
     idf_path = os.path.join(os.getcwd(), '..', 'data', 'epm')
 
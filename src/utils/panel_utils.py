@@ -0,0 +1,290 @@
+import numpy as np
+import pandas as pd
+
+from utils.time_utils import index_step
+
+
+# config entries that locate files rather than describe an experiment
+_PATH_KEYS = {'name', 'out_dir', 'idf_path', 'weather_path'}
+
+
+class ExperimentPanel:
+    '''
+    Data of many experiments in long format, read by ExperimentStore.read_panel.
+
+    The columns of the experiments (outputs, and the weather of
+    experiments written before weather was stored separately) are one
+    frame with a row per experiment and timestamp. The weather of every
+    location is held once, in a frame with a row per location and
+    timestamp, and is joined to the rows of the experiments by location
+    and the hour (or weather step) they fall into when it is asked for.
+    Every query is a vectorized group operation on these frames, so
+    comparing many experiments never rebuilds wide frames per experiment.
+    Timestamps are taken as stored, so experiments of different years and
+    runs spanning several years are kept apart.
+
+    Attributes:
+        outputs(pd.DataFrame): indexed by (experiment, location, timestamp), both
+            categorical; columns missing in some experiments are nan there
+        weather(pd.DataFrame): indexed by (location, timestamp)
+        experiments(pd.DataFrame): indexed by experiment, in the order of the categories
+            of outputs: building_type, location, rows and the scalar entries of the config,
+            including the parameters of sweep points
+    '''
+
+    def __init__(self, outputs: pd.DataFrame, weather: pd.DataFrame, experiments: pd.DataFrame):
+
+        self.outputs = outputs
+        self.weather = weather
+        self.experiments = experiments
+
+
+    @classmethod
+    def from_frames(cls, metas: list, outputs: list, weather: dict, start=None, end=None):
+        '''
+        Builds a panel from the frames of ExperimentStore.read_panel
+
+        Args:
+            metas(List[dict]): metadata of the experiments
+            outputs(List[pd.DataFrame]): timestamp indexed columns of every experiment
+            weather(dict): weather partition -> (location, timestamp indexed weather)
+            start, end: the weather is cut to the same time range as the outputs
+        '''
+        names = [meta['experiment'] for meta in metas]
+        locations = sorted({str(meta['location']) for meta in metas})
+        lengths = [len(df) for df in outputs]
+
+        columns = list(dict.fromkeys(col for df in outputs for col in df.columns))
+        data = {col: np.concatenate([df[col].to_numpy() if col in df.columns else np.full(len(df), np.nan)
+                                     for df in outputs]) if outputs else np.empty(0)
+                for col in columns}
+
+        index = pd.MultiIndex.from_arrays([
+            pd.Categorical(np.repeat(names, lengths), categories=names),
+            pd.Categorical(np.repeat([str(meta['location']) for meta in metas], lengths), categories=locations),
+            pd.DatetimeIndex(np.concatenate([df.index.to_numpy() for df in outputs])
+                             if outputs else np.empty(0, dtype='datetime64[ns]'))],
+            names=['experiment', 'location', 'timestamp'])
+
+        return cls(pd.DataFrame(data, index=index),
+                   _stack_weather(weather, locations, start, end),
+                   _experiment_table(metas))
+
+
+    def select(self, experiments=None, start=None, end=None, **attributes):
+        '''
+        Returns the panel of the experiments named in experiments (all if None) whose
+        attributes (columns of self.experiments, e.g. building_type='small') match,
+        restricted to the timestamps from start to end (inclusive)
+        '''
+        table = self.experiments
+        keep = np.ones(len(table), dtype=bool)
+        if experiments is not None:
+            keep &= table.index.isin(experiments)
+        for key, value in attributes.items():
+            keep &= (table[key] == value).to_numpy()
+
+        codes = self.outputs.index.codes[0]
+        rows = keep[codes] if len(codes) else np.zeros(0, dtype=bool)
+        timestamps = self.outputs.index.get_level_values('timestamp')
+        if start is not None:
+            rows &= timestamps >= pd.Timestamp(start)
+        if end is not None:
+            rows &= timestamps <= pd.Timestamp(end)
+
+        outputs = _as_categories(self.outputs[rows], list(table.index[keep]))
+
+        return ExperimentPanel(outputs, self.weather, table[keep])
+
+
+    def frame(self, columns=None) -> pd.DataFrame:
+        '''
+        Returns the long frame of columns (all if None), output columns taken from
+        self.outputs and weather columns joined from the weather of every row's location
+        '''
+        if columns is None:
+            own, shared = list(self.outputs.columns), list(self.weather.columns)
+        else:
+            unknown = [col for col in columns if col not in self.outputs.columns and col not in self.weather.columns]
+            if unknown:
+                raise KeyError(f'Columns {unknown} are neither outputs nor weather of the panel')
+            own = [col for col in columns if col in self.outputs.columns]
+            shared = [col for col in columns if col not in self.outputs.columns]
+
+        df = self.outputs[own].copy()
+        if shared:
+            rows = self.weather_rows()
+            found = rows >= 0
+            for col in shared:
+                values = self.weather[col].to_numpy()
+                if found.all():
+                    df[col] = values[rows]
+                else:
+                    column = np.full(len(rows), np.nan)
+                    column[found] = values[rows[found]]
+                    df[col] = column
+
+        return df if columns is None else df[list(columns)]
+
+
+    def weather_rows(self) -> np.ndarray:
+        '''
+        returns the row of self.weather of every row of self.outputs (its location and the
+        weather step its timestamp falls into), -1 where there is no weather
+        '''
+        if not len(self.weather) or not len(self.outputs):
+            return np.full(len(self.outputs), -1, dtype=np.int64)
+
+        step = index_step(self.weather.index.get_level_values('timestamp').unique().sort_values())
+        step = step.value
+
+        # integer keys of location and step, matched in one indexer lookup
+        def keys(index):
+            locations = index.get_level_values('location').astype(str)
+            codes = pd.Index(self.weather.index.levels[0]).get_indexer(locations).astype(np.int64)
+            steps = index.get_level_values('timestamp').to_numpy().astype('datetime64[ns]').view(np.int64) // step
+            return np.where(codes >= 0, codes * (2**40) + steps, -1)
+
+        return pd.Index(keys(self.weather.index)).get_indexer(keys(self.outputs.index))
+
+
+    def aggregate(self, columns=None, by='experiment', freq=None, how='mean') -> pd.DataFrame:
+        '''
+        Aggregates columns over groups of rows of all experiments at once
+
+        Args:
+            columns(List[str]): output or weather columns, all if None
+            by(str or List[str]): 'experiment', 'location' or columns of self.experiments,
+                e.g. a sweep parameter; empty to aggregate over all experiments
+            freq(str): also group by periods of the timestamps, e.g. 'D', 'M' or 'Y'
+            how(str or callable): aggregation, e.g. 'mean', 'sum', 'max' or 'std'
+
+        Returns:
+            pd.DataFrame: one row per group (and period), one column per column
+        '''
+        by = [by] if isinstance(by, str) else list(by)
+        df = self.frame(columns)
+
+        keys = [self.labels(key) for key in by]
+        if freq is not None:
+            timestamps = self.outputs.index.get_level_values('timestamp')
+            keys.append(pd.Index(timestamps.to_period(freq).start_time, name='period'))
+        if not keys:
+            return df.agg([how]) if isinstance(how, str) else df.agg(how).to_frame().T
+
+        return df.groupby(keys, observed=True, sort=True).agg(how)
+
+
+    def labels(self, key: str) -> pd.Index:
+        '''
+        returns the value of key ('experiment', 'location' or a column of self.experiments) of every row
+        '''
+        if key in ('experiment', 'location'):
+            return pd.Index(self.outputs.index.get_level_values(key), name=key)
+
+        values = self.experiments[key].to_numpy()
+        return pd.Index(values[self.outputs.index.codes[0]], name=key)
+
+
+    def pivot(self, column: str) -> pd.DataFrame:
+        '''
+        returns column as wide frame, one column per experiment and one row per timestamp
+        '''
+        series = self.frame([column])[column].droplevel('location')
+        return series.unstack('experiment')
+
+
+    def relative_to(self, baseline: str, columns=None) -> pd.DataFrame:
+        '''
+        Returns the difference of the output columns of every experiment to those of
+        the experiment baseline at the same timestamp, nan where baseline has no row
+
+        Args:
+            baseline(str): name of the reference experiment
+            columns(List[str]): output columns, all if None
+        '''
+        columns = list(self.outputs.columns if columns is None else columns)
+        if baseline not in self.experiments.index:
+            raise KeyError(f'Experiment {baseline} is not in the panel')
+
+        values = self.outputs[columns].to_numpy(dtype=float)
+        is_base = self.outputs.index.codes[0] == self.experiments.index.get_loc(baseline)
+        timestamps = self.outputs.index.get_level_values('timestamp')
+
+        rows = pd.Index(timestamps[is_base]).get_indexer(timestamps)
+        base = values[is_base]
+        diff = np.full(values.shape, np.nan)
+        found = rows >= 0
+        diff[found] = values[found] - base[rows[found]]
+
+        return pd.DataFrame(diff, index=self.outputs.index, columns=columns)
+
+
+    def memory_usage(self) -> int:
+        '''
+        returns the bytes taken by the outputs, the weather and their indexes
+        '''
+        return int(self.outputs.memory_usage(index=True, deep=True).sum()
+                   + self.weather.memory_usage(index=True, deep=True).sum())
+
+
+def _as_categories(outputs: pd.DataFrame, experiments: list) -> pd.DataFrame:
+    '''
+    gives the experiment level of outputs exactly the categories experiments, in this order
+    '''
+    index = outputs.index
+    names = pd.Categorical(index.get_level_values('experiment').astype(str), categories=experiments)
+    index = pd.MultiIndex.from_arrays([names, index.get_level_values('location'),
+                                       index.get_level_values('timestamp')], names=index.names)
+    return outputs.set_axis(index, axis=0)
+
+
+def _stack_weather(weather: dict, locations: list, start=None, end=None) -> pd.DataFrame:
+    '''
+    returns the weather of all locations in one frame indexed by (location, timestamp)
+    '''
+    frames = [(location, df) for location, df in weather.values()]
+    if not frames:
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays(
+            [pd.Categorical([], categories=locations), pd.DatetimeIndex([])], names=['location', 'timestamp']))
+
+    if start is not None or end is not None:
+        # the weather step holding start is kept, so every output row finds its weather
+        step = max(index_step(df.index) for _, df in frames)
+        first = None if start is None else pd.Timestamp(start).floor(step)
+        frames = [(location, df.loc[first:end]) for location, df in frames]
+
+    columns = list(dict.fromkeys(col for _, df in frames for col in df.columns))
+    data = {col: np.concatenate([df[col].to_numpy() if col in df.columns else np.full(len(df), np.nan)
+                                 for _, df in frames])
+            for col in columns}
+    index = pd.MultiIndex.from_arrays([
+        pd.Categorical(np.repeat([str(location) for location, _ in frames], [len(df) for _, df in frames]),
+                       categories=locations),
+        pd.DatetimeIndex(np.concatenate([df.index.to_numpy() for _, df in frames]))],
+        names=['location', 'timestamp'])
+
+    df = pd.DataFrame(data, index=index)
+    # weather of one location stored for several experiments' years may overlap
+    return df[~df.index.duplicated(keep='last')].sort_index()
+
+
+def _experiment_table(metas: list) -> pd.DataFrame:
+    '''
+    returns one row per experiment with its partition, row count and scalar config entries
+    '''
+    rows = []
+    for meta in metas:
+        cfg = meta.get('cfg') or {}
+        row = {'building_type': meta['building_type'], 'location': meta['location'], 'rows': meta['rows']}
+        row.update({key: value for key, value in cfg.items()
+                    if key not in _PATH_KEYS and key not in row and isinstance(value, (str, int, float, bool))})
+
+        sweep = cfg.get('sweep')
+        if isinstance(sweep, dict):
+            row['sweep'] = sweep.get('name')
+            row.update({key: value for key, value in (sweep.get('point') or {}).items()
+                        if isinstance(value, (str, int, float, bool))})
+        rows.append(row)
+
+    return pd.DataFrame(rows, index=pd.Index([meta['experiment'] for meta in metas], name='experiment'))
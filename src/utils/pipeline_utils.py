@@ -0,0 +1,431 @@
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils import profile_utils
+from utils.profile_utils import span
+from utils.sim_utils import get_simulator
+from utils.run_utils import attempt_dir, place_outputs, kill_group
+
+
+# stages of RunPipeline, in the order runs pass through them
+STAGES = ['build', 'simulate', 'parse', 'persist']
+
+# directory holding the utils package, put on the path of simulator subprocesses
+SOURCE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare(cfg, scratch_dir: str, output_dir: str, idd_file: str = None, sim_cache=None, simulator=None,
+            profile=False) -> dict:
+    '''
+    Builds the model of cfg in scratch_dir and returns the command simulating it.
+    Target of the build workers of RunPipeline; as the worker processes are
+    reused, the prototype building is parsed only once per worker. The
+    working directory is changed, so the paths in cfg must be absolute.
+
+    Args:
+        cfg(AttrDict): run config as returned by DataClerk.setup_cfg
+        scratch_dir(str): private working directory of this run
+        output_dir(str): directory the command writes the outputs to, see utils.run_utils.attempt_dir
+        idd_file(str): EnergyPlus data dictionary; set if not yet known to eppy
+        sim_cache(SimulationCache): outputs of an identical run are restored instead of simulated
+        simulator: backend from utils.sim_utils, EnergyPlus if None
+        profile(bool): return the spans of the build
+
+    Returns:
+        dict: command (None if the outputs were restored from sim_cache), key in
+            sim_cache, hit, and the spans and counters recorded while building
+    '''
+    from eppy.modeleditor import IDF
+    from utils.idf_utils import build_model
+
+    if idd_file is not None and IDF.getiddname() is None:
+        IDF.setiddname(idd_file)
+
+    profiler = profile_utils.enable(f'build-{cfg.name}') if profile else None
+    try:
+        os.chdir(scratch_dir)
+
+        with span('build_model', run=cfg.name):
+            model = build_model(cfg, view=False)
+        simulator = get_simulator(simulator)
+
+        key, hit = None, False
+        if sim_cache is not None:
+            key = sim_cache.key(model, simulator=simulator)
+            hit = sim_cache.restore(key, output_dir)
+
+        command = None if hit else simulator.command(model, scratch_dir, output_dir)
+    finally:
+        if profile:
+            profile_utils.disable()
+
+    return {'command': command, 'key': key, 'hit': hit,
+            'spans': profiler.spans if profiler else [], 'counters': profiler.counters if profiler else {}}
+
+
+class Stage:
+    '''
+    One stage of RunPipeline: its concurrency limit, the bounded queue
+    feeding it and what it did
+
+    Attributes:
+        name(str): one of STAGES
+        workers(int): runs processed at the same time
+        queue_size(int): runs waiting for the stage at most; upstream stages block beyond
+        runs(int): runs passed on to the next stage
+        failed(int): runs that failed in this stage
+        busy(float): seconds spent processing, summed over workers
+        blocked(float): seconds workers waited for room in the queue of the next stage
+        max_depth(int): largest number of runs waiting in the queue
+    '''
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self.runs = 0
+        self.failed = 0
+        self.busy = 0.
+        self.blocked = 0.
+        self.max_depth = 0
+        self.queue = None
+        self._depths = []
+
+
+    def sample(self) -> None:
+        '''
+        records the current depth of the queue, averaged in stats
+        '''
+        depth = self.queue.qsize()
+        self._depths.append(depth)
+        self.max_depth = max(self.max_depth, depth)
+
+
+    def stats(self, wall: float) -> dict:
+        '''
+        returns the statistics of the stage over wall seconds as dict
+        '''
+        return {'stage': self.name, 'workers': self.workers, 'runs': self.runs, 'failed': self.failed,
+                'busy_seconds': self.busy, 'blocked_seconds': self.blocked,
+                'utilization': self.busy / (self.workers * wall) if wall else None,
+                'mean_depth': sum(self._depths) / len(self._depths) if self._depths else 0.,
+                'max_depth': self.max_depth, 'queue_size': self.queue_size}
+
+
+class RunPipeline:
+    '''
+    Runs the configs of a batch through four stages connected by bounded queues.
+
+        build     builds the model and saves what the simulator needs, in a pool
+                  of worker processes that keep their parsed prototypes
+        simulate  runs the simulator command as asyncio subprocess, with
+                  timeout and retries, and moves its outputs to cfg.out_dir;
+                  restored cache hits pass straight through
+        parse     reads and aligns weather and output, in threads of this process
+        persist   reports and writes the results, in threads of this process
+
+    Every stage has its own number of workers. A stage whose successor's
+    queue is full waits (backpressure), so at most queue_size runs are
+    built ahead of the simulator slots and simulated ahead of the parser,
+    while the simulator slots keep running as long as post-processing
+    keeps up with them. Runs reach parse and persist in the order they
+    finish simulating, not necessarily in the order of the configs.
+
+    The simulator needs a command method (see utils.sim_utils); parse and
+    persist are called with the config of a run and have to be thread
+    safe for more than one worker. Commands run in a process group of
+    their own, which is killed as a whole on timeout, and write into a
+    directory next to cfg.out_dir that only replaces it once the command
+    succeeded; the outputs of a failed attempt are moved aside before the
+    next one starts.
+
+    Attributes:
+        stages(dict): stage name -> Stage
+        timeout(float): seconds after which a simulation is killed, None for no limit
+        retries(int): number of additional attempts for failed simulations
+        scratch_root(str): directory in which the scratch directories are created
+        idd_file(str): EnergyPlus data dictionary passed on to the build workers
+        sim_cache(SimulationCache): cache of simulation outputs
+        simulator: backend from utils.sim_utils, EnergyPlus if None
+        failed(List[str]): names of runs that failed in any stage
+        wall(float): seconds the last batch took
+    '''
+
+    def __init__(self, stage_workers=None, queue_size=None, timeout=None, retries=0, scratch_root=None,
+                 idd_file=None, sim_cache=None, simulator=None, monitor_interval=0.1):
+
+        workers = {'build': 1, 'simulate': os.cpu_count(), 'parse': 1, 'persist': 1}
+        unknown = set(stage_workers or {}) - set(STAGES)
+        if unknown:
+            raise ValueError(f'Unknown stages {sorted(unknown)}; choose from {STAGES}')
+        workers.update(stage_workers or {})
+
+        queue_size = queue_size or 2 * workers['simulate']
+        self.stages = {name: Stage(name, max(1, int(workers[name])), queue_size) for name in STAGES}
+
+        self.timeout = timeout
+        self.retries = retries
+        self.scratch_root = scratch_root
+        self.idd_file = idd_file
+        self.sim_cache = sim_cache
+        self.simulator = get_simulator(simulator)
+        self.monitor_interval = monitor_interval
+
+        self.failed = []
+        self.wall = 0.
+        self._status = []
+
+
+    def run(self, cfgs, parse=None, persist=None) -> list:
+        '''
+        Builds, simulates, parses and persists all cfgs
+
+        cfgs are consumed lazily, only as the build queue has room, so a
+        generator such as utils.sweep_utils.expand_sweep can be passed in directly
+
+        Args:
+            cfgs(Iterable[AttrDict]): configs as returned by DataClerk.setup_cfg
+            parse(callable): called with the config of every simulated run
+            persist(callable): called with the config of every parsed run
+
+        Returns:
+            List[bool]: success of each run, in the order of cfgs
+        '''
+        if self.scratch_root is not None:
+            os.makedirs(self.scratch_root, exist_ok=True)
+
+        start = time.time()
+        status = asyncio.run(self._run(iter(cfgs), parse, persist))
+        self.wall = time.time() - start
+
+        self.report()
+
+        return status
+
+
+    async def _run(self, cfgs, parse, persist) -> list:
+
+        for stage in self.stages.values():
+            stage.queue = asyncio.Queue(stage.queue_size)
+
+        self._status = []
+        self._loop = asyncio.get_running_loop()
+        self._builders = ProcessPoolExecutor(self.stages['build'].workers)
+        self._threads = {name: ThreadPoolExecutor(self.stages[name].workers, thread_name_prefix=name)
+                         for name in ['simulate', 'parse', 'persist']}
+        # simulator subprocesses can import this project, e.g. python -m utils.sim_utils
+        self._env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [SOURCE_ROOT] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+
+        handlers = {'build': self._build, 'simulate': self._simulate,
+                    'parse': lambda run: self._call(parse, 'parse', run),
+                    'persist': lambda run: self._call(persist, 'persist', run)}
+        workers = [asyncio.create_task(self._work(name, handlers[name]))
+                   for name in STAGES for _ in range(self.stages[name].workers)]
+        monitor = asyncio.create_task(self._monitor())
+
+        try:
+            await self._feed(cfgs)
+            # every stage only passes runs on before it marks them done
+            for name in STAGES:
+                await self.stages[name].queue.join()
+        finally:
+            for task in workers + [monitor]:
+                task.cancel()
+            await asyncio.gather(*workers, monitor, return_exceptions=True)
+            self._builders.shutdown()
+            for pool in self._threads.values():
+                pool.shutdown()
+
+        return self._status
+
+
+    async def _feed(self, cfgs) -> None:
+        '''
+        puts the configs into the build queue as it has room
+        '''
+        queue = self.stages['build'].queue
+        for cfg in cfgs:
+            self._status.append(None)
+            await queue.put({'index': len(self._status) - 1, 'cfg': cfg})
+            self.stages['build'].max_depth = max(self.stages['build'].max_depth, queue.qsize())
+
+
+    async def _work(self, name: str, handler) -> None:
+        '''
+        worker of stage name: takes runs from its queue and passes successful ones on
+        '''
+        stage = self.stages[name]
+        following = STAGES.index(name) + 1
+        following = self.stages[STAGES[following]] if following < len(STAGES) else None
+
+        while True:
+            run = await stage.queue.get()
+            try:
+                start = time.time()
+                try:
+                    ok = await handler(run)
+                except Exception:
+                    traceback.print_exc()
+                    ok = False
+                stage.busy += time.time() - start
+
+                profiler = profile_utils.active()
+                if profiler is not None:
+                    profiler.add(name, start, time.time() - start, run=run['cfg'].name, ok=ok)
+
+                if not ok:
+                    stage.failed += 1
+                    self._fail(run, name)
+                elif following is None:
+                    stage.runs += 1
+                    self._status[run['index']] = True
+                else:
+                    stage.runs += 1
+                    waiting = time.time()
+                    await following.queue.put(run)
+                    stage.blocked += time.time() - waiting
+                    following.max_depth = max(following.max_depth, following.queue.qsize())
+            finally:
+                stage.queue.task_done()
+
+
+    async def _monitor(self) -> None:
+        '''
+        samples the depth of every queue once per monitor_interval
+        '''
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            for stage in self.stages.values():
+                stage.sample()
+
+
+    def _fail(self, run, name) -> None:
+
+        print(f'Run {run["cfg"].name} failed in stage {name}.')
+        self.failed.append(run['cfg'].name)
+        self._status[run['index']] = False
+        for key in ('scratch_dir', 'output_dir'):
+            if run.get(key):
+                shutil.rmtree(run.pop(key), ignore_errors=True)
+
+
+    async def _build(self, run) -> bool:
+
+        cfg = run['cfg']
+        # the build workers change their working directory, see prepare
+        for key in ('out_dir', 'idf_path', 'weather_path'):
+            if cfg.get(key):
+                cfg[key] = os.path.abspath(cfg[key])
+
+        run['scratch_dir'] = tempfile.mkdtemp(prefix=cfg.name + '_', dir=self.scratch_root)
+        run['output_dir'] = attempt_dir(cfg.out_dir)
+
+        prepared = await self._loop.run_in_executor(
+            self._builders, prepare, cfg, run['scratch_dir'], run['output_dir'], self.idd_file,
+            self.sim_cache, self.simulator, profile_utils.active() is not None)
+
+        profiler = profile_utils.active()
+        if profiler is not None:
+            profiler.extend(prepared.pop('spans'), prepared.pop('counters'))
+        run.update(prepared)
+
+        if self.sim_cache is not None:
+            self.sim_cache.record(prepared['hit'])
+            profile_utils.count('sim_cache_hits' if prepared['hit'] else 'sim_cache_misses', run=cfg.name)
+            if prepared['hit']:
+                print(f'Took outputs of {cfg.name} from simulation cache.')
+
+        return True
+
+
+    async def _simulate(self, run) -> bool:
+
+        cfg = run['cfg']
+        output_dir = run['output_dir']
+        try:
+            if run['command'] is None:
+                place_outputs(output_dir, cfg.out_dir)
+                return True
+
+            log_file = os.path.join(run['scratch_dir'], 'simulation.log')
+            for attempt in range(1, self.retries + 2):
+                start = time.time()
+                with open(log_file, 'wb') as log:
+                    proc = await asyncio.create_subprocess_exec(
+                        *run['command'], stdout=log, stderr=asyncio.subprocess.STDOUT,
+                        cwd=run['scratch_dir'], env=self._env, start_new_session=True)
+                    try:
+                        exitcode = await asyncio.wait_for(proc.wait(), self.timeout)
+                    except asyncio.TimeoutError:
+                        print(f'Run {cfg.name} exceeded timeout of {self.timeout}s; terminating.')
+                        kill_group(proc)
+                        exitcode = await proc.wait()
+                        profile_utils.count('timeouts', run=cfg.name)
+                    finally:
+                        if proc.returncode is None:
+                            # cancelled, the simulation would outlive the pipeline
+                            kill_group(proc)
+
+                profiler = profile_utils.active()
+                if profiler is not None:
+                    profiler.add('attempt', start, time.time() - start, run=cfg.name,
+                                 attempt=attempt, exitcode=exitcode)
+
+                if exitcode == 0:
+                    if self.sim_cache is not None:
+                        await self._loop.run_in_executor(self._threads['simulate'], self.sim_cache.store,
+                                                         run['key'], output_dir)
+                    place_outputs(output_dir, cfg.out_dir)
+                    return True
+
+                with open(log_file, errors='replace') as log:
+                    tail = log.readlines()[-5:]
+                print(f'Run {cfg.name} failed (attempt {attempt}, exit code {exitcode}):\n' + ''.join(tail))
+
+                # the next attempt writes into a fresh directory of the same name
+                if os.path.exists(output_dir):
+                    failed = f'{output_dir}.{attempt}'
+                    os.replace(output_dir, failed)
+                    shutil.rmtree(failed, ignore_errors=True)
+
+            return False
+
+        finally:
+            shutil.rmtree(run.pop('scratch_dir'), ignore_errors=True)
+            shutil.rmtree(run.pop('output_dir'), ignore_errors=True)
+
+
+    async def _call(self, func, name: str, run) -> bool:
+
+        if func is not None:
+            await self._loop.run_in_executor(self._threads[name], func, run['cfg'])
+        return True
+
+
+    def stats(self) -> list:
+        '''
+        returns the statistics of every stage of the last batch, see Stage.stats
+        '''
+        return [stage.stats(self.wall) for stage in self.stages.values()]
+
+
+    def report(self) -> None:
+        '''
+        prints the runs, utilization and queue depths of every stage
+        '''
+        print(f'Pipeline of {len(self._status)} runs in {self.wall:.2f}s')
+        print(f'{"stage":<10}{"workers":>8}{"runs":>6}{"failed":>8}{"busy s":>9}{"util":>7}'
+              f'{"blocked s":>11}{"depth":>7}{"max":>5}')
+        for stats in self.stats():
+            utilization = f'{100 * stats["utilization"]:.0f}%' if stats['utilization'] is not None else ''
+            print(f'{stats["stage"]:<10}{stats["workers"]:>8}{stats["runs"]:>6}{stats["failed"]:>8}'
+                  f'{stats["busy_seconds"]:>9.2f}{utilization:>7}{stats["blocked_seconds"]:>11.2f}'
+                  f'{stats["mean_depth"]:>7.1f}{stats["max_depth"]:>5}')
@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak memory is not reported there
+    resource = None
+
+
+def peak_rss_mb(children=False) -> float:
+    '''
+    returns the peak resident memory of this process (or of its largest
+    finished child process) in MB, None where it cannot be determined
+    '''
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss / (1024**2 if sys.platform == 'darwin' else 1024)
+
+
+class Span:
+    '''
+    timer of one stage, returned by Profiler.span; set(rows=...) attaches row counts etc.
+    '''
+
+    __slots__ = ('profiler', 'name', 'run', 'args', 'start', '_clock')
+
+    def __init__(self, profiler, name, run, args):
+
+        self.profiler = profiler
+        self.name = name
+        self.run = run
+        self.args = args
+
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+
+    def __enter__(self):
+        self.start = time.time()
+        self._clock = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.profiler.add(self.name, self.start, time.perf_counter() - self._clock, run=self.run, **self.args)
+
+
+class _NullSpan:
+    '''
+    stands in for Span while profiling is disabled
+    '''
+
+    def set(self, **args) -> None:
+        pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    '''
+    Collects timers and counters of the stages of a batch of runs.
+
+    Every span records the stage, the run it belongs to, its start (epoch
+    seconds) and duration, the process and thread it ran in, the peak RSS
+    of the process when it ended and any arguments such as rows. Spans
+    recorded in worker processes are merged in with extend. The records
+    can be summarized per stage (and run), and saved as JSON or as a
+    Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+    Attributes:
+        name(str): name of the batch
+        created(str): ISO time the profiler was created
+        spans(List[dict]): recorded spans
+        counters(dict): (name, run) -> value, run None for batch wide counters
+    '''
+
+    def __init__(self, name='batch'):
+
+        self.name = name
+        self.created = datetime.now().isoformat(timespec='seconds')
+        self.spans = []
+        self.counters = {}
+        self._origin = time.time()
+        self._lock = threading.Lock()
+
+
+    def span(self, name: str, run: str = None, **args) -> Span:
+        '''
+        returns a context manager timing the stage name of run
+        '''
+        return Span(self, name, run, args)
+
+
+    def add(self, name: str, start: float, seconds: float, run: str = None, **args) -> None:
+        '''
+        records a span measured elsewhere, start in epoch seconds
+        '''
+        record = {'name': name, 'run': run, 'start': start, 'seconds': seconds,
+                  'pid': os.getpid(), 'thread': threading.current_thread().name,
+                  'rss_mb': peak_rss_mb(), 'args': args}
+        with self._lock:
+            self.spans.append(record)
+
+
+    def count(self, name: str, value=1, run: str = None) -> None:
+        '''
+        adds value to the counter name of run and to the batch wide counter name
+        '''
+        with self._lock:
+            keys = [(name, None)] if run is None else [(name, None), (name, run)]
+            for key in keys:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def extend(self, spans: list, counters: dict = None) -> None:
+        '''
+        adds spans and counters recorded by another profiler, e.g. in a worker process
+        '''
+        with self._lock:
+            self.spans.extend(spans)
+            for key, value in (counters or {}).items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def summary(self, by_run=False) -> list:
+        '''
+        Returns one dict per stage (per run and stage if by_run) with calls,
+        seconds (total, mean, max), rows, rows_per_s and the share of the batch wall time
+        '''
+        wall = self.wall_time() or None
+        groups = {}
+        for span in self.spans:
+            key = (span['run'], span['name']) if by_run else (None, span['name'])
+            group = groups.setdefault(key, {'run': key[0], 'stage': key[1], 'calls': 0, 'seconds': 0.,
+                                            'max_seconds': 0., 'rows': 0})
+            group['calls'] += 1
+            group['seconds'] += span['seconds']
+            group['max_seconds'] = max(group['max_seconds'], span['seconds'])
+            group['rows'] += span['args'].get('rows') or 0
+
+        for group in groups.values():
+            group['mean_seconds'] = group['seconds'] / group['calls']
+            group['rows_per_s'] = group['rows'] / group['seconds'] if group['rows'] and group['seconds'] else None
+            group['share'] = group['seconds'] / wall if wall else None
+
+        return sorted(groups.values(), key=lambda group: (str(group['run']), -group['seconds']))
+
+
+    def wall_time(self) -> float:
+        '''
+        returns the seconds from the start of the first to the end of the last span
+        '''
+        if not self.spans:
+            return 0.
+        return (max(span['start'] + span['seconds'] for span in self.spans)
+                - min(span['start'] for span in self.spans))
+
+
+    def report(self, by_run=False) -> None:
+        '''
+        prints the summary table, the counters and the peak memory
+        '''
+        print(f'Profile of {self.name}: {len(self.spans)} spans in {self.wall_time():.2f}s')
+        print(f'{"run":<20}{"stage":<22}{"calls":>7}{"seconds":>10}{"mean":>9}{"max":>9}'
+              f'{"rows":>11}{"rows/s":>12}{"share":>7}')
+
+        for group in self.summary(by_run=by_run):
+            share = f'{100 * group["share"]:.0f}%' if group['share'] is not None else ''
+            print(f'{str(group["run"] or "-")[:19]:<20}{group["stage"][:21]:<22}{group["calls"]:>7}'
+                  f'{group["seconds"]:>10.3f}{group["mean_seconds"]:>9.3f}{group["max_seconds"]:>9.3f}'
+                  f'{group["rows"]:>11,}{group["rows_per_s"] or 0:>12,.0f}{share:>7}')
+
+        counters = {name: value for (name, run), value in self.counters.items() if run is None}
+        if counters:
+            print('Counters: ' + ', '.join(f'{name}={value}' for name, value in sorted(counters.items())))
+
+        rss, children = peak_rss_mb(), peak_rss_mb(children=True)
+        if rss is not None:
+            print(f'Peak RSS: {rss:.0f}MB, largest worker process {children:.0f}MB')
+
+
+    def to_dict(self) -> dict:
+        '''
+        returns all records, the summaries and the peak memory as JSON serializable dict
+        '''
+        return {'name': self.name,
+                'created': self.created,
+                'pid': os.getpid(),
+                'wall_seconds': self.wall_time(),
+                'peak_rss_mb': peak_rss_mb(),
+                'peak_rss_children_mb': peak_rss_mb(children=True),
+                'summary': self.summary(),
+                'runs': self.summary(by_run=True),
+                'counters': [{'name': name, 'run': run, 'value': value}
+                             for (name, run), value in self.counters.items()],
+                'spans': self.spans}
+
+
+    def to_chrome(self) -> dict:
+        '''
+        Returns the spans in the Chrome trace event format
+
+        Every process is one track with a lane per thread and run, the peak
+        RSS of every process is drawn as a counter track.
+        '''
+        origin = min([span['start'] for span in self.spans] + [self._origin])
+        lanes = {}
+        events = []
+
+        for span in sorted(self.spans, key=lambda span: span['start']):
+            lane = (span['pid'], span['thread'], span['run'])
+            if lane not in lanes:
+                lanes[lane] = len(lanes) + 1
+                label = span['thread'] if span['run'] is None else f'{span["thread"]} {span["run"]}'
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': span['pid'],
+                               'tid': lanes[lane], 'args': {'name': label}})
+
+            ts = (span['start'] - origin) * 1e6
+            events.append({'name': span['name'], 'cat': 'stage', 'ph': 'X',
+                           'ts': ts, 'dur': span['seconds'] * 1e6,
+                           'pid': span['pid'], 'tid': lanes[lane],
+                           'args': dict(span['args'], run=span['run'])})
+            if span['rss_mb'] is not None:
+                events.append({'name': 'peak_rss_mb', 'ph': 'C', 'ts': ts + span['seconds'] * 1e6,
+                               'pid': span['pid'], 'args': {'MB': span['rss_mb']}})
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'name': self.name, 'created': self.created}}
+
+
+    def save(self, path: str, fmt=None) -> str:
+        '''
+        Writes the profile to path
+
+        Args:
+            path(str): file to be written
+            fmt(str): 'chrome' or 'json'; chrome if path ends with .trace.json, json otherwise
+        '''
+        fmt = fmt or ('chrome' if path.endswith('.trace.json') else 'json')
+        data = self.to_chrome() if fmt == 'chrome' else self.to_dict()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=None if fmt == 'chrome' else 2, default=str)
+
+        return path
+
+
+# profiler of the current batch, None while profiling is disabled
+_active = None
+
+
+def enable(name='batch') -> Profiler:
+    '''
+    starts recording spans and counters of this process in a new Profiler
+    '''
+    global _active
+    _active = Profiler(name)
+    return _active
+
+
+def disable() -> Profiler:
+    '''
+    stops recording and returns the profiler, None if profiling was not enabled
+    '''
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active() -> Profiler:
+    '''
+    returns the profiler recording in this process, None while profiling is disabled
+    '''
+    return _active
+
+
+def span(name: str, run: str = None, **args):
+    '''
+    Times the stage name of run if profiling is enabled, e.g.
+
+        with span('parse_mtr', run=cfg.name) as timer:
+            df = mtr2df(filename)
+            timer.set(rows=len(df))
+
+    While profiling is disabled a shared no-op context manager is returned.
+    '''
+    profiler = _active
+    if profiler is None:
+        return _NULL_SPAN
+    return profiler.span(name, run=run, **args)
+
+
+def count(name: str, value=1, run: str = None) -> None:
+    '''
+    adds value to a counter if profiling is enabled
+    '''
+    profiler = _active
+    if profiler is not None:
+        profiler.count(name, value=value, run=run)
+
+
+def profiled(name: str):
+    '''
+    Decorator adding the keyword argument profile to a batch function
+
+    With profile=True the call is profiled and the summary table printed
+    at its end; a string is the path the profile is saved to in addition,
+    as Chrome trace if it ends with .trace.json and as JSON otherwise.
+    Without profile the function runs as it is.
+    '''
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, profile=None, **kwargs):
+            if not profile:
+                return func(*args, **kwargs)
+
+            profiler = enable(name)
+            try:
+                with profiler.span(name):
+                    return func(*args, **kwargs)
+            finally:
+                disable()
+                profiler.report()
+                if isinstance(profile, str):
+                    print(f'Profile written to {profiler.save(profile)}')
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,500 @@
+import os
+import json
+import uuid
+import socket
+import threading
+from datetime import datetime
+
+
+class WorkQueue:
+    '''
+    Queue of runs in a plain directory on a shared filesystem, drained by
+    any number of worker processes on any number of nodes without a broker.
+
+    Layout of the directory:
+        queue.json              settings: lease_seconds, max_attempts
+        tasks/<id>.json         config of every run, never changed after submit
+        leases/<id>.json        claim of the worker running it, touched as heartbeat
+        attempts/<id>.<n>.json  attempts that ended without a result (expired or failed)
+        done/<id>.json          committed result: worker, timing, rows, partition
+        failed/<id>.json        given up after max_attempts
+
+    A run is claimed by creating its lease with O_CREAT | O_EXCL, which
+    succeeds for one worker only. The worker touches the lease every
+    few seconds; a lease not touched for lease_seconds belongs to a dead
+    worker and is moved to attempts/ by whoever notices, which makes the
+    run claimable again. The lease is first renamed to a name of the
+    reclaiming worker's own, so only one worker moves it, and put back if
+    it turns out to have been renewed or replaced in the meantime. Tasks
+    are created exclusively as well, so concurrent submitters never
+    overwrite each other's runs. Ages are measured against the clock of the file server (the mtime
+    of a file touched for the purpose), not against the clocks of the nodes.
+
+    Results are committed idempotently: the experiment is written to the
+    store first (an atomic directory swap) and done/<id>.json is created
+    exclusively afterwards. A run reclaimed from a worker that was only
+    slow may be simulated twice, but it is recorded once and its partition
+    holds the data of one of the attempts.
+
+    Attributes:
+        path(str): directory of the queue
+        lease_seconds(float): seconds without heartbeat after which a run is reclaimed
+        max_attempts(int): attempts per run before it is given up
+    '''
+
+    dirs = ['tasks', 'leases', 'attempts', 'done', 'failed']
+
+    def __init__(self, path: str, lease_seconds=600., max_attempts=3):
+
+        self.path = path
+        settings = os.path.join(path, 'queue.json')
+
+        if os.path.exists(settings):
+            with open(settings) as file:
+                meta = json.load(file)
+            lease_seconds, max_attempts = meta['lease_seconds'], meta['max_attempts']
+        else:
+            for name in self.dirs:
+                os.makedirs(os.path.join(path, name), exist_ok=True)
+            _write_json(settings, {'lease_seconds': lease_seconds, 'max_attempts': max_attempts,
+                                   'created': datetime.now().isoformat(timespec='seconds')})
+
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+
+    def _file(self, kind: str, name: str) -> str:
+        return os.path.join(self.path, kind, name)
+
+
+    def _ids(self, kind: str) -> set:
+        '''
+        returns the ids of the runs with a file in the directory kind
+        '''
+        return {name[:-len('.json')] for name in os.listdir(os.path.join(self.path, kind))
+                if name.endswith('.json') and not name.startswith('.')}
+
+
+    def now(self) -> float:
+        '''
+        returns the current time of the file server, so that leases written by
+        nodes with skewed clocks are compared fairly
+        '''
+        clock = os.path.join(self.path, '.clock')
+        with open(clock, 'a'):
+            os.utime(clock, None)
+        return os.stat(clock).st_mtime
+
+
+    def submit(self, cfgs) -> list:
+        '''
+        Adds runs to the queue
+
+        Args:
+            cfgs(Iterable[str or dict]): yaml files (relative to CONFIG_PATH of the
+                workers) or generated configs, see DataClerk.setup_cfg
+
+        Returns:
+            List[str]: ids of the added runs, ordered as they are claimed
+        '''
+        number = len(self._ids('tasks'))
+        ids = []
+        for cfg in cfgs:
+            if isinstance(cfg, dict):
+                name, task = cfg['name'], {'cfg': cfg}
+            else:
+                name, task = os.path.basename(cfg).split('.')[0], {'cfg_file': cfg}
+
+            # numbers taken by a concurrent submitter are skipped
+            while True:
+                task_id = f'{number:06d}-{name}'
+                task.update({'id': task_id, 'name': name,
+                             'submitted': datetime.now().isoformat(timespec='seconds')})
+                number += 1
+                if _create_json(self._file('tasks', task_id + '.json'), task):
+                    break
+            ids.append(task_id)
+
+        return ids
+
+
+    def claim(self, worker: str = None) -> dict:
+        '''
+        Claims the first pending run, reclaiming expired leases first
+
+        Args:
+            worker(str): name of the claiming worker, see worker_name
+
+        Returns:
+            dict: the task with its lease (worker, attempt, claimed), None if no run is pending
+        '''
+        worker = worker or worker_name()
+        self.reclaim()
+
+        finished = self._ids('done') | self._ids('failed')
+        for task_id in sorted(self._ids('tasks') - finished - self._ids('leases')):
+            attempt = self._attempts(task_id) + 1
+            lease = {'worker': worker, 'host': socket.gethostname(), 'pid': os.getpid(),
+                     'attempt': attempt, 'claimed': self.now()}
+
+            path = self._file('leases', task_id + '.json')
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # claimed by another worker since the listing
+                continue
+            with os.fdopen(fd, 'w') as file:
+                json.dump(lease, file)
+
+            if os.path.exists(self._file('done', task_id + '.json')):
+                # committed by a worker whose lease had expired
+                self._remove_lease(task_id, lease)
+                continue
+
+            with open(self._file('tasks', task_id + '.json')) as file:
+                task = json.load(file)
+            task['lease'] = lease
+
+            return task
+
+        return None
+
+
+    def heartbeat(self, task: dict) -> bool:
+        '''
+        Renews the lease of task; returns False if it was reclaimed in the meantime
+        '''
+        path = self._file('leases', task['id'] + '.json')
+        if self._lease(task['id']) != task['lease']:
+            return False
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            return False
+        return True
+
+
+    def complete(self, task: dict, result: dict = None) -> bool:
+        '''
+        Records task as done once its results are in the store
+
+        Args:
+            task(dict): claimed task
+            result(dict): e.g. rows and partition of the stored experiment
+
+        Returns:
+            bool: False if the run had been committed before, by an earlier attempt
+        '''
+        record = dict(result or {}, id=task['id'], name=task['name'], **task['lease'])
+        record['finished'] = self.now()
+        record['seconds'] = record['finished'] - task['lease']['claimed']
+
+        committed = _create_json(self._file('done', task['id'] + '.json'), record)
+        self._remove_lease(task['id'], task['lease'])
+
+        return committed
+
+
+    def fail(self, task: dict, error: str) -> bool:
+        '''
+        Records a failed attempt of task and releases it
+
+        Returns:
+            bool: True if the run is given up, False if it will be attempted again
+        '''
+        attempt = task['lease']['attempt']
+        _write_json(self._file('attempts', f'{task["id"]}.{attempt}.json'),
+                    dict(task['lease'], reason='failed', error=error, ended=self.now()))
+
+        given_up = attempt >= self.max_attempts
+        if given_up:
+            _create_json(self._file('failed', task['id'] + '.json'),
+                         dict(task['lease'], id=task['id'], name=task['name'], error=error))
+        self._remove_lease(task['id'], task['lease'])
+
+        return given_up
+
+
+    def release(self, task: dict) -> None:
+        '''
+        gives the claim of task back without counting an attempt, e.g. when a worker is stopped
+        '''
+        self._remove_lease(task['id'], task['lease'])
+
+
+    def reclaim(self) -> list:
+        '''
+        Moves the leases not renewed for lease_seconds to attempts/, making their runs claimable
+
+        Returns:
+            List[str]: ids of the reclaimed runs
+        '''
+        now = self.now()
+        reclaimed = []
+        for task_id in self._ids('leases'):
+            path = self._file('leases', task_id + '.json')
+            try:
+                age = now - os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if age <= self.lease_seconds:
+                continue
+
+            try:
+                with open(path, 'rb') as file:
+                    content = file.read()
+            except FileNotFoundError:
+                continue
+            try:
+                lease = json.loads(content)
+            except ValueError:
+                # its claimer died while writing it
+                lease = {}
+
+            attempt = lease.get('attempt') or self._attempts(task_id) + 1
+            if not self._take_lease(task_id, content, attempt):
+                # reclaimed by another worker, or renewed or replaced since the stat
+                continue
+            print(f'Reclaimed run {task_id} from {lease.get("worker")} (no heartbeat for {age:.0f}s)')
+            reclaimed.append(task_id)
+
+            if attempt >= self.max_attempts and not os.path.exists(self._file('done', task_id + '.json')):
+                _create_json(self._file('failed', task_id + '.json'),
+                             dict(lease, id=task_id, error=f'lease expired after {age:.0f}s'))
+
+        return reclaimed
+
+
+    def _take_lease(self, task_id: str, content: bytes, attempt: int) -> bool:
+        '''
+        Moves the expired lease of task_id to attempts/ as the given attempt if
+        the file still holds content
+
+        The lease is renamed to a name unique to this call first, so of several
+        workers reclaiming it only one gets it. The moved file is then checked:
+        a lease renewed by its worker or replaced by a new claim since it was
+        found expired is put back, unless a new claim has taken its place.
+
+        Returns:
+            bool: True if the lease was moved to attempts/
+        '''
+        path = self._file('leases', task_id + '.json')
+        taken = self._file('leases', f'.{task_id}.{uuid.uuid4().hex}.reclaim')
+        try:
+            os.rename(path, taken)
+        except FileNotFoundError:
+            return False
+
+        with open(taken, 'rb') as file:
+            moved = file.read()
+        expired = self.now() - os.stat(taken).st_mtime > self.lease_seconds
+
+        if moved != content or not expired:
+            try:
+                os.link(taken, path)
+            except FileExistsError:
+                # claimed again while the lease was away; the old claim is lost
+                pass
+            os.remove(taken)
+            return False
+
+        try:
+            os.link(taken, self._file('attempts', f'{task_id}.{attempt}.json'))
+        except FileExistsError:
+            # recorded as failed by its worker already
+            pass
+        os.remove(taken)
+
+        return True
+
+
+    def _attempts(self, task_id: str) -> int:
+        prefix = task_id + '.'
+        return sum(1 for name in os.listdir(os.path.join(self.path, 'attempts')) if name.startswith(prefix))
+
+
+    def _lease(self, task_id: str) -> dict:
+        try:
+            with open(self._file('leases', task_id + '.json')) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            # gone, or still being written by its claimer
+            return None
+
+
+    def _remove_lease(self, task_id: str, lease: dict) -> None:
+        '''
+        removes the lease of task_id if it still is the given one
+        '''
+        if self._lease(task_id) == lease:
+            try:
+                os.remove(self._file('leases', task_id + '.json'))
+            except FileNotFoundError:
+                pass
+
+
+    def finished(self) -> bool:
+        '''
+        tells whether every submitted run is done or given up
+        '''
+        return not (self._ids('tasks') - self._ids('done') - self._ids('failed'))
+
+
+    def status(self, window=900.) -> dict:
+        '''
+        Returns the progress of the queue
+
+        Args:
+            window(float): seconds over which the current throughput is measured
+
+        Returns:
+            dict: counts of tasks, pending, running, done and failed runs; running
+                runs with worker and age; runs per hour overall and in the last
+                window; estimated seconds to drain the queue; and per worker the
+                runs done and their mean duration
+        '''
+        now = self.now()
+        tasks, done, failed = self._ids('tasks'), self._ids('done'), self._ids('failed')
+        leases = self._ids('leases') - done - failed
+
+        running = []
+        for task_id in sorted(leases):
+            lease = self._lease(task_id) or {}
+            try:
+                heartbeat = now - os.stat(self._file('leases', task_id + '.json')).st_mtime
+            except FileNotFoundError:
+                continue
+            running.append({'id': task_id, 'worker': lease.get('worker'), 'attempt': lease.get('attempt'),
+                            'seconds': now - lease['claimed'] if 'claimed' in lease else None,
+                            'heartbeat': heartbeat})
+
+        records = []
+        for task_id in done:
+            try:
+                with open(self._file('done', task_id + '.json')) as file:
+                    records.append(json.load(file))
+            except (FileNotFoundError, ValueError):
+                continue
+
+        workers = {}
+        for record in records:
+            stats = workers.setdefault(record['worker'], {'runs': 0, 'seconds': 0.})
+            stats['runs'] += 1
+            stats['seconds'] += record['seconds']
+        for stats in workers.values():
+            stats['mean_seconds'] = stats.pop('seconds') / stats['runs']
+
+        first = min((record['claimed'] for record in records), default=None)
+        overall = 3600 * len(records) / (now - first) if records and now > first else None
+        recent = [record for record in records if now - record['finished'] <= window]
+        current = 3600 * len(recent) / min(window, now - first) if recent and now > first else None
+
+        remaining = len(tasks) - len(done) - len(failed)
+        rate = current or overall
+
+        return {'tasks': len(tasks), 'pending': remaining - len(running), 'running': len(running),
+                'done': len(done), 'failed': len(failed),
+                'runs_per_hour': overall, 'recent_runs_per_hour': current,
+                'eta_seconds': 3600 * remaining / rate if rate and remaining else None,
+                'workers': workers, 'running_runs': running}
+
+
+    def report(self) -> dict:
+        '''
+        prints the progress and throughput of the queue, see status
+        '''
+        status = self.status()
+
+        print(f'{self.path}: {status["done"]}/{status["tasks"]} done, {status["running"]} running, '
+              f'{status["pending"]} pending, {status["failed"]} failed')
+        if status['runs_per_hour']:
+            eta = f', done in {status["eta_seconds"] / 60:.0f}min' if status['eta_seconds'] else ''
+            print(f'throughput {status["runs_per_hour"]:.1f} runs/h overall, '
+                  f'{status["recent_runs_per_hour"] or 0:.1f} runs/h recently{eta}')
+
+        for worker, stats in sorted(status['workers'].items()):
+            print(f'  {worker:<40}{stats["runs"]:>6} runs{stats["mean_seconds"]:>9.1f}s per run')
+        for run in status['running_runs']:
+            seconds = f'{run["seconds"]:.0f}s' if run['seconds'] is not None else '?'
+            print(f'  running {run["id"]} on {run["worker"]} (attempt {run["attempt"]}, {seconds}, '
+                  f'heartbeat {run["heartbeat"]:.0f}s ago)')
+
+        return status
+
+
+class Heartbeat:
+    '''
+    Renews the lease of a claimed task in a background thread while the run is processed
+
+    Attributes:
+        lost(bool): the lease was reclaimed by another worker
+    '''
+
+    def __init__(self, queue: WorkQueue, task: dict, interval: float = None):
+
+        self.queue = queue
+        self.task = task
+        self.interval = interval or max(1., queue.lease_seconds / 5)
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f'heartbeat-{self.task["id"]}', daemon=True)
+        self._thread.start()
+        return self
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.heartbeat(self.task):
+                print(f'Lease of {self.task["id"]} was reclaimed; its result is committed only once.')
+                self.lost = True
+                return
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def worker_name() -> str:
+    '''
+    returns a name identifying this process across nodes
+    '''
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def _temporary(path: str) -> str:
+    '''
+    returns a hidden file name next to path, unique to this call also among threads
+    '''
+    return f'{os.path.join(os.path.dirname(path), "." + os.path.basename(path))}.{uuid.uuid4().hex}.tmp'
+
+
+def _write_json(path: str, data: dict) -> None:
+    '''
+    writes data to path atomically
+    '''
+    tmp = _temporary(path)
+    with open(tmp, 'w') as file:
+        json.dump(data, file, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def _create_json(path: str, data: dict) -> bool:
+    '''
+    writes data to path unless it exists; returns False if it did
+    '''
+    tmp = _temporary(path)
+    with open(tmp, 'w') as file:
+        json.dump(data, file, indent=2, default=str)
+    try:
+        # a hard link fails if the target exists, unlike os.replace
+        os.link(tmp, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
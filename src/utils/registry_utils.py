@@ -0,0 +1,321 @@
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import numpy as np
+import pandas as pd
+
+from utils.store_utils import ExperimentStore
+
+
+def compact(df: pd.DataFrame, floats=False) -> pd.DataFrame:
+    '''
+    Returns df with the smallest dtypes that hold its values
+
+    Integer columns (e.g. year, month, day, hour, weekday of the weather)
+    become the smallest integer type fitting their range and text columns
+    become categoricals. With floats, float64 columns become float32 if
+    every value survives the conversion unchanged. Object columns holding
+    tuples are dropped; they only repeat the timestamp index.
+
+    Float32 columns print differently, so frames compacted with floats
+    are for memory only; see widen before writing them out.
+
+    Args:
+        df(pd.DataFrame): experiment data
+        floats(bool): also compact float columns
+
+    Returns:
+        pd.DataFrame: compacted copy with the same index and column order
+    '''
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        kind = values.dtype.kind
+
+        if kind == 'O':
+            present = values.dropna()
+            if len(present) and isinstance(present.iloc[0], tuple):
+                continue
+            if pd.api.types.infer_dtype(present, skipna=True) == 'string':
+                values = values.astype('category')
+
+        elif kind == 'i':
+            values = pd.to_numeric(values, downcast='integer')
+
+        elif kind == 'u':
+            values = pd.to_numeric(values, downcast='unsigned')
+
+        elif kind == 'f' and floats and values.dtype.itemsize > 4:
+            with np.errstate(over='ignore', invalid='ignore'):
+                single = values.to_numpy().astype(np.float32)
+            if np.array_equal(single.astype(np.float64), values.to_numpy(), equal_nan=True):
+                values = pd.Series(single, index=df.index, name=col)
+
+        columns[col] = values
+
+    return pd.DataFrame(columns, index=df.index)
+
+
+def widen(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns df with its float32 columns as float64, e.g. to write a frame compacted with floats
+    '''
+    singles = {col: np.float64 for col, dtype in df.dtypes.items() if dtype == np.float32}
+    return df.astype(singles) if singles else df
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    '''
+    returns the memory taken by df, including its index and the strings of object columns
+    '''
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class Experiment(MutableMapping):
+    '''
+    One entry of an ExperimentRegistry, holding cfg_file, cfg and data of an experiment.
+
+    Behaves like the dict it replaces; 'data' is handed to the registry,
+    which may spill it to disk and load it again when it is accessed.
+    Keys can also be read as attributes.
+    '''
+
+    def __init__(self, registry, name: str):
+
+        self._registry = registry
+        self._name = name
+        self._items = {}
+
+
+    def __getitem__(self, key):
+        if key == 'data':
+            return self._registry._get_data(self._name)
+        return self._items[key]
+
+
+    def __setitem__(self, key, value):
+        if key == 'data':
+            self._registry._set_data(self._name, value)
+        else:
+            self._items[key] = value
+
+
+    def __delitem__(self, key):
+        if key == 'data':
+            self._registry._drop_data(self._name)
+        else:
+            del self._items[key]
+
+
+    def __contains__(self, key):
+        if key == 'data':
+            return self._registry._has_data(self._name)
+        return key in self._items
+
+
+    def __iter__(self):
+        yield from self._items
+        if self._registry._has_data(self._name):
+            yield 'data'
+
+
+    def __len__(self):
+        return len(self._items) + self._registry._has_data(self._name)
+
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+
+    def __repr__(self):
+        return f'Experiment({self._name!r}, keys={list(self)})'
+
+
+class ExperimentRegistry(MutableMapping):
+    '''
+    Experiments of a DataClerk, with their data kept within a memory budget.
+
+    Maps experiment names to Experiment entries. Data frames are compacted
+    (see compact) when they are stored. Once the frames held in memory
+    take more than max_bytes, the least recently used ones are spilled to
+    an ExperimentStore in a private temporary directory and dropped; they
+    are loaded again, transparently, the next time their data is accessed.
+    A frame that was loaded and not set again is not written twice, so
+    frames modified in place have to be stored again with
+    registry[name]['data'] = df. Data is set, loaded and spilled under a
+    lock, so the registry can be shared by threads (see RunPipeline).
+
+    Attributes:
+        spill_path(str): directory in which the spill directory is created
+        max_bytes(int): budget of the frames held in memory, None for no limit
+        compact_floats(bool): also hold float columns as float32 where that loses
+            nothing, see compact; frames written out have to be widened again
+        use_compact(bool): compact frames when they are stored
+        spills(int): number of frames written to disk
+        loads(int): number of frames loaded from disk
+    '''
+
+    def __init__(self, spill_path: str, max_bytes=None, compact_floats=False, use_compact=True):
+
+        self.spill_path = spill_path
+        self.max_bytes = max_bytes
+        self.compact_floats = compact_floats
+        self.use_compact = use_compact
+
+        self.spills = 0
+        self.loads = 0
+
+        self._experiments = {}
+        # frames in memory, least recently used first
+        self._frames = OrderedDict()
+        self._bytes = {}
+        # name -> partition of the spilled frame, if it is up to date
+        self._spilled = {}
+        # name -> (rows, columns, bytes) of the last frame stored
+        self._sizes = {}
+        self._store = None
+        self._lock = threading.RLock()
+
+
+    @property
+    def spill(self) -> ExperimentStore:
+        '''
+        store of the spilled frames, created on first use and removed with the registry
+        '''
+        if self._store is None:
+            os.makedirs(self.spill_path, exist_ok=True)
+            directory = tempfile.mkdtemp(prefix='registry_', dir=self.spill_path)
+            self._store = ExperimentStore(directory)
+            weakref.finalize(self, shutil.rmtree, directory, True)
+
+        return self._store
+
+
+    def __getitem__(self, name) -> Experiment:
+        return self._experiments[name]
+
+
+    def __setitem__(self, name, items):
+        if name in self._experiments:
+            self._drop_data(name)
+
+        experiment = Experiment(self, name)
+        self._experiments[name] = experiment
+        for key, value in dict(items).items():
+            experiment[key] = value
+
+
+    def __delitem__(self, name):
+        self._drop_data(name)
+        del self._experiments[name]
+
+
+    def __iter__(self):
+        return iter(self._experiments)
+
+
+    def __len__(self):
+        return len(self._experiments)
+
+
+    def memory_bytes(self) -> int:
+        '''
+        returns the memory taken by the frames held in memory
+        '''
+        return sum(self._bytes.values())
+
+
+    def memory_usage(self) -> pd.DataFrame:
+        '''
+        Returns one row per experiment with data: its rows, columns and bytes
+        (as of the last time it was in memory) and whether it is in memory or on disk
+        '''
+        rows = []
+        with self._lock:
+            sizes = list(self._sizes.items())
+        for name, (length, width, size) in sizes:
+            rows.append({'experiment': name, 'rows': length, 'columns': width, 'bytes': size,
+                         'in_memory': name in self._frames, 'spilled': name in self._spilled})
+
+        columns = ['experiment', 'rows', 'columns', 'bytes', 'in_memory', 'spilled']
+        return pd.DataFrame(rows, columns=columns).set_index('experiment')
+
+
+    def _has_data(self, name) -> bool:
+        return name in self._frames or name in self._spilled
+
+
+    def _get_data(self, name) -> pd.DataFrame:
+
+        with self._lock:
+            if name in self._frames:
+                self._frames.move_to_end(name)
+                return self._frames[name]
+
+            if name not in self._spilled:
+                raise KeyError('data')
+
+            df = self.spill.read_path(self._spilled[name])
+            if self.use_compact:
+                # the store keeps categoricals as text
+                df = compact(df)
+            self.loads += 1
+            self._track(name, df)
+
+            return df
+
+
+    def _set_data(self, name, df: pd.DataFrame) -> None:
+
+        if self.use_compact:
+            df = compact(df, floats=self.compact_floats)
+
+        with self._lock:
+            self._drop_data(name)
+            self._track(name, df)
+
+
+    def _drop_data(self, name) -> None:
+
+        with self._lock:
+            self._frames.pop(name, None)
+            self._bytes.pop(name, None)
+            self._sizes.pop(name, None)
+            path = self._spilled.pop(name, None)
+            if path is not None:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+    def _track(self, name, df) -> None:
+
+        size = frame_bytes(df)
+        self._frames[name] = df
+        self._frames.move_to_end(name)
+        self._bytes[name] = size
+        self._sizes[name] = (len(df), len(df.columns), size)
+
+        if self.max_bytes is None:
+            return
+
+        # evict cold frames; the frame just accessed stays even if it exceeds the budget alone
+        while self.memory_bytes() > self.max_bytes and len(self._frames) > 1:
+            self._evict(next(iter(self._frames)))
+
+
+    def _evict(self, name) -> None:
+
+        df = self._frames.pop(name)
+        del self._bytes[name]
+
+        if name not in self._spilled:
+            self._spilled[name] = self.spill.write(name, df)
+            self.spills += 1
@@ -0,0 +1,316 @@
+import os
+import time
+import signal
+import shutil
+import tempfile
+import traceback
+import multiprocessing as mp
+
+from utils import profile_utils
+from utils.profile_utils import span
+from utils.idf_utils import build_model
+from utils.sim_utils import get_simulator
+
+
+def simulate(cfg, scratch_dir: str, idd_file: str = None, sim_cache=None, simulator=None) -> bool:
+    '''
+    Builds and runs the EnergyPlus model of one config inside scratch_dir.
+    Intended to be the target of a worker process: the working directory
+    is changed for the whole process so that intermediate files written by
+    build_model (e.g. 'hold_model.idf') do not collide between runs, so the
+    paths in cfg must be absolute.
+
+    Args:
+        cfg(AttrDict): run config as returned by DataClerk.setup_cfg, out_dir being the
+            directory of this attempt, see attempt_dir
+        scratch_dir(str): private working directory of this run
+        idd_file(str): EnergyPlus data dictionary; set if not yet known to eppy
+        sim_cache(SimulationCache): skips the simulation if an identical run is cached
+        simulator: backend from utils.sim_utils, EnergyPlus if None
+
+    Returns:
+        bool: True if the outputs were taken from sim_cache
+    '''
+    from eppy.modeleditor import IDF
+
+    if idd_file is not None and IDF.getiddname() is None:
+        IDF.setiddname(idd_file)
+
+    os.chdir(scratch_dir)
+
+    with span('build_model', run=cfg.name):
+        model = build_model(cfg, view=False)
+    simulator = get_simulator(simulator)
+
+    with span('simulate', run=cfg.name, simulator=simulator.name) as timer:
+        if sim_cache is None:
+            simulator.run(model, cfg.out_dir)
+            return False
+
+        hit = sim_cache.run(model, cfg.out_dir, simulator=simulator)
+        timer.set(cache_hit=hit)
+        profile_utils.count('sim_cache_hits' if hit else 'sim_cache_misses', run=cfg.name)
+
+    return hit
+
+
+def _worker(cfg, scratch_dir, idd_file, sim_cache, simulator, hits, spans=None):
+    '''
+    process entry point; maps exceptions to a non-zero exit code
+    and reports cache hits to the parent through the queue hits,
+    and the profiled spans through the queue spans if the parent profiles
+    '''
+    if hasattr(os, 'setsid'):
+        # EnergyPlus and its helpers join the group, so a timeout kills them all, see kill_group
+        os.setsid()
+
+    profiler = profile_utils.enable(f'run-{cfg.name}') if spans is not None else profile_utils.disable()
+    try:
+        hit = simulate(cfg, scratch_dir, idd_file=idd_file, sim_cache=sim_cache, simulator=simulator)
+        if sim_cache is not None:
+            hits.put(hit)
+    except Exception:
+        traceback.print_exc()
+        raise SystemExit(1)
+    finally:
+        if spans is not None:
+            spans.put((profiler.spans, profiler.counters))
+
+
+def kill_group(proc) -> None:
+    '''
+    kills proc and all processes it started, if it leads a process group of its own
+    (os.setsid or start_new_session); only proc itself where there are no process groups
+    '''
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except (ProcessLookupError, PermissionError):
+            # not yet a group leader
+            pass
+    proc.kill()
+
+
+def attempt_dir(out_dir: str) -> str:
+    '''
+    Creates the output directory of one attempt of a run next to out_dir, so that
+    the outputs of an attempt that is killed or fails never mix with those of the
+    next one; see place_outputs
+    '''
+    parent, name = os.path.split(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+
+    return tempfile.mkdtemp(prefix=f'.{name}.', suffix='.attempt', dir=parent)
+
+
+def place_outputs(directory: str, out_dir: str) -> None:
+    '''
+    Moves the outputs of a successful attempt to out_dir, replacing those of earlier runs
+
+    The old outputs are renamed aside first, so out_dir always holds a
+    complete set of outputs. directory must be on the file system of
+    out_dir, see attempt_dir.
+    '''
+    old = None
+    if os.path.exists(out_dir):
+        old = directory + '.old'
+        os.replace(out_dir, old)
+    os.replace(directory, out_dir)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+class RunExecutor:
+    '''
+    Runs EnergyPlus simulations of several configs in parallel worker processes.
+
+    Every attempt of every run gets its own scratch directory, output
+    directory and process group, so a run exceeding its timeout can be
+    killed together with the simulator it started and retried without
+    affecting the others. The outputs of an attempt are moved to
+    cfg.out_dir only once it succeeded. Finished runs are handed to a callback strictly
+    in the order of the input configs, regardless of the order in which
+    they complete.
+
+    Attributes:
+        workers(int): maximum number of concurrent simulations
+        timeout(float): seconds after which a run is killed, None for no limit
+        retries(int): number of additional attempts for failed or timed out runs
+        scratch_root(str): directory in which the scratch directories are created
+        idd_file(str): EnergyPlus data dictionary passed on to the workers
+        sim_cache(SimulationCache): cache of simulation outputs shared by the workers
+        simulator: backend from utils.sim_utils used by the workers, EnergyPlus if None
+        failed(List[str]): names of runs that did not succeed in any attempt
+    '''
+
+    def __init__(self, workers=None, timeout=None, retries=0, scratch_root=None,
+                 idd_file=None, sim_cache=None, simulator=None, poll_interval=0.2):
+
+        self.workers = workers or os.cpu_count()
+        self.timeout = timeout
+        self.retries = retries
+        self.scratch_root = scratch_root
+        self.idd_file = idd_file
+        self.sim_cache = sim_cache
+        self.simulator = simulator
+        self.poll_interval = poll_interval
+
+        self.failed = []
+        self._hits = mp.Queue()
+        self._spans = mp.Queue()
+
+
+    def run(self, cfgs, on_done=None, on_start=None, on_poll=None) -> list:
+        '''
+        Simulates all cfgs and calls on_done(cfg) for each successful run in input order
+
+        cfgs are consumed lazily, only as worker slots become free, so a
+        generator such as utils.sweep_utils.expand_sweep can be passed in directly
+
+        Args:
+            cfgs(Iterable[AttrDict]): configs as returned by DataClerk.setup_cfg
+            on_done(callable): called in the parent process with the config of each finished run
+            on_start(callable): called in the parent process with the config of every attempt
+                just before it is launched; its out_dir is the directory of the attempt
+            on_poll(callable): called in the parent process with the config of every running
+                attempt once per poll interval, e.g. to ingest its output while it is written,
+                and once more before the outputs of a successful attempt are moved
+
+        Returns:
+            List[bool]: success of each run, in the order of cfgs
+        '''
+        if self.scratch_root is not None:
+            os.makedirs(self.scratch_root, exist_ok=True)
+
+        cfgs = iter(cfgs)
+        started = []
+        attempts = []
+        status = []
+        retry = []
+        running = {}
+        next_report = 0
+        exhausted = False
+
+        try:
+            while True:
+
+                # fill free worker slots, retries first
+                while len(running) < self.workers:
+                    if retry:
+                        i = retry.pop(0)
+                    elif not exhausted:
+                        try:
+                            started.append(next(cfgs))
+                        except StopIteration:
+                            exhausted = True
+                            continue
+                        attempts.append(0)
+                        status.append(None)
+                        i = len(started) - 1
+                    else:
+                        break
+                    attempt = type(started[i])(started[i])
+                    attempt['out_dir'] = attempt_dir(started[i].out_dir)
+                    if on_start is not None:
+                        on_start(attempt)
+                    running[i] = (attempt,) + self._start(attempt)
+                    attempts[i] += 1
+
+                if not running:
+                    break
+
+                time.sleep(self.poll_interval)
+
+                if on_poll is not None:
+                    for attempt, *_ in running.values():
+                        on_poll(attempt)
+
+                for i, (attempt, proc, scratch_dir, start, clock) in list(running.items()):
+                    cfg = started[i]
+                    timed_out = self.timeout is not None and time.monotonic() - clock > self.timeout
+
+                    if proc.is_alive() and not timed_out:
+                        continue
+
+                    if timed_out and proc.is_alive():
+                        print(f'Run {cfg.name} exceeded timeout of {self.timeout}s; terminating.')
+                        kill_group(proc)
+                        profile_utils.count('timeouts', run=cfg.name)
+                    proc.join()
+                    del running[i]
+                    shutil.rmtree(scratch_dir, ignore_errors=True)
+
+                    profiler = profile_utils.active()
+                    if profiler is not None:
+                        profiler.add('attempt', start, time.monotonic() - clock, run=cfg.name,
+                                     attempt=attempts[i], exitcode=proc.exitcode)
+
+                    if proc.exitcode == 0:
+                        if on_poll is not None:
+                            on_poll(attempt)
+                        place_outputs(attempt.out_dir, cfg.out_dir)
+                        status[i] = True
+                        continue
+
+                    shutil.rmtree(attempt.out_dir, ignore_errors=True)
+                    if attempts[i] <= self.retries:
+                        print(f'Run {cfg.name} failed (attempt {attempts[i]}); retrying.')
+                        retry.append(i)
+                    else:
+                        print(f'Run {cfg.name} failed after {attempts[i]} attempts.')
+                        status[i] = False
+                        self.failed.append(cfg.name)
+
+                while self.sim_cache is not None and not self._hits.empty():
+                    self.sim_cache.record(self._hits.get())
+                self._collect_spans()
+
+                # hand finished runs to the caller in input order
+                while next_report < len(status) and status[next_report] is not None:
+                    if status[next_report] and on_done is not None:
+                        on_done(started[next_report])
+                    # finished configs are not needed anymore
+                    started[next_report] = None
+                    next_report += 1
+
+        finally:
+            # e.g. interrupted: the simulations run in sessions of their own and would outlive this one
+            for attempt, proc, scratch_dir, *_ in running.values():
+                kill_group(proc)
+                proc.join()
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+                shutil.rmtree(attempt.out_dir, ignore_errors=True)
+
+        while self.sim_cache is not None and not self._hits.empty():
+            self.sim_cache.record(self._hits.get())
+        self._collect_spans()
+
+        return status
+
+
+    def _collect_spans(self):
+        '''
+        merges the spans profiled by finished workers into the profiler of this process
+        '''
+        profiler = profile_utils.active()
+        while not self._spans.empty():
+            spans, counters = self._spans.get()
+            if profiler is not None:
+                profiler.extend(spans, counters)
+
+
+    def _start(self, cfg):
+        '''
+        launches one attempt of cfg in a fresh process and scratch directory,
+        returns the process, the directory and the wall and monotonic time of the launch
+        '''
+        scratch_dir = tempfile.mkdtemp(prefix=cfg.name + '_', dir=self.scratch_root)
+        spans = self._spans if profile_utils.active() is not None else None
+        proc = mp.Process(target=_worker, 
+                          args=(cfg, scratch_dir, self.idd_file, self.sim_cache, self.simulator, self._hits,
+                                spans),
+                          name=f'run-{cfg.name}')
+        proc.start()
+
+        return proc, scratch_dir, time.time(), time.monotonic()
@@ -0,0 +1,150 @@
+import numpy as np
+
+
+class ScheduleIndex:
+    '''
+    Index of all numeric values in the temperature typed SCHEDULE:COMPACT
+    objects of a model.
+
+    The index is built once per prototype building and stores, for every
+    value, the object it belongs to, its position in the object's field
+    list, the value itself and the period it applies to ('Through' date,
+    'For' day types, 'Until' time). Transforms are then computed on the
+    whole value array at once and written back by position, for any number
+    of copies of the prototype. All fields of an object are covered,
+    however long it is.
+
+    Attributes:
+        key(str): idf class of the indexed objects
+        objects(np.ndarray): index of the owning object in model.idfobjects[key]
+        positions(np.ndarray): position of the value in the object's field list
+        values(np.ndarray): original values
+        names(np.ndarray): names of the owning schedules
+        through(np.ndarray): last day of the period as month*100 + day
+        day_types(np.ndarray): 'For' specification of the period
+        until(np.ndarray): end of the time interval in minutes after midnight
+    '''
+
+    key = 'SCHEDULE:COMPACT'
+
+    def __init__(self, model, type_limits='Temperature'):
+
+        objects, positions, values = [], [], []
+        names, through, day_types, until = [], [], [], []
+
+        for i, schedule in enumerate(model.idfobjects[self.key]):
+            if schedule.Schedule_Type_Limits_Name != type_limits:
+                continue
+
+            curr_through, curr_for, curr_until = 1231, '', 24 * 60
+            obj = schedule['obj']
+
+            # obj holds the class name, Name and Schedule_Type_Limits_Name before the fields
+            for position in range(3, len(obj)):
+                field = str(obj[position]).strip()
+                label, _, spec = field.partition(':')
+                label = label.strip().lower()
+
+                if label == 'through':
+                    month, _, day = spec.strip().partition('/')
+                    curr_through = int(month) * 100 + int(day)
+                elif label == 'for':
+                    curr_for = spec.strip()
+                elif label == 'until':
+                    hours, _, minutes = spec.strip().partition(':')
+                    curr_until = int(hours) * 60 + int(minutes or 0)
+                else:
+                    try:
+                        value = float(field)
+                    except ValueError:
+                        continue
+
+                    objects.append(i)
+                    positions.append(position)
+                    values.append(value)
+                    names.append(schedule.Name)
+                    through.append(curr_through)
+                    day_types.append(curr_for)
+                    until.append(curr_until)
+
+        self.objects = np.array(objects, dtype=np.int64)
+        self.positions = np.array(positions, dtype=np.int64)
+        self.values = np.array(values, dtype=float)
+        self.names = np.array(names, dtype=str)
+        self.through = np.array(through, dtype=np.int64)
+        self.day_types = np.array(day_types, dtype=str)
+        self.until = np.array(until, dtype=np.int64)
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def mask(self, names=None, day_types=None, until_from=None, until_to=None) -> np.ndarray:
+        '''
+        Returns a boolean mask selecting values by schedule and period
+
+        Args:
+            names(str): only schedules whose name contains this (case insensitive)
+            day_types(str): only periods whose 'For' field contains this, e.g. 'Weekdays'
+            until_from(int): only intervals ending at or after this hour
+            until_to(int): only intervals ending at or before this hour
+        '''
+        mask = np.ones(len(self), dtype=bool)
+
+        if names is not None:
+            mask &= np.char.find(np.char.lower(self.names), names.lower()) >= 0
+        if day_types is not None:
+            mask &= np.char.find(np.char.lower(self.day_types), day_types.lower()) >= 0
+        if until_from is not None:
+            mask &= self.until >= until_from * 60
+        if until_to is not None:
+            mask &= self.until <= until_to * 60
+
+        return mask
+
+
+    def read(self, model) -> np.ndarray:
+        '''
+        Returns the current values of the indexed fields of model, which must be
+        the indexed model or a copy of it; nan for fields edited to a non-number
+        '''
+        schedules = model.idfobjects[self.key]
+        values = np.full(len(self), np.nan)
+
+        for j, (i, position) in enumerate(zip(self.objects.tolist(), self.positions.tolist())):
+            try:
+                values[j] = float(schedules[i]['obj'][position])
+            except (IndexError, TypeError, ValueError):
+                pass
+
+        return values
+
+
+    def transform(self, scale=1., offset=0., mask=None, values=None) -> np.ndarray:
+        '''
+        Returns values * scale + offset; scale and offset may be scalars or
+        arrays with one entry per value. Values outside mask are unchanged.
+        values default to the indexed ones, see read for those of an edited copy.
+        '''
+        values = self.values if values is None else values
+        transformed = values * scale + offset
+        if mask is not None:
+            transformed = np.where(mask, transformed, values)
+
+        return transformed
+
+
+    def apply(self, model, values) -> None:
+        '''
+        Writes values (one per indexed field) into model, which must be the
+        indexed model or a copy of it; fields whose value is nan are left as they are
+        '''
+        schedules = model.idfobjects[self.key]
+        values = np.asarray(values, dtype=float)
+        keep = ~np.isnan(values)
+        formatted = np.char.mod('%.6g', values[keep])
+
+        for i, position, value in zip(self.objects[keep].tolist(), self.positions[keep].tolist(),
+                                      formatted.tolist()):
+            schedules[i]['obj'][position] = value
@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+from utils import synth_utils
+from utils.cache_utils import model_hash, simulator_version
+from utils.edit_utils import write_idf
+
+
+# bump whenever LocalSimulator writes different outputs for the same model
+LOCAL_SIMULATOR_VERSION = 1
+
+# EnergyPlus reporting frequencies reported once per timestep by LocalSimulator;
+# all coarser ones are reported daily
+STEP_FREQUENCIES = {'detailed', 'timestep', 'hourly'}
+
+
+class EnergyPlusSimulator:
+    '''
+    Runs models with the EnergyPlus installation known to eppy
+    '''
+
+    name = 'energyplus'
+
+    def run(self, model, output_directory: str, **run_kwargs) -> None:
+        '''
+        simulates model and writes the outputs to output_directory, like IDF.run but
+        writing the model with utils.edit_utils.write_idf instead of IDF.saveas
+        '''
+        import tempfile
+        from eppy.runner.run_functions import run
+
+        run_kwargs.setdefault('weather', model.epw)
+        run_kwargs.setdefault('idd', model.iddname)
+        run_kwargs.setdefault('ep_version', '-'.join(str(part) for part in model.idd_version[:3]))
+
+        with tempfile.TemporaryDirectory() as model_dir:
+            idf = write_idf(model, os.path.join(model_dir, 'in.idf'))
+            run(idf, output_directory=output_directory, **run_kwargs)
+
+
+    def version(self, model) -> str:
+        '''
+        returns a string identifying the simulator, part of the simulation cache key
+        '''
+        return simulator_version(model)
+
+
+    def command(self, model, model_dir: str, output_directory: str) -> list:
+        '''
+        Returns the EnergyPlus command line simulating model in a process of its own,
+        after saving the model to model_dir; used by utils.pipeline_utils.RunPipeline
+        '''
+        idf = write_idf(model, os.path.join(model_dir, 'in.idf'))
+
+        return [energyplus_executable(), '--weather', model.epw,
+                '--output-directory', os.path.abspath(output_directory), idf]
+
+
+def energyplus_executable() -> str:
+    '''
+    Returns the EnergyPlus executable: ENERGYPLUS_EXE if set, else the one next to
+    the IDD known to eppy, else energyplus on the PATH
+    '''
+    executable = os.environ.get('ENERGYPLUS_EXE')
+    if executable:
+        return executable
+
+    from eppy.modeleditor import IDF
+
+    if IDF.getiddname() is not None:
+        directory = os.path.dirname(os.path.abspath(IDF.getiddname()))
+        for name in ('energyplus', 'energyplus.exe'):
+            if os.path.isfile(os.path.join(directory, name)):
+                return os.path.join(directory, name)
+
+    return shutil.which('energyplus') or 'energyplus'
+
+
+class LocalSimulator:
+    '''
+    Deterministic stand-in for EnergyPlus that needs no installation.
+
+    Reads the run period, timestep, Output:Meter and Output:Variable
+    objects of a built model and writes eplusout.mtr and eplusout.eso (and
+    eplusout.sql if requested or the model has Output:SQLite) in EnergyPlus
+    format, with synthetic values that depend only on the model and seed.
+    Meters and variables reported hourly or more often are written once
+    per timestep (once per hour if none asks for timestep frequency),
+    coarser ones once per day. Together with a
+    latency, this lets the orchestration, parsing and storage layers be
+    load tested on machines without EnergyPlus.
+
+    Attributes:
+        latency(float or Tuple[float, float]): seconds each run takes, or the bounds
+            of a uniform distribution drawn from deterministically per model
+        sqlite(bool): always write eplusout.sql
+        seed(int): changes all values
+        runs(int): number of runs simulated by this instance
+    '''
+
+    name = 'local'
+
+    def __init__(self, latency=0., sqlite=False, seed=0):
+
+        self.latency = latency
+        self.sqlite = sqlite
+        self.seed = seed
+        self.runs = 0
+
+
+    def run(self, model, output_directory: str, **run_kwargs) -> None:
+        '''
+        writes outputs of model to output_directory, taking self.latency seconds at least
+        '''
+        self.write(self.plan(model), output_directory)
+        self.runs += 1
+
+
+    def plan(self, model) -> dict:
+        '''
+        Returns everything write needs to know about model as JSON serializable dict,
+        so that the outputs can be written by a process that has no model, see command
+        '''
+        step_names, daily_names, meters, frequencies = self.outputs(model)
+        begin, end = self.run_period(model)
+        seed = self.model_seed(model)
+
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = np.random.default_rng(seed).uniform(*latency)
+
+        return {'seed': seed,
+                'begin': begin.isoformat(),
+                'end': end.isoformat(),
+                # hourly outputs are only written every timestep if some output asks for it
+                'timestep': 60 // self.timesteps_per_hour(model) if frequencies - {'hourly'} else 60,
+                'step_names': step_names,
+                'daily_names': daily_names,
+                'meters': sorted(meters),
+                'sqlite': bool(self.sqlite or model.idfobjects['OUTPUT:SQLITE']),
+                'latency': float(latency)}
+
+
+    @staticmethod
+    def write(plan: dict, output_directory: str) -> None:
+        '''
+        writes the outputs described by plan (see LocalSimulator.plan) to output_directory
+        '''
+        start = time.perf_counter()
+
+        begin, end = pd.Timestamp(plan['begin']), pd.Timestamp(plan['end'])
+        step_names, daily_names, meters = plan['step_names'], plan['daily_names'], set(plan['meters'])
+        timestep, seed = plan['timestep'], plan['seed']
+
+        index = synth_utils.timesteps(timestep, start=begin, end=end)
+        values = synth_utils.profiles(index, step_names, seed)
+        daily_values = synth_utils.profiles(index, daily_names, seed + 1)
+
+        step_meters = [i for i, name in enumerate(step_names) if name in meters]
+        daily_meters = [i for i, name in enumerate(daily_names) if name in meters]
+
+        os.makedirs(output_directory, exist_ok=True)
+        files = {'mtr': os.path.join(output_directory, 'eplusout.mtr'),
+                 'eso': os.path.join(output_directory, 'eplusout.eso'),
+                 'sql': os.path.join(output_directory, 'eplusout.sql')}
+
+        synth_utils.write_report(files['mtr'], [step_names[i] for i in step_meters], timestep,
+                                 daily_names=[daily_names[i] for i in daily_meters],
+                                 start=begin, end=end,
+                                 values=values[:, step_meters], daily_values=daily_values[:, daily_meters])
+        synth_utils.write_report(files['eso'], step_names, timestep, daily_names=daily_names,
+                                 start=begin, end=end, values=values, daily_values=daily_values)
+        if plan['sqlite']:
+            synth_utils.write_sql(files['sql'], step_names, timestep, daily_names=daily_names,
+                                  start=begin, end=end, values=values, daily_values=daily_values,
+                                  meters=meters)
+
+        with open(os.path.join(output_directory, 'eplusout.err'), 'w') as file:
+            file.write(f'Program Version,LocalSimulator {LOCAL_SIMULATOR_VERSION}\n')
+            file.write('   ************* EnergyPlus Completed Successfully-- 0 Warning; 0 Severe Errors\n')
+        with open(os.path.join(output_directory, 'eplusout.end'), 'w') as file:
+            file.write('EnergyPlus Completed Successfully-- 0 Warning; 0 Severe Errors; '
+                       f'Elapsed Time={time.perf_counter() - start:.2f}sec\n')
+
+        remaining = plan['latency'] - (time.perf_counter() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+    def command(self, model, model_dir: str, output_directory: str) -> list:
+        '''
+        Returns the command line that writes the outputs of model in a process of its own,
+        after saving its plan to model_dir; used by utils.pipeline_utils.RunPipeline
+        '''
+        path = os.path.join(model_dir, 'local_plan.json')
+        with open(path, 'w') as file:
+            json.dump(self.plan(model), file)
+
+        return [sys.executable, '-m', 'utils.sim_utils', path, output_directory]
+
+
+    def version(self, model) -> str:
+        '''
+        returns a string identifying the simulator, part of the simulation cache key
+        '''
+        return f'local:{LOCAL_SIMULATOR_VERSION}:{self.seed}:{int(self.sqlite)}'
+
+
+    def model_seed(self, model) -> int:
+        '''
+        returns the seed of all values written for model, derived from its fields and weather
+        '''
+        digest = hashlib.sha256(model_hash(model).encode())
+        digest.update(os.path.basename(model.epw or '').encode())
+        digest.update(str(self.seed).encode())
+
+        return int(digest.hexdigest()[:8], 16)
+
+
+    @staticmethod
+    def run_period(model):
+        '''
+        returns the first and last simulated day of the first RunPeriod of model
+        '''
+        period = model.idfobjects['RUNPERIOD'][0]
+        dates = []
+        for obj in ['Begin', 'End']:
+            try:
+                year = period[obj + '_Year'] or 2020
+            except Exception:
+                # RunPeriod has no year fields before EnergyPlus 9
+                year = 2020
+            dates.append(pd.Timestamp(int(year), int(period[obj + '_Month']),
+                                      int(period[obj + '_Day_of_Month'])))
+
+        return dates[0], dates[1]
+
+
+    @staticmethod
+    def timesteps_per_hour(model) -> int:
+        timestep = model.idfobjects['TIMESTEP']
+        return int(timestep[0].Number_of_Timesteps_per_Hour) if timestep else 6
+
+
+    @staticmethod
+    def outputs(model):
+        '''
+        Returns the names of the requested series as written by EnergyPlus
+
+        Returns:
+            step_names(List[str]): series reported every timestep
+            daily_names(List[str]): series reported daily or less often
+            meters(set): names of the series that are meters
+            frequencies(set): frequencies of the series in step_names
+        '''
+        step_names, daily_names, meters, frequencies = [], [], set(), set()
+
+        def add(name, frequency):
+            frequency = str(frequency).lower()
+            names = step_names if frequency in STEP_FREQUENCIES else daily_names
+            if names is step_names:
+                frequencies.add(frequency)
+            if name not in names:
+                names.append(name)
+
+        for key in ['OUTPUT:METER', 'OUTPUT:METER:METERFILEONLY', 'OUTPUT:METER:CUMULATIVE']:
+            for meter in model.idfobjects[key]:
+                name = f'{meter.Key_Name} [J]'
+                add(name, meter.Reporting_Frequency)
+                meters.add(name)
+
+        zones = [zone.Name for zone in model.idfobjects['ZONE']] or ['Environment']
+        for variable in model.idfobjects['OUTPUT:VARIABLE']:
+            keys = zones if variable.Key_Value in ('*', '') else [variable.Key_Value]
+            for key in keys:
+                add(f'{key},{variable.Variable_Name} [{_unit(variable.Variable_Name)}]',
+                    variable.Reporting_Frequency)
+
+        return step_names, daily_names, meters, frequencies
+
+
+def _unit(variable: str) -> str:
+    '''
+    guesses the unit of an EnergyPlus report variable from its name
+    '''
+    variable = variable.lower()
+    for word, unit in [('temperature', 'C'), ('energy', 'J'), ('per area', 'W/m2'),
+                       ('rate', 'W'), ('humidity', '%'), ('flow', 'kg/s')]:
+        if word in variable:
+            return unit
+    return ''
+
+
+# simulator backends selectable by name, e.g. in execute_runs or on the command line
+SIMULATORS = {
+    EnergyPlusSimulator.name: EnergyPlusSimulator,
+    LocalSimulator.name: LocalSimulator,
+}
+
+
+def get_simulator(simulator=None, **kwargs):
+    '''
+    Returns a simulator backend
+
+    Args:
+        simulator(str or simulator): name in SIMULATORS, an instance (returned as is),
+            or None for the STES_SIMULATOR environment variable, defaulting to EnergyPlus
+        kwargs: passed to the constructor, e.g. latency of LocalSimulator
+    '''
+    if simulator is not None and not isinstance(simulator, str):
+        return simulator
+
+    name = simulator or os.environ.get('STES_SIMULATOR', EnergyPlusSimulator.name)
+    if name not in SIMULATORS:
+        raise ValueError(f'Unknown simulator {name}; choose one of {sorted(SIMULATORS)}')
+
+    return SIMULATORS[name](**kwargs)
+
+
+if __name__ == '__main__':
+
+    # python -m utils.sim_utils <plan> <output directory>, see LocalSimulator.command
+    with open(sys.argv[1]) as file:
+        LocalSimulator.write(json.load(file), sys.argv[2])
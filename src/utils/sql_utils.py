@@ -0,0 +1,326 @@
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from utils.time_utils import fields_to_index, run_years
+
+
+# reporting frequencies of ReportDataDictionary as labelled in .mtr and .eso files
+FREQUENCY_LABELS = {'Each Call': 'Each Call', 'HVAC System Timestep': 'TimeStep', 'Zone Timestep': 'TimeStep',
+                    'Timestep': 'TimeStep', 'Hourly': 'Hourly', 'Daily': 'Daily', 'Monthly': 'Monthly',
+                    'Run Period': 'RunPeriod', 'Annual': 'Annual'}
+
+# fields of the records of lower frequencies, part of the names in .mtr and .eso files
+FREQUENCY_FIELDS = {'Daily': ' [Value,Min,Hour,Minute,Max,Hour,Minute]',
+                    'Monthly': ' [Value,Min,Day,Hour,Minute,Max,Day,Hour,Minute]',
+                    'RunPeriod': ' [Value,Min,Month,Day,Hour,Minute,Max,Month,Day,Hour,Minute]',
+                    'Annual': ' [Value,Min,Month,Day,Hour,Minute,Max,Month,Day,Hour,Minute]'}
+
+# frequencies reported on every row of the frame, all others are sparse as in mtr2df
+STEP_FREQUENCIES = {'Each Call', 'TimeStep', 'Hourly'}
+
+# EnvironmentPeriods.EnvironmentType of the run periods of the weather file (not design days)
+WEATHER_RUN_PERIOD = 3
+
+# series read per scan of ReportData, below the limit of SQLite on the parameters of a query
+SCAN_SERIES = 500
+
+INDEX_NAME = 'stes_ReportData_series'
+INDEX_COLUMNS = ['ReportDataDictionaryIndex', 'TimeIndex', 'Value']
+
+
+def series_name(key: str, name: str, units: str, frequency: str) -> str:
+    '''
+    returns the column name of a series as in mtr2df, e.g. 'Electricity:Facility [J] !Hourly'
+    for meters and 'ZONE 1,Zone Mean Air Temperature [C] !TimeStep' for variables
+    '''
+    label = FREQUENCY_LABELS.get(frequency, frequency)
+    name = f'{key},{name}' if key else name
+
+    return f'{name} [{units or ""}] !{label}{FREQUENCY_FIELDS.get(label, "")}'
+
+
+def _matches(request: str, column: str, key: str, name: str) -> bool:
+    '''
+    a requested series matches its full column name, the name without
+    frequency, its variable or meter name alone or key,name
+    '''
+    return request in (column, column.partition(' !')[0], name, f'{key},{name}')
+
+
+def connect(filename: str, read_only=True) -> sqlite3.Connection:
+    '''
+    opens an sqlite file; read only by default, so reading never changes the output of a run
+    '''
+    if not read_only:
+        return sqlite3.connect(filename)
+    return sqlite3.connect(Path(filename).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def has_index(connection) -> bool:
+    '''
+    tells whether ReportData has a covering index by series and time, see ensure_index
+    '''
+    for _, index, *_ in connection.execute('PRAGMA index_list(ReportData)').fetchall():
+        columns = [row[2] for row in connection.execute(f'PRAGMA index_info("{index}")').fetchall()]
+        if columns[:3] == INDEX_COLUMNS:
+            return True
+
+    return False
+
+
+def ensure_index(connection) -> bool:
+    '''
+    Creates a covering index of ReportData by series and time unless there is one,
+    so that single series are read from the index alone without scanning the table
+
+    Building the index takes several times as long as scanning the table
+    once and about doubles the size of the file, so it only pays off for
+    files read many times (see sql2df).
+
+    Returns:
+        bool: True if such an index exists afterwards; False if the file is read only
+    '''
+    if has_index(connection):
+        return True
+
+    try:
+        with connection:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+                               f'ON ReportData ({", ".join(INDEX_COLUMNS)})')
+    except sqlite3.OperationalError:
+        return False
+
+    return True
+
+
+def sql_series(filename: str) -> pd.DataFrame:
+    '''
+    Returns the data dictionary of an eplusout.sql: one row per series with its
+    dictionary index, column name (see series_name), whether it is a meter,
+    key, name, units and reporting frequency
+    '''
+    connection = connect(filename)
+    try:
+        rows = connection.execute('SELECT ReportDataDictionaryIndex, IsMeter, KeyValue, Name, '
+                                  'ReportingFrequency, Units FROM ReportDataDictionary').fetchall()
+    finally:
+        connection.close()
+
+    series = pd.DataFrame(rows, columns=['index', 'is_meter', 'key', 'name', 'frequency', 'units'])
+    series['column'] = [series_name(key, name, units, frequency) for key, name, units, frequency
+                        in zip(series.key, series.name, series.units, series.frequency)]
+
+    return series
+
+
+def sql2df(filename: str, names=None, start=None, end=None, year=2020, meters_only=False,
+           index=False) -> pd.DataFrame:
+    '''
+    Reads time series from the SQLite output (usually 'eplusout.sql') of an EnergyPlus run
+
+    The file is opened read only. The requested series are read in one
+    scan of ReportData, or, if the file has a covering index (see
+    ensure_index), with one indexed query each, so that the cost grows
+    with the requested series rather than with the file. The frame
+    has the layout of mtr2df: one row per timestep (of the finest
+    requested series) indexed by the start of the interval in year, and
+    series reported less often (daily, monthly) placed on the last
+    timestep of their period, nan elsewhere. Warmup days and design days
+    are skipped.
+
+    Parameters
+    ----------
+    filename : str
+        sql file to be read
+    names : List[str]
+        series to be read, either full column names ('Gas:Facility [J] !Hourly'),
+        without frequency, or only the meter or variable name; all if None
+    start, end : pd.Timestamp or str
+        if given, only timesteps from start until end (inclusive) are read
+    year : int
+        year assigned to the timestamps of the first year of every run
+        period; runs spanning several years continue into the following years
+    meters_only : bool
+        only read meters, as mtr2df does
+    index : bool
+        create the covering index first unless there is one; this writes to
+        the file, and only pays off if it is read repeatedly
+
+    Returns
+    ----------
+    data : pd.DataFrame
+        dataframe of the requested series
+    '''
+    series = sql_series(filename)
+    if meters_only:
+        series = series[series.is_meter == 1]
+    if names is not None:
+        missing = [request for request in names if not any(
+            _matches(request, column, key, name)
+            for column, key, name in zip(series.column, series.key, series.name))]
+        if missing:
+            raise KeyError(f'Series {missing} not in {filename}')
+        series = series[[any(_matches(request, column, key, name) for request in names)
+                         for column, key, name in zip(series.column, series.key, series.name)]]
+
+    connection = connect(filename, read_only=not index)
+    try:
+        indexed = ensure_index(connection) if index else has_index(connection)
+        times = _read_times(connection)
+        labels = series.frequency.map(lambda frequency: FREQUENCY_LABELS.get(frequency, frequency))
+        dense = series[labels.isin(STEP_FREQUENCIES).to_numpy()]
+
+        # rows of the frame: the time records of the finest series reported every timestep
+        step = _finest_interval(connection, times, dense['index']) if len(dense) else None
+        grid = times[times.interval == step] if step is not None else times.iloc[:0]
+        # years are counted over the whole run, before the window is cut
+        grid = _window(grid.assign(start=_start_times(grid, year)), start, end)
+
+        # end of the interval of every time record, nan for those outside the run periods
+        ends = np.full(int(times.time_index.max()) + 1 if len(times) else 0, np.nan)
+        ends[times.time_index.to_numpy()] = times.end.to_numpy()
+
+        first = int(grid.time_index.iloc[0]) if len(grid) else 0
+        codes = [int(code) for code in series['index']]
+        records = _read_records(connection, codes, first, indexed)
+        data = {column: _place_values(records[code], grid, ends) for code, column in zip(codes, series.column)}
+    finally:
+        connection.close()
+
+    print(f'Read {len(data)} series of {filename}')
+
+    return pd.DataFrame(data, index=pd.DatetimeIndex(grid.start, name='timestamp'))
+
+
+def _read_times(connection) -> pd.DataFrame:
+    '''
+    returns the records of the Time table in the weather file run periods, without warmup days
+    '''
+    query = ('SELECT TimeIndex, Month, Day, Hour, Minute, Interval, SimulationDays, EnvironmentPeriodIndex '
+             'FROM Time WHERE (WarmupFlag IS NULL OR WarmupFlag = 0)')
+    args = []
+
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if 'EnvironmentPeriods' in tables:
+        run_periods = [row[0] for row in connection.execute(
+            'SELECT EnvironmentPeriodIndex FROM EnvironmentPeriods WHERE EnvironmentType = ?',
+            (WEATHER_RUN_PERIOD,))]
+        if run_periods:
+            query += f' AND EnvironmentPeriodIndex IN ({", ".join("?" * len(run_periods))})'
+            args += run_periods
+
+    columns = ['time_index', 'month', 'day', 'hour', 'minute', 'interval', 'sim_day', 'environment']
+    # NULLs become nan in a float array, much faster than a frame of tuples
+    values = np.array(connection.execute(query + ' ORDER BY TimeIndex', args).fetchall(),
+                      dtype=float).reshape(-1, len(columns))
+
+    # records of lower frequencies leave fields empty, they end at midnight
+    defaults = {'hour': 24, 'minute': 0, 'interval': 0, 'sim_day': 1, 'environment': 0}
+    times = {}
+    for i, col in enumerate(columns):
+        column = values[:, i]
+        if col in defaults:
+            column = np.where(np.isnan(column), defaults[col], column)
+        times[col] = column.astype(np.int64)
+    times = pd.DataFrame(times)
+
+    # end of every interval in minutes since the start of the simulation, to match periods to rows
+    times['end'] = (times.environment * 100000 + times.sim_day - 1) * 1440 + times.hour * 60 + times.minute
+
+    return times
+
+
+def _finest_interval(connection, times, codes) -> int:
+    '''
+    returns the shortest interval (minutes) of the time records of the series codes
+    '''
+    intervals = set()
+    for code in codes:
+        row = connection.execute('SELECT TimeIndex FROM ReportData WHERE ReportDataDictionaryIndex = ? '
+                                 'LIMIT 1', (int(code),)).fetchone()
+        if row is not None:
+            interval = times.interval[times.time_index == row[0]]
+            intervals.update(interval.tolist())
+
+    return min(intervals) if intervals else None
+
+
+def _window(grid, start, end) -> pd.DataFrame:
+    '''
+    drops the rows of grid starting before start or after end
+    '''
+    if start is None and end is None:
+        return grid
+
+    times = grid.start.to_numpy()
+    keep = np.ones(len(grid), dtype=bool)
+    if start is not None:
+        keep &= times >= np.datetime64(pd.Timestamp(start))
+    if end is not None:
+        keep &= times <= np.datetime64(pd.Timestamp(end))
+
+    return grid[keep]
+
+
+def _start_times(grid, year) -> pd.DatetimeIndex:
+    '''
+    returns the start of the interval of every row of grid, counting the years of every run period from year
+    '''
+    environments = np.flatnonzero(np.diff(grid.environment.to_numpy())) + 1
+    years = run_years(grid.month, grid.day, year, environments)
+    minutes = (grid.hour * 60 + grid.minute - grid.interval).to_numpy()
+
+    return fields_to_index(years, grid.month, grid.day, 0, minutes)
+
+
+def _read_records(connection, codes: list, first: int, indexed: bool) -> dict:
+    '''
+    Returns code -> (TimeIndex, Value) records of the series codes from TimeIndex first on
+
+    With a covering index, every series is read from the index alone by a
+    query of its own. Without one, every query would scan the whole table,
+    so the records of all series are read in one scan and split by series.
+    '''
+    query = 'SELECT TimeIndex, Value FROM ReportData WHERE ReportDataDictionaryIndex = ? AND TimeIndex >= ?'
+    if indexed:
+        return {code: np.array(connection.execute(query, (code, first)).fetchall(), dtype=float).reshape(-1, 2)
+                for code in codes}
+
+    records = {}
+    for i in range(0, len(codes), SCAN_SERIES):
+        chunk = codes[i:i + SCAN_SERIES]
+        rows = np.array(connection.execute(
+            'SELECT ReportDataDictionaryIndex, TimeIndex, Value FROM ReportData '
+            f'WHERE TimeIndex >= ? AND ReportDataDictionaryIndex IN ({", ".join("?" * len(chunk))})',
+            [first] + chunk).fetchall(), dtype=float).reshape(-1, 3)
+
+        # stable, so the records of every series keep the order of the table
+        rows = rows[np.argsort(rows[:, 0], kind='stable')]
+        bounds = np.searchsorted(rows[:, 0], chunk), np.searchsorted(rows[:, 0], chunk, 'right')
+        records.update({code: rows[lower:upper, 1:] for code, lower, upper in zip(chunk, *bounds)})
+
+    return records
+
+
+def _place_values(records: np.ndarray, grid, ends) -> np.ndarray:
+    '''
+    places the (TimeIndex, Value) records of one series on the rows of grid, matched by the end of their interval
+    '''
+    column = np.full(len(grid), np.nan)
+    if not len(records) or not len(grid):
+        return column
+
+    # records outside the run periods are dropped
+    ends = ends[records[:, 0].astype(np.int64)]
+    valid = ~np.isnan(ends)
+    ends, values = ends[valid], records[valid, 1]
+
+    grid_ends = grid.end.to_numpy()
+    rows = np.searchsorted(grid_ends, ends, 'right') - 1
+    # a period ending on the last row of the window or before is placed on that row
+    inside = (rows >= 0) & (ends <= grid_ends[-1]) & (ends > grid_ends[0] - grid.interval.iloc[0])
+    column[rows[inside]] = values[inside]
+
+    return column
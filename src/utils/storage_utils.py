@@ -0,0 +1,284 @@
+from itertools import product
+import numpy as np
+import pandas as pd
+
+
+# parameters of a storage candidate and their defaults; None marks required ones
+PARAMETERS = {
+    'capacity': None,                   # usable storage capacity [kWh]
+    'supply_scale': 1.,                 # multiplies the supply, e.g. collector area * efficiency [m2]
+    'demand_scale': 1.,                 # multiplies the demand
+    'charge_power': np.inf,             # maximum charging power [kW]
+    'discharge_power': np.inf,          # maximum discharging power [kW]
+    'charge_efficiency': 1.,            # fraction of the charged energy that is stored
+    'discharge_efficiency': 1.,         # fraction of the discharged energy that reaches the demand
+    'loss_rate': 0.,                    # fraction of the stored energy lost per hour
+    'initial_soc': 0.,                  # state of charge at the start, fraction of capacity
+    'min_soc': 0.,                      # control: never discharged below this fraction of capacity
+    'max_soc': 1.,                      # control: never charged above this fraction of capacity
+    'charge_above': -np.inf,            # control: only charged at outdoor temperatures >= this [C]
+    'discharge_below': np.inf,          # control: only discharged at outdoor temperatures < this [C]
+}
+
+# energy totals of every candidate, all in kWh except the last
+RESULTS = ['demand', 'supply', 'direct', 'charged', 'discharged', 'losses',
+           'spilled', 'unmet', 'initial', 'final', 'max_stored', 'coverage', 'cycles']
+
+# joules per kWh, the unit of EnergyPlus meters and of the results
+J_PER_KWH = 3.6e6
+
+
+def experiment_loads(df: pd.DataFrame, demand=('output_Gas:Facility',), demand_efficiency=0.8,
+                     supply='ghi', temperature='temp_air') -> pd.DataFrame:
+    '''
+    Returns the hourly loads of the storage simulation from an experiment frame of DataClerk
+
+    Output columns are EnergyPlus meters or variables in J per reporting step and are summed
+    per hour; weather columns are repeated on every step of the outputs by DataClerk.align
+    and are averaged per hour.
+
+    Args:
+        df(pd.DataFrame): timestamp indexed experiment, e.g. DataClerk.experiments[name]['data']
+            or ExperimentStore.read(name)
+        demand(List[str]): columns whose sum is the heat demand, matched by name without
+            unit and frequency, e.g. 'output_Gas:Facility' or 'Gas:Facility'
+        demand_efficiency(float): converts the demand columns to heat, e.g. of a gas boiler
+        supply(str): irradiance column in W/m2, the supply is its energy per m2; None for no supply
+        temperature(str): outdoor temperature column for the charge_above and discharge_below
+            controls, None to omit
+
+    Returns:
+        pd.DataFrame: hourly 'demand' [kWh], 'supply' [kWh/m2] and 'temperature' [C]
+    '''
+    def match(name):
+        columns = [col for col in df.columns
+                   if any(col == key or col.startswith(key + ' ') for key in (name, 'output_' + name))]
+        if not columns:
+            raise KeyError(f'No column {name} in the experiment; columns are {list(df.columns)}')
+        return columns[0]
+
+    hours = df.index.floor('h')
+    demand = [demand] if isinstance(demand, str) else list(demand)
+    energy = df[[match(name) for name in demand]].sum(axis=1)
+
+    loads = pd.DataFrame({'demand': energy.groupby(hours).sum() * demand_efficiency / J_PER_KWH})
+    if supply is not None:
+        loads['supply'] = df[match(supply)].groupby(hours).mean() / 1000.
+    else:
+        loads['supply'] = 0.
+    if temperature is not None:
+        loads['temperature'] = df[match(temperature)].groupby(hours).mean()
+
+    return loads.rename_axis('timestamp')
+
+
+def storage_candidates(spec: dict) -> pd.DataFrame:
+    '''
+    Returns one row of parameters per storage candidate
+
+    Args:
+        spec(dict): 'grid' and 'sample' sections as in a sweep spec (see
+            utils.sweep_utils.expand_sweep), over the keys of PARAMETERS, e.g.
+            {'grid': {'capacity': [1e4, 5e4], 'loss_rate': [1e-4]},
+             'sample': {'method': 'lhs', 'n': 1000, 'parameters': {'supply_scale': [10, 200]}}}
+
+    Returns:
+        pd.DataFrame: one column per given parameter, indexed by candidate
+    '''
+    from utils.sweep_utils import sample_points
+
+    grid = spec.get('grid', {})
+    samples = sample_points(spec.get('sample'))
+    unknown = [key for key in list(grid) + list(samples[0]) if key not in PARAMETERS]
+    if unknown:
+        raise KeyError(f'Unknown storage parameters {unknown}; choose from {list(PARAMETERS)}')
+
+    keys = list(grid)
+    rows = [dict(zip(keys, values), **sample)
+            for values, sample in product(product(*[grid[key] for key in keys]), samples)]
+
+    return pd.DataFrame(rows, index=pd.RangeIndex(len(rows), name='candidate'))
+
+
+def simulate_storage(supply, demand, candidates=None, temperature=None, step_hours=1.,
+                     chunk_size=8192, trace=False, **parameters):
+    '''
+    Simulates the energy balance of many storage candidates over the same load series at once
+
+    Every step, supply first covers the demand directly. The surplus
+    charges the storage within its charging power, the room left below
+    max_soc and the charge_above control; what does not fit is spilled.
+    The remaining demand is discharged from the storage within its
+    discharging power, the energy above min_soc and the discharge_below
+    control; what is left is unmet and has to be covered by a backup.
+    Standing losses are taken from the stored energy before every step.
+
+    The steps are computed in order, but each one for all candidates in a
+    single array operation, so thousands of sizes and control settings
+    take about as long as a handful. Candidates are processed in chunks
+    of chunk_size to keep the state in cache.
+
+    Args:
+        supply(array-like): supply of every step [kWh per unit of supply_scale], shape (steps,)
+            or (steps, candidates)
+        demand(array-like): demand of every step [kWh per unit of demand_scale], as supply
+        candidates(pd.DataFrame): one row per candidate, columns are keys of PARAMETERS,
+            see storage_candidates
+        temperature(array-like): outdoor temperature of every step [C], needed by the
+            charge_above and discharge_below controls
+        step_hours(float): duration of a step in hours, scales powers and loss_rate
+        chunk_size(int): candidates simulated together
+        trace(bool): also return the stored energy after every step
+        parameters: values of PARAMETERS shared by or (as arrays) given per candidate;
+            columns of candidates take precedence
+
+    Returns:
+        pd.DataFrame: RESULTS of every candidate, indexed like candidates; coverage is the
+            fraction of the demand covered directly or from the storage, cycles the discharged
+            energy in full capacities
+        np.ndarray: stored energy [kWh] after every step as float32, shape (steps, candidates),
+            only if trace
+    '''
+    supply = np.asarray(supply, dtype=float)
+    demand = np.asarray(demand, dtype=float)
+    if len(supply) != len(demand):
+        raise ValueError(f'supply and demand differ in length: {len(supply)} != {len(demand)}')
+
+    params = _parameters(candidates, parameters)
+    size = len(next(iter(params.values())))
+    for name, series in (('supply', supply), ('demand', demand)):
+        if series.ndim == 2 and series.shape[1] != size:
+            raise ValueError(f'{name} has {series.shape[1]} columns for {size} candidates')
+
+    needs_temperature = np.isfinite(params['charge_above']).any() or np.isfinite(params['discharge_below']).any()
+    if temperature is None and needs_temperature:
+        raise ValueError('The charge_above and discharge_below controls need the temperature')
+    if temperature is not None:
+        temperature = np.asarray(temperature, dtype=float)
+
+    totals = {key: np.zeros(size) for key in RESULTS}
+    stored_trace = np.empty((len(supply), size), dtype=np.float32) if trace else None
+
+    for start in range(0, size, chunk_size):
+        chunk = slice(start, min(start + chunk_size, size))
+        _simulate_chunk(supply[:, chunk] if supply.ndim == 2 else supply,
+                        demand[:, chunk] if demand.ndim == 2 else demand,
+                        temperature, step_hours,
+                        {key: values[chunk] for key, values in params.items()},
+                        {key: values[chunk] for key, values in totals.items()},
+                        None if stored_trace is None else stored_trace[:, chunk])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        totals['coverage'] = np.where(totals['demand'] > 0, 1. - totals['unmet'] / totals['demand'], 1.)
+        totals['cycles'] = np.where(params['capacity'] > 0, totals['discharged'] / params['capacity'], 0.)
+
+    index = candidates.index if candidates is not None else pd.RangeIndex(size, name='candidate')
+    results = pd.DataFrame(totals, index=index)
+
+    return (results, stored_trace) if trace else results
+
+
+def _parameters(candidates: pd.DataFrame, parameters: dict) -> dict:
+    '''
+    returns every key of PARAMETERS as float array with one entry per candidate
+    '''
+    unknown = [key for key in list(parameters) + list(candidates.columns if candidates is not None else [])
+               if key not in PARAMETERS]
+    if unknown:
+        raise KeyError(f'Unknown storage parameters {unknown}; choose from {list(PARAMETERS)}')
+
+    values = {key: default for key, default in PARAMETERS.items()}
+    values.update(parameters)
+    if candidates is not None:
+        values.update({key: candidates[key].to_numpy() for key in candidates.columns})
+
+    missing = [key for key, value in values.items() if value is None]
+    if missing:
+        raise ValueError(f'Storage parameters {missing} are required')
+
+    size = len(candidates) if candidates is not None else \
+        max((np.size(value) for value in values.values()), default=1)
+    try:
+        values = {key: np.broadcast_to(np.asarray(value, dtype=float), (size,)).copy() for key, value in values.items()}
+    except ValueError:
+        raise ValueError(f'Storage parameters must be scalars or have one value per candidate ({size})')
+
+    # the stored energy is divided by the efficiencies
+    invalid = [key for key in ('charge_efficiency', 'discharge_efficiency') if not (values[key] > 0).all()]
+    if invalid:
+        raise ValueError(f'Storage parameters {invalid} must be positive')
+
+    return values
+
+
+def _simulate_chunk(supply, demand, temperature, step_hours, params, totals, stored_trace) -> None:
+    '''
+    simulates the candidates of one chunk, adding to the arrays in totals in place
+    '''
+    capacity = params['capacity']
+    upper = params['max_soc'] * capacity
+    lower = params['min_soc'] * capacity
+    keep = (1. - params['loss_rate']) ** step_hours
+    charge_power = params['charge_power'] * step_hours
+    discharge_power = params['discharge_power'] * step_hours
+    charge_efficiency = params['charge_efficiency']
+    discharge_efficiency = params['discharge_efficiency']
+    charge_above, discharge_below = params['charge_above'], params['discharge_below']
+    supply_scale, demand_scale = params['supply_scale'], params['demand_scale']
+
+    stored = params['initial_soc'] * capacity
+    totals['initial'] += stored
+    max_stored = stored.copy()
+
+    sums = {key: np.zeros_like(stored) for key in ['demand', 'supply', 'direct', 'charged', 'discharged',
+                                                   'losses', 'spilled', 'unmet']}
+    s, d, direct, room, charge, loss, release = (np.empty_like(stored) for _ in range(7))
+
+    for t in range(len(supply)):
+
+        np.multiply(supply[t], supply_scale, out=s)
+        np.multiply(demand[t], demand_scale, out=d)
+        np.minimum(s, d, out=direct)
+        s -= direct                                         # surplus
+        d -= direct                                         # deficit
+
+        np.multiply(stored, 1. - keep, out=loss)
+        stored -= loss
+
+        # charging: surplus within power, room below max_soc and control
+        np.subtract(upper, stored, out=room)
+        np.maximum(room, 0., out=room)
+        room /= charge_efficiency
+        np.minimum(s, charge_power, out=charge)
+        np.minimum(charge, room, out=charge)
+        if temperature is not None:
+            charge *= temperature[t] >= charge_above
+        stored += charge * charge_efficiency
+
+        # discharging: deficit within power, energy above min_soc and control
+        np.subtract(stored, lower, out=room)
+        np.maximum(room, 0., out=room)
+        room *= discharge_efficiency
+        np.minimum(d, discharge_power, out=release)
+        np.minimum(release, room, out=release)
+        if temperature is not None:
+            release *= temperature[t] < discharge_below
+        stored -= release / discharge_efficiency
+
+        np.maximum(max_stored, stored, out=max_stored)
+        sums['demand'] += d + direct
+        sums['supply'] += s + direct
+        sums['direct'] += direct
+        sums['charged'] += charge
+        sums['discharged'] += release
+        sums['losses'] += loss
+        sums['spilled'] += s - charge
+        sums['unmet'] += d - release
+
+        if stored_trace is not None:
+            stored_trace[t] = stored
+
+    for key, values in sums.items():
+        totals[key] += values
+    totals['final'] += stored
+    totals['max_stored'] += max_stored
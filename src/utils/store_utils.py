@@ -0,0 +1,494 @@
+import os
+import glob
+import json
+import shutil
+import uuid
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from utils.time_utils import align
+
+
+class ExperimentStore:
+    '''
+    Columnar on-disk store of experiment data, replacing the csv export.
+
+    Every experiment is one partition directory
+        <root>/building_type=<...>/location=<...>/experiment=<name>/
+    holding one .npy file per column, the timestamp index and a
+    meta.json with the schema (column names and dtypes) and the run
+    config. Writing an experiment never touches the partitions of other
+    experiments, so new runs are appended without rewriting old ones; an
+    experiment written again with another building_type or location moves
+    to the new partition. Columns are read with
+    memory mapping, i.e. only the requested columns and time range are
+    loaded from disk.
+
+    Weather is stored once per location (and weather file and year) in
+        <root>/_weather/location=<...>/weather=<key>/
+    Experiments written with a weather reference keep only their own
+    columns and name the weather partition in meta.json; read joins the
+    weather back, read_panel returns it separately (see ExperimentPanel).
+
+    Experiments can also be written in chunks while their simulation is
+    running (append, then finish). Their columns are raw binary files that
+    grow with every chunk; meta.json counts the rows written completely,
+    so partial experiments can be read at any time.
+
+    Attributes:
+        root(str): directory of the store
+    '''
+
+    meta_file = 'meta.json'
+    index_file = '__index__.npy'
+    weather_dir = '_weather'
+
+    def __init__(self, root):
+
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+
+    def write(self, name: str, df: pd.DataFrame, cfg: dict = None, overwrite=True, weather: dict = None) -> str:
+        '''
+        Stores the data of one experiment in its partition
+
+        Args:
+            name(str): name of the experiment
+            df(pd.DataFrame): timestamp indexed experiment data
+            cfg(dict): run config; building_type and location decide the partition
+            overwrite(bool): replace an existing partition of the same experiment
+            weather(dict): 'path' of a partition written by write_weather and the
+                'columns' of df taken from it, which are not stored again
+
+        Returns:
+            str: path of the partition
+        '''
+        cfg = dict(cfg or {})
+        path = self._partition(name, cfg.get('building_type'), cfg.get('location'))
+
+        if os.path.exists(path) and not overwrite:
+            raise FileExistsError(f'Experiment {name} already exists in {self.root}')
+
+        meta = {'experiment': name,
+                'building_type': cfg.get('building_type'),
+                'location': cfg.get('location')}
+        if weather is not None:
+            df = df.drop(columns=weather['columns'])
+            meta['weather'] = {'path': weather['path'], 'columns': list(weather['columns'])}
+        meta['cfg'] = cfg
+
+        path = self._swap_in(path, df, meta)
+        self._drop_others(name, path)
+
+        return path
+
+
+    def write_weather(self, location: str, df: pd.DataFrame, key: str) -> str:
+        '''
+        Stores the weather of location once, shared by all experiments referencing it
+
+        Args:
+            location(str): key of config.weather_dict
+            df(pd.DataFrame): timestamp indexed weather
+            key(str): identifies the weather file, its columns and year; a
+                partition with the same key is not written again
+
+        Returns:
+            str: path of the partition relative to the root, see write
+        '''
+        path = os.path.join(self.root, self.weather_dir, f'location={location}', f'weather={key}')
+        if not os.path.exists(os.path.join(path, self.meta_file)):
+            self._swap_in(path, df, {'location': location, 'weather': key})
+
+        return os.path.relpath(path, self.root)
+
+
+    def _swap_in(self, path: str, df: pd.DataFrame, meta: dict) -> str:
+        '''
+        writes the columns of df and meta (completed by the schema) to a new
+        partition and replaces the one at path with it
+        '''
+        # private to this write, so that concurrent writers of the same experiment do not collide
+        tmp = f'{path}.{uuid.uuid4().hex[:12]}.tmp'
+        os.makedirs(tmp)
+
+        schema = []
+        for i, col in enumerate(df.columns):
+            values = df[col].to_numpy()
+            if values.dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype):
+                values = np.asarray(df[col].astype(str))
+            np.save(os.path.join(tmp, f'col_{i}.npy'), values, allow_pickle=False)
+            schema.append({'name': str(col), 'file': f'col_{i}.npy', 'dtype': str(values.dtype)})
+
+        np.save(os.path.join(tmp, self.index_file), df.index.to_numpy(), allow_pickle=False)
+
+        meta = dict(meta,
+                    rows=len(df),
+                    complete=True,
+                    start=str(df.index[0]) if len(df) else None,
+                    end=str(df.index[-1]) if len(df) else None,
+                    index_name=df.index.name,
+                    columns=schema,
+                    written=datetime.now().isoformat())
+        with open(os.path.join(tmp, self.meta_file), 'w') as file:
+            json.dump(meta, file, indent=2, default=str)
+
+        # swap in the new partition only once it is complete; the old one is renamed aside
+        # rather than deleted first, so it is gone only once the new one is in place
+        old = f'{path}.{uuid.uuid4().hex[:12]}.old'
+        try:
+            os.replace(path, old)
+        except FileNotFoundError:
+            old = None
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # another process wrote the experiment in the meantime; a run written twice
+            # (e.g. reclaimed from a worker that was only slow) has the same data
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(path, self.meta_file)):
+                if old is not None:
+                    os.replace(old, path)
+                raise
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+
+        return path
+
+
+    def append(self, name: str, df: pd.DataFrame, cfg: dict = None, reset=False, weather: dict = None) -> int:
+        '''
+        Appends rows to an experiment that is still being written
+
+        The first chunk defines the columns and dtypes; later chunks must
+        have the same columns. Columns are only appended to, the rows
+        become visible to readers once meta.json counts them.
+
+        Args:
+            name(str): name of the experiment
+            df(pd.DataFrame): timestamp indexed rows following those stored before
+            cfg(dict): run config; building_type and location decide the partition
+            reset(bool): discard rows stored before, e.g. when the run was restarted
+            weather(dict): 'path' of a partition written by write_weather and the
+                'columns' joined from it on read, as for write; recorded with the first chunk
+
+        Returns:
+            int: number of rows stored for the experiment
+        '''
+        cfg = dict(cfg or {})
+        path = self._partition(name, cfg.get('building_type'), cfg.get('location'))
+        meta_path = os.path.join(path, self.meta_file)
+
+        if reset or not os.path.exists(meta_path):
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            self._drop_others(name, path)
+            schema = []
+            for i, col in enumerate(df.columns):
+                dtype = df[col].to_numpy().dtype
+                if dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype):
+                    raise TypeError(f'Column {col} of {name} cannot be appended; only numeric columns can')
+                schema.append({'name': str(col), 'file': f'col_{i}.bin', 'dtype': str(dtype)})
+
+            meta = {'experiment': name,
+                    'building_type': cfg.get('building_type'),
+                    'location': cfg.get('location'),
+                    'rows': 0,
+                    'complete': False,
+                    'start': str(df.index[0]) if len(df) else None,
+                    'end': None,
+                    'index_name': df.index.name,
+                    'index_file': '__index__.bin',
+                    'index_dtype': str(df.index.to_numpy().dtype),
+                    'columns': schema}
+            if weather is not None:
+                meta['weather'] = {'path': weather['path'], 'columns': list(weather['columns'])}
+            meta['cfg'] = cfg
+        else:
+            with open(meta_path) as file:
+                meta = json.load(file)
+            if [col['name'] for col in meta['columns']] != [str(col) for col in df.columns]:
+                raise ValueError(f'Columns of the chunk differ from those stored for {name}')
+
+        if len(df):
+            for col, values in zip(meta['columns'], df.columns):
+                self._append_raw(os.path.join(path, col['file']), df[values].to_numpy(), col['dtype'], meta['rows'])
+            self._append_raw(os.path.join(path, meta['index_file']), df.index.to_numpy(),
+                             meta['index_dtype'], meta['rows'])
+            meta['rows'] += len(df)
+            meta['end'] = str(df.index[-1])
+
+        meta['written'] = datetime.now().isoformat()
+        self._write_meta(path, meta)
+
+        return meta['rows']
+
+
+    def finish(self, name: str, cfg: dict = None) -> None:
+        '''
+        marks an experiment written with append as complete
+        '''
+        cfg = dict(cfg or {})
+        path = self._partition(name, cfg.get('building_type'), cfg.get('location'))
+        with open(os.path.join(path, self.meta_file)) as file:
+            meta = json.load(file)
+
+        meta['complete'] = True
+        meta['written'] = datetime.now().isoformat()
+        self._write_meta(path, meta)
+
+
+    @staticmethod
+    def _append_raw(filename, values, dtype, rows):
+        '''
+        writes values after the first rows entries of a raw column file, dropping
+        bytes of an interrupted earlier append
+        '''
+        values = np.ascontiguousarray(values, dtype=dtype)
+        with open(filename, 'ab') as file:
+            file.truncate(rows * values.itemsize)
+            file.write(values.tobytes())
+
+
+    def _write_meta(self, path, meta):
+
+        tmp = os.path.join(path, self.meta_file + '.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(meta, file, indent=2, default=str)
+        os.replace(tmp, os.path.join(path, self.meta_file))
+
+
+    def experiments(self, building_type=None, location=None) -> list:
+        '''
+        Returns the metadata of all stored experiments, optionally filtered by partition
+        '''
+        metas = []
+        for dirpath, dirs, files in os.walk(self.root):
+            if dirpath == self.root and self.weather_dir in dirs:
+                dirs.remove(self.weather_dir)
+            if self.meta_file not in files or dirpath.endswith(('.tmp', '.old')):
+                continue
+            with open(os.path.join(dirpath, self.meta_file)) as file:
+                meta = json.load(file)
+            if building_type is not None and meta['building_type'] != building_type:
+                continue
+            if location is not None and meta['location'] != location:
+                continue
+            meta['path'] = dirpath
+            metas.append(meta)
+
+        return sorted(metas, key=lambda meta: meta['experiment'])
+
+
+    def read(self, name: str, columns=None, start=None, end=None,
+             building_type=None, location=None) -> pd.DataFrame:
+        '''
+        Reads one experiment
+
+        Its partition is looked up by name among the building types and
+        locations of the store, without reading the metadata of the other
+        experiments, or taken directly from building_type and location.
+
+        Args:
+            name(str): name of the experiment
+            columns(List[str]): columns to be read, all if None
+            start(str or pd.Timestamp): first timestamp to be read
+            end(str or pd.Timestamp): last timestamp to be read (inclusive)
+            building_type, location(str): partition of the experiment, if known
+        '''
+        if building_type is not None and location is not None:
+            paths = [self._partition(name, building_type, location)]
+        else:
+            paths = self._partitions(name)
+
+        metas = [self._meta(path) for path in paths if os.path.exists(os.path.join(path, self.meta_file))]
+        if not metas:
+            raise KeyError(f'No experiment {name} in {self.root}')
+
+        # stores written before experiments moved between partitions may hold several
+        return self._read(max(metas, key=lambda meta: meta.get('written') or ''), columns, start, end)
+
+
+    def read_path(self, path: str, columns=None, start=None, end=None) -> pd.DataFrame:
+        '''
+        reads the experiment in the partition path returned by write, without searching the store
+        '''
+        return self._read(self._meta(path), columns, start, end)
+
+
+    def _meta(self, path: str) -> dict:
+        '''
+        returns the metadata of the partition path, including the path
+        '''
+        with open(os.path.join(path, self.meta_file)) as file:
+            meta = json.load(file)
+        meta['path'] = path
+
+        return meta
+
+
+    def _partitions(self, name: str) -> list:
+        '''
+        returns the partitions of experiment name under any building type and location
+        '''
+        pattern = os.path.join(glob.escape(self.root), 'building_type=*', 'location=*',
+                               f'experiment={glob.escape(name)}')
+        return glob.glob(pattern)
+
+
+    def _drop_others(self, name: str, path: str) -> None:
+        '''
+        removes the partitions of experiment name other than path, left by a
+        write with another building_type or location
+        '''
+        for other in self._partitions(name):
+            if os.path.abspath(other) != os.path.abspath(path):
+                shutil.rmtree(other, ignore_errors=True)
+
+
+    def read_many(self, names=None, columns=None, start=None, end=None,
+                  building_type=None, location=None) -> pd.DataFrame:
+        '''
+        Reads several experiments into one frame, with categorical columns
+        'experiment', 'building_type' and 'location' identifying the rows
+
+        Args:
+            names(List[str]): experiments to be read, all (matching the filters) if None
+            columns, start, end: see ExperimentStore.read
+            building_type(str): only read experiments of this building type
+            location(str): only read experiments at this location
+        '''
+        metas = self.experiments(building_type=building_type, location=location)
+        if names is not None:
+            metas = [meta for meta in metas if meta['experiment'] in names]
+
+        frames = []
+        for meta in metas:
+            df = self._read(meta, columns, start, end)
+            for key in ['experiment', 'building_type', 'location']:
+                df[key] = meta[key]
+            frames.append(df)
+
+        if not frames:
+            # no experiment matches
+            empty = {col: pd.Series(dtype=float) for col in columns or []}
+            empty.update({key: pd.Series(dtype=object) for key in ['experiment', 'building_type', 'location']})
+            frames = [pd.DataFrame(empty, index=pd.DatetimeIndex([], name='timestamp'))]
+
+        df = pd.concat(frames, axis=0)
+        for key in ['experiment', 'building_type', 'location']:
+            df[key] = df[key].astype('category')
+
+        return df
+
+
+    def read_panel(self, names=None, columns=None, start=None, end=None,
+                   building_type=None, location=None):
+        '''
+        Reads several experiments into an ExperimentPanel: their own columns
+        in long format, indexed by experiment, location and timestamp, and
+        the weather of every location once, see utils.panel_utils
+
+        Args:
+            names, columns, start, end, building_type, location: see ExperimentStore.read_many;
+                columns may name output and weather columns
+        '''
+        from utils.panel_utils import ExperimentPanel
+
+        metas = self.experiments(building_type=building_type, location=location)
+        if names is not None:
+            metas = [meta for meta in metas if meta['experiment'] in names]
+
+        outputs, shared = [], {}
+        for meta in metas:
+            own, weather = self._split_columns(meta, columns)
+            outputs.append(self._read_columns(meta, own, start, end))
+            if weather:
+                # every weather partition is read once, with the columns any of its experiments needs
+                needed = shared.setdefault(meta['weather']['path'], (meta['location'], []))[1]
+                needed.extend(col for col in weather if col not in needed)
+
+        weather = {path: (place, self._read_columns(self._weather_meta(path), needed, None, None))
+                   for path, (place, needed) in shared.items()}
+
+        return ExperimentPanel.from_frames(metas, outputs, weather, start=start, end=end)
+
+
+    def _read(self, meta, columns, start, end) -> pd.DataFrame:
+        '''
+        reads the columns of an experiment, joining those of its weather partition
+        '''
+        own, shared = self._split_columns(meta, columns)
+        df = self._read_columns(meta, own, start, end)
+        if not shared:
+            return df
+
+        weather = self._read_columns(self._weather_meta(meta['weather']['path']), shared, None, None)
+        if not len(df):
+            return pd.concat([df, weather.iloc[:0].set_axis(df.index, axis=0)], axis=1)
+
+        # the weather partition holds every hour, the experiment only its simulated steps
+        return align(df, weather)
+
+
+    def _split_columns(self, meta, columns):
+        '''
+        returns the requested columns stored with the experiment (None for all)
+        and those to be taken from its weather partition
+        '''
+        shared = meta['weather']['columns'] if 'weather' in meta else []
+        if columns is None:
+            return None, list(shared)
+
+        own = set(col['name'] for col in meta['columns'])
+        missing = set(columns) - own - set(shared)
+        if missing:
+            raise KeyError(f'Columns {sorted(missing)} not stored for experiment {meta["experiment"]}')
+
+        return [col for col in columns if col in own], [col for col in columns if col in shared]
+
+
+    def _weather_meta(self, path: str) -> dict:
+
+        return self._meta(os.path.join(self.root, path))
+
+
+    def _read_columns(self, meta, columns, start, end) -> pd.DataFrame:
+
+        path = meta['path']
+        index = self._load(path, meta.get('index_file', self.index_file), meta.get('index_dtype'), meta['rows'])
+
+        # the index is sorted, so time ranges map to one slice of every column
+        first = 0 if start is None else np.searchsorted(index, np.datetime64(pd.Timestamp(start)), 'left')
+        last = len(index) if end is None else np.searchsorted(index, np.datetime64(pd.Timestamp(end)), 'right')
+
+        schema = meta['columns']
+        if columns is not None:
+            schema = [col for col in schema if col['name'] in columns]
+
+        data = {col['name']: np.array(self._load(path, col['file'], col['dtype'], meta['rows'])[first:last])
+                for col in schema}
+
+        return pd.DataFrame(data, index=pd.DatetimeIndex(np.array(index[first:last]), name=meta['index_name']))
+
+
+    @staticmethod
+    def _load(path, file, dtype, rows) -> np.ndarray:
+        '''
+        memory maps a column, .npy files as written by write, raw files as written by append
+        '''
+        filename = os.path.join(path, file)
+        if file.endswith('.npy'):
+            return np.load(filename, mmap_mode='r')
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r', shape=(rows,))
+
+
+    def _partition(self, name, building_type, location):
+        return os.path.join(self.root,
+                            f'building_type={building_type}',
+                            f'location={location}',
+                            f'experiment={name}')
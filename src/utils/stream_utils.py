@@ -0,0 +1,161 @@
+import threading
+import pandas as pd
+
+from utils.data_utils import MtrTail
+from utils.profile_utils import span
+
+
+class OutputStream:
+    '''
+    Ingests the .mtr output of a run into the ExperimentStore while the
+    simulation is still writing it.
+
+    Every poll parses the timesteps completed since the last poll (see
+    MtrTail) and appends them to the store once chunk_rows have been
+    collected. Only the outputs are stored; the weather is referenced from
+    its partition (see ExperimentStore.write_weather) and joined on read.
+    Polling is done either by a background thread (start/close, or as
+    context manager around the simulation) or by the caller, e.g. the poll
+    loop of RunExecutor. When the run is restarted and the output file
+    replaced, the stored rows are discarded and ingestion starts over.
+
+    Attributes:
+        tail(MtrTail): reader of the output file
+        store(ExperimentStore): store the experiment is appended to
+        name(str): name of the experiment
+        cfg(dict): run config, decides the partition
+        weather(dict): 'path' of the weather partition of the experiment and the 'columns'
+            taken from it, see ExperimentStore.append; None for output only
+        chunk_rows(int): minimum number of timesteps appended at once
+        poll_interval(float): seconds between polls of the background thread
+        rows(int): number of rows stored so far
+        chunks(int): number of chunks appended
+    '''
+
+    def __init__(self, filename: str, store, name: str, cfg: dict = None, weather: dict = None,
+                 year=2020, chunk_rows=1008, poll_interval=1.):
+
+        self.tail = MtrTail(filename, year=year)
+        self.store = store
+        self.name = name
+        self.cfg = cfg
+        self.weather = weather
+        self.year = year
+        self.chunk_rows = chunk_rows
+        self.poll_interval = poll_interval
+
+        self.rows = 0
+        self.chunks = 0
+        self._buffer = []
+        self._buffered = 0
+        self._resets = 0
+        self._reset = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+        self.error = None
+
+
+    def poll(self, final=False) -> int:
+        '''
+        Reads newly completed timesteps and appends them once chunk_rows are collected
+
+        Args:
+            final(bool): the simulation has exited; everything left is read and appended
+
+        Returns:
+            int: number of rows stored so far
+        '''
+        with self._lock:
+            df = self.tail.read(final=final)
+
+            if self.tail.resets != self._resets:
+                # the output file was replaced by a new attempt of the run
+                self._resets = self.tail.resets
+                self._buffer, self._buffered = [], 0
+                self.rows, self._reset = 0, True
+
+            if df is not None and len(df):
+                self._buffer.append(df)
+                self._buffered += len(df)
+
+            if self._buffered >= self.chunk_rows or (final and self._buffer):
+                self._flush()
+
+            return self.rows
+
+
+    def _flush(self):
+
+        with span('stream_chunk', run=self.name, rows=self._buffered):
+            df = pd.concat(self._buffer) if len(self._buffer) > 1 else self._buffer[0]
+
+            df = df.rename(columns={col: 'output_'+col for col in df.columns if ':' in col})
+
+            self.rows = self.store.append(self.name, df, cfg=self.cfg, reset=self._reset, weather=self.weather)
+        self._reset = False
+        self.chunks += 1
+        # only dropped once stored, a failed append is retried with the next poll
+        self._buffer, self._buffered = [], 0
+
+
+    def start(self):
+        '''
+        starts polling in a background thread
+        '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f'stream-{self.name}', daemon=True)
+        self._thread.start()
+
+        return self
+
+
+    def _run(self):
+
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # reported by close, which retries from the file
+                self.error = e
+
+
+    def close(self, complete=True) -> int:
+        '''
+        Stops the background thread, ingests the rest of the file and marks the
+        experiment as complete
+
+        Args:
+            complete(bool): the simulation succeeded; otherwise only stops polling
+
+        Returns:
+            int: number of rows stored
+        '''
+        if self._closed:
+            return self.rows
+        self._closed = True
+
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+        if self.error is not None:
+            print(f'Streaming {self.name} failed at least once: {self.error!r}')
+
+        if complete:
+            self.poll(final=True)
+            if self.rows:
+                self.store.finish(self.name, cfg=self.cfg)
+        self.tail.close()
+
+        return self.rows
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close(complete=exc_type is None)
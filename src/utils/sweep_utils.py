@@ -0,0 +1,149 @@
+import os
+import copy
+from itertools import product
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import yaml
+
+
+def load_spec(spec, config_path: str = None) -> dict:
+    '''
+    Returns a sweep spec as dict
+
+    Args:
+        spec(str or dict): yaml file (absolute or relative to config_path) or spec itself
+        config_path(str): directory of run and sweep configs
+    '''
+    if isinstance(spec, dict):
+        return dict(spec)
+
+    path = spec if config_path is None else os.path.join(config_path, spec)
+    spec = yaml.safe_load(Path(path).read_text())
+    spec.setdefault('name', Path(path).stem)
+
+    # base configs are given relative to the spec file
+    if isinstance(spec.get('base'), str):
+        spec['base'] = os.path.join(os.path.dirname(path), spec['base'])
+
+    return spec
+
+
+def expand_sweep(spec, config_path: str = None):
+    '''
+    Lazily yields the run configs described by a sweep spec.
+
+    A spec has the form
+        name: office_setpoints          # prefix of the generated run names
+        base: ../runs/run1.yml          # run config (file relative to spec or inline dict)
+        grid:                           # full factorial over all listed values
+            building_type: [office, school]
+            setpoint_factor: [0.95, 1.0, 1.05]
+            period:
+                - {start: 2020-01-01, end: 2020-03-31}
+        sample:                         # combined with every grid point
+            method: lhs                 # lhs or random
+            n: 20
+            seed: 0
+            parameters:                 # [low, high] of each sampled dimension
+                idf.Building..North_Axis: [0, 90]
+
+    Dimensions starting with 'idf.' are collected into the config's
+    json_update (eppy json_functions format), 'period' sets the start and
+    end fields of the run period, all others overwrite the config key of
+    the same name. Configs are created one at a time, so arbitrarily
+    large sweeps can be streamed into DataClerk.setup_cfg and execute_runs.
+
+    Args:
+        spec(str or dict): sweep spec or yaml file containing it
+        config_path(str): directory of run and sweep configs
+
+    Yields:
+        dict: run config including 'name' and a 'sweep' entry describing its point
+    '''
+    spec = load_spec(spec, config_path)
+    base = spec.get('base', {})
+    if isinstance(base, str):
+        base = load_spec(base)
+    base.pop('name', None)
+
+    name = spec.get('name', 'sweep')
+    grid = spec.get('grid', {})
+    samples = sample_points(spec.get('sample'))
+
+    keys = list(grid)
+    for i, (values, sample) in enumerate(product(product(*[grid[key] for key in keys]), samples)):
+
+        point = dict(zip(keys, values), **sample)
+
+        cfg = copy.deepcopy(base)
+        for key, value in point.items():
+            set_dimension(cfg, key, value)
+
+        cfg['name'] = f'{name}_{i:05d}'
+        cfg['sweep'] = {'name': name, 'index': i, 'point': point}
+
+        yield cfg
+
+
+def sweep_size(spec, config_path: str = None) -> int:
+    '''
+    Returns the number of configs expand_sweep yields for spec without creating them
+    '''
+    spec = load_spec(spec, config_path)
+
+    size = int(np.prod([len(values) for values in spec.get('grid', {}).values()]))
+    if spec.get('sample') is not None:
+        size *= spec['sample']['n']
+
+    return size
+
+
+def sample_points(sample: dict = None) -> list:
+    '''
+    Draws the sampled dimensions of a sweep using besos.sampling
+
+    Args:
+        sample(dict): 'sample' section of a sweep spec
+
+    Returns:
+        List[dict]: one dict of dimension values per sample, [{}] if sample is None
+    '''
+    if sample is None:
+        return [{}]
+
+    from besos import sampling
+
+    keys = list(sample['parameters'])
+    bounds = np.array([sample['parameters'][key] for key in keys], dtype=float)
+    method = sample.get('method', 'lhs')
+    seed = sample.get('seed', 0)
+
+    if method == 'lhs':
+        unit = sampling.lhs(sample['n'], len(keys), random_state=seed)
+    elif method == 'random':
+        unit = sampling.seeded_sampler(sample['n'], len(keys), seed=seed)
+    else:
+        raise NotImplementedError(f'Sampling method {method} is not supported; use lhs or random')
+
+    values = bounds[:, 0] + unit * (bounds[:, 1] - bounds[:, 0])
+
+    return [{key: float(value) for key, value in zip(keys, row)} for row in values]
+
+
+def set_dimension(cfg: dict, key: str, value) -> None:
+    '''
+    Sets one sweep dimension in a run config, see expand_sweep
+    '''
+    if key.startswith('idf.'):
+        cfg.setdefault('json_update', {})[key] = value
+
+    elif key == 'period':
+        for bound in ['start', 'end']:
+            date = pd.Timestamp(value[bound])
+            cfg[f'{bound}_year'] = date.year
+            cfg[f'{bound}_month'] = date.month
+            cfg[f'{bound}_day'] = date.day
+
+    else:
+        cfg[key] = value
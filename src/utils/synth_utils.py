@@ -0,0 +1,398 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from utils.epw_utils import EPW_COLUMNS
+
+
+# names of the synthetic meters, repeated with a numbered end use once exhausted
+METER_NAMES = ['Electricity:Facility [J]', 'Gas:Facility [J]', 'DistrictHeating:Facility [J]',
+               'DistrictCooling:Facility [J]', 'InteriorLights:Electricity [J]',
+               'InteriorEquipment:Electricity [J]', 'Fans:Electricity [J]', 'Heating:Gas [J]',
+               'Cooling:Electricity [J]', 'WaterSystems:Gas [J]']
+
+# names of the synthetic report variables of .eso files
+VARIABLE_NAMES = ['Environment,Site Outdoor Air Drybulb Temperature [C]',
+                  'Environment,Site Direct Solar Radiation Rate per Area [W/m2]',
+                  'ZONE {i},Zone Mean Air Temperature [C]',
+                  'ZONE {i},Zone Air System Sensible Heating Energy [J]',
+                  'ZONE {i},Zone Air System Sensible Cooling Energy [J]']
+
+# time records of the data dictionary, identical in .mtr and .eso files
+TIME_RECORDS = [
+    '1,5,Environment Title[],Latitude[deg],Longitude[deg],Time Zone[],Elevation[m]',
+    '2,8,Day of Simulation[],Month[],Day of Month[],DST Indicator[1=yes 0=no],Hour[],StartMinute[],EndMinute[],DayType',
+    '3,5,Cumulative Day of Simulation[],Month[],Day of Month[],DST Indicator[1=yes 0=no],DayType  ! When Daily Report Variables Requested',
+    '4,2,Cumulative Days of Simulation[],Month[]  ! When Monthly Report Variables Requested',
+    '5,1,Cumulative Days of Simulation[] ! When Run Period Report Variables Requested',
+    '6,1,Calendar Year of Simulation[] ! When Annual Report Variables Requested',
+]
+
+
+def meter_names(n: int) -> list:
+    '''
+    returns n distinct meter names in EnergyPlus notation
+    '''
+    names = METER_NAMES[:n]
+    names += [f'Custom{i}:Electricity [J]' for i in range(n - len(names))]
+    return names
+
+
+def variable_names(n: int) -> list:
+    '''
+    returns n distinct 'key,variable [unit]' names in EnergyPlus notation
+    '''
+    names = [name for name in VARIABLE_NAMES if '{i}' not in name][:n]
+    zoned = [name for name in VARIABLE_NAMES if '{i}' in name]
+    i = 0
+    while len(names) < n:
+        names.append(zoned[i % len(zoned)].format(i=i // len(zoned) + 1))
+        i += 1
+    return names
+
+
+def timesteps(timestep=60, years=1, year=2020, start=None, end=None) -> pd.DatetimeIndex:
+    '''
+    Returns the start of every reporting interval of a simulation
+
+    Args:
+        timestep(int): minutes per interval, a divisor of 60
+        years(int): number of simulated years
+        year(int): first simulated year
+        start(pd.Timestamp): first simulated day, overrides years and year
+        end(pd.Timestamp): last simulated day (inclusive), required with start
+    '''
+    if 60 % timestep:
+        raise ValueError(f'timestep must divide an hour, got {timestep} minutes')
+
+    if start is None:
+        start, end = pd.Timestamp(year, 1, 1), pd.Timestamp(year + years - 1, 12, 31)
+
+    return pd.date_range(pd.Timestamp(start).normalize(),
+                         pd.Timestamp(end).normalize() + pd.Timedelta('1D'),
+                         freq=f'{timestep}min', inclusive='left')
+
+
+def _scales(names) -> np.ndarray:
+    '''
+    typical magnitude of every series, by unit
+    '''
+    units = {'[C]': 20., '[W/m2]': 500., '[J]': 1e6}
+    return np.array([next((scale for unit, scale in units.items() if unit in name), 1.)
+                     for name in names])
+
+
+def _profiles(index: pd.DatetimeIndex, scale: np.ndarray, seed: int) -> np.ndarray:
+    '''
+    daily and seasonal cycles with noise around scale, one column per series
+    '''
+    n = len(scale)
+    rng = np.random.default_rng(seed)
+    hour = index.hour.to_numpy() + index.minute.to_numpy() / 60
+    day = index.dayofyear.to_numpy()
+
+    daily = 1 + 0.5 * np.sin(2 * np.pi * (hour[:, None] - 6) / 24 + rng.uniform(0, 1, n))
+    seasonal = 1 + 0.3 * np.cos(2 * np.pi * day[:, None] / 365)
+    noise = rng.gamma(20, 0.05, size=(len(index), n))
+
+    return scale * rng.uniform(0.1, 1, n) * daily * seasonal * noise
+
+
+def profiles(index: pd.DatetimeIndex, names: list, seed=0) -> np.ndarray:
+    '''
+    Returns synthetic values of the series names at every step of index,
+    one column per series; the values depend only on index, names and seed
+    '''
+    return _profiles(index, _scales(names), seed)
+
+
+def write_report(path: str, names: list, timestep=60, years=1, year=2020,
+                 daily_names=(), seed=0, start=None, end=None,
+                 values=None, daily_values=None) -> str:
+    '''
+    Writes an EnergyPlus report file (.mtr or .eso format) with synthetic values
+
+    Every name in names is reported at every timestep ('!Hourly' for
+    hourly timesteps, '!TimeStep' otherwise), daily_names once per day
+    with minimum and maximum as EnergyPlus does for daily reports. The
+    values follow daily and seasonal cycles and depend only on seed.
+
+    Args:
+        path(str): file to be written
+        names(List[str]): series reported at every timestep
+        timestep(int): minutes per timestep, a divisor of 60
+        years(int): number of simulated years
+        year(int): first simulated year, decides the weekdays
+        daily_names(List[str]): series reported once per day
+        seed(int): seed of the values
+        start, end(pd.Timestamp): first and last simulated day, see timesteps
+        values(np.ndarray): values of names at every timestep instead of synthetic ones
+        daily_values(np.ndarray): the same for daily_names, aggregated to one value per day
+
+    Returns:
+        str: path
+    '''
+    index = timesteps(timestep, years, year, start, end)
+    frequency = '!Hourly' if timestep == 60 else '!TimeStep'
+    codes = range(7, 7 + len(names))
+    daily_codes = range(7 + len(names), 7 + len(names) + len(daily_names))
+
+    if values is None:
+        values = profiles(index, names, seed)
+    if daily_values is None:
+        daily_values = profiles(index, daily_names, seed + 1)
+
+    months = index.month.to_numpy()
+    days = index.day.to_numpy()
+    hours = index.hour.to_numpy() + 1
+    start_minutes = index.minute.to_numpy()
+    day_of_sim = (index - index[0]).days.to_numpy() + 1
+    day_names = index.day_name().to_numpy()
+    last_of_day = np.append(day_of_sim[1:] != day_of_sim[:-1], True)
+
+    step_record = ('2,%d,%2d,%2d, 0,%2d,%5.2f,%5.2f,%s\n'
+                   + ''.join(f'{code},%.4f\n' for code in codes))
+    daily_record = ('3,%d,%2d,%2d, 0,%s\n'
+                    + ''.join(f'{code},%.4f,%.4f,%2d,%2d,%.4f,%2d,%2d\n' for code in daily_codes))
+
+    with open(path, 'w') as file:
+        file.write('Program Version,EnergyPlus, Version 9.0.1-bb7ca4f0da, YMD=2020.01.01 00:00\n')
+        file.write('\n'.join(TIME_RECORDS) + '\n')
+        for code, name in zip(codes, names):
+            file.write(f'{code},1,{name} {frequency}\n')
+        for code, name in zip(daily_codes, daily_names):
+            file.write(f'{code},7,{name} !Daily [Value,Min,Hour,Minute,Max,Hour,Minute]\n')
+        file.write('End of Data Dictionary\n')
+        file.write('1,RUN PERIOD 1, 47.47,-111.38, -7.00,1117.00\n')
+
+        first = 0
+        for i in range(len(index)):
+            file.write(step_record % (day_of_sim[i], months[i], days[i], hours[i],
+                                      start_minutes[i], start_minutes[i] + timestep, day_names[i],
+                                      *values[i]))
+
+            if daily_names and last_of_day[i]:
+                day = daily_values[first:i + 1]
+                low, high = day.argmin(axis=0), day.argmax(axis=0)
+                fields = []
+                for j in range(len(daily_names)):
+                    fields += [day[:, j].sum(), day[low[j], j], hours[first + low[j]], start_minutes[first + low[j]],
+                               day[high[j], j], hours[first + high[j]], start_minutes[first + high[j]]]
+                file.write(daily_record % (day_of_sim[i], months[i], days[i], day_names[i], *fields))
+                first = i + 1
+
+        file.write('End of Data\n')
+        file.write(f' Number of Records Written=  {len(index) * (len(names) + 1)}\n')
+
+    return path
+
+
+def write_mtr(path: str, meters=10, timestep=60, years=1, year=2020, daily=0, seed=0) -> str:
+    '''
+    Writes a synthetic eplusout.mtr with meters timestep meters and daily daily meters, see write_report
+    '''
+    names = meter_names(meters + daily)
+    return write_report(path, names[:meters], timestep, years, year,
+                        daily_names=names[meters:], seed=seed)
+
+
+def write_eso(path: str, variables=10, timestep=60, years=1, year=2020, daily=0, seed=0) -> str:
+    '''
+    Writes a synthetic eplusout.eso with variables timestep variables and daily daily variables, see write_report
+    '''
+    names = variable_names(variables + daily)
+    return write_report(path, names[:variables], timestep, years, year,
+                        daily_names=names[variables:], seed=seed)
+
+
+def _split_name(name: str):
+    '''
+    splits 'key,Variable [unit]' or 'Meter [unit]' into key, name and unit
+    '''
+    key, _, rest = name.rpartition(',')
+    rest, _, unit = rest.partition(' [')
+    return key, rest.strip(), unit.rstrip(']')
+
+
+def write_sql(path: str, names: list, timestep=60, years=1, year=2020,
+              daily_names=(), seed=0, start=None, end=None,
+              values=None, daily_values=None, meters=()) -> str:
+    '''
+    Writes the time series tables of an EnergyPlus eplusout.sql with synthetic values
+
+    Only the tables Time, ReportDataDictionary and ReportData are written,
+    with the columns EnergyPlus uses. As in EnergyPlus, the Time table
+    holds the end of every interval. Arguments and values are the same as
+    for write_report, so both files contain the same data for the same seed.
+
+    Args:
+        meters(Iterable[str]): names that are meters rather than report variables
+
+    Returns:
+        str: path
+    '''
+    index = timesteps(timestep, years, year, start, end)
+    if values is None:
+        values = profiles(index, names, seed)
+    if daily_values is None:
+        daily_values = profiles(index, daily_names, seed + 1)
+
+    meters = set(meters)
+    step_type = (1, 'Hourly') if timestep == 60 else (0, 'Zone Timestep')
+    day_of_sim = (index - index[0]).days.to_numpy() + 1
+    ends = index + pd.Timedelta(minutes=timestep)
+
+    # intervals ending at midnight are reported as hour 24 of the previous day
+    at_midnight = (ends.hour == 0) & (ends.minute == 0)
+    labels = ends - pd.to_timedelta(at_midnight.astype(int), unit='D')
+    times = [(i + 1, label.year, label.month, label.day, 24 if midnight else label.hour, label.minute,
+              0, timestep, step_type[0], int(sim_day), label.day_name(), 1, 0)
+             for i, (label, midnight, sim_day) in enumerate(zip(labels, at_midnight, day_of_sim))]
+
+    days = index.normalize()
+    first_days = np.flatnonzero(np.append(True, days[1:] != days[:-1]))
+    daily_sums = np.add.reduceat(daily_values, first_days, axis=0) if len(daily_names) else None
+    times += [(len(index) + i + 1, day.year, day.month, day.day, 24, 0, 0, 1440, 2,
+               int(day_of_sim[first]), day.day_name(), 1, 0)
+              for i, (day, first) in enumerate(zip(days[first_days], first_days))]
+
+    dictionary = []
+    for i, name in enumerate(list(names) + list(daily_names)):
+        key, variable, unit = _split_name(name)
+        frequency = step_type[1] if i < len(names) else 'Daily'
+        dictionary.append((i + 1, int(name in meters), 'Sum' if unit == 'J' else 'Avg',
+                           'Facility:Electricity' if name in meters else 'Zone', 'Zone',
+                           key, variable, frequency, None, unit))
+
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('CREATE TABLE Time (TimeIndex INTEGER PRIMARY KEY, Year INTEGER, '
+                           'Month INTEGER, Day INTEGER, Hour INTEGER, Minute INTEGER, Dst INTEGER, '
+                           'Interval INTEGER, IntervalType INTEGER, SimulationDays INTEGER, '
+                           'DayType TEXT, EnvironmentPeriodIndex INTEGER, WarmupFlag INTEGER)')
+        connection.execute('CREATE TABLE ReportDataDictionary (ReportDataDictionaryIndex INTEGER PRIMARY KEY, '
+                           'IsMeter INTEGER, Type TEXT, IndexGroup TEXT, TimestepType TEXT, KeyValue TEXT, '
+                           'Name TEXT, ReportingFrequency TEXT, ScheduleName TEXT, Units TEXT)')
+        connection.execute('CREATE TABLE ReportData (ReportDataIndex INTEGER PRIMARY KEY, '
+                           'TimeIndex INTEGER, ReportDataDictionaryIndex INTEGER, Value REAL)')
+        connection.executemany('INSERT INTO Time VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', times)
+        connection.executemany('INSERT INTO ReportDataDictionary VALUES (?,?,?,?,?,?,?,?,?,?)', dictionary)
+
+        rows = ((int(t) + 1, int(code) + 1, float(value))
+                for (t, code), value in np.ndenumerate(values))
+        connection.executemany('INSERT INTO ReportData (TimeIndex, ReportDataDictionaryIndex, Value) '
+                               'VALUES (?,?,?)', rows)
+        if daily_sums is not None:
+            rows = ((len(index) + int(t) + 1, len(names) + int(code) + 1, float(value))
+                    for (t, code), value in np.ndenumerate(daily_sums))
+            connection.executemany('INSERT INTO ReportData (TimeIndex, ReportDataDictionaryIndex, Value) '
+                                   'VALUES (?,?,?)', rows)
+    connection.close()
+
+    return path
+
+
+def write_epw(path: str, years=1, year=2020, seed=0) -> str:
+    '''
+    Writes a synthetic hourly epw file
+
+    Header lines follow the EPW format, the location is Great Falls (MT).
+    Temperature, humidity, radiation and wind follow daily and seasonal
+    cycles; all values depend only on seed.
+
+    Args:
+        path(str): file to be written
+        years(int): number of years, consecutive calendar years starting at year
+        year(int): first year
+        seed(int): seed of the values
+
+    Returns:
+        str: path
+    '''
+    index = timesteps(60, years, year)
+    rng = np.random.default_rng(seed)
+    n = len(index)
+
+    hour = index.hour.to_numpy()
+    day = index.dayofyear.to_numpy()
+    seasonal = -np.cos(2 * np.pi * (day - 15) / 365)
+    daylight = np.clip(np.sin(np.pi * (hour - 6) / 12 + 0.2 * seasonal), 0, None)
+
+    temp_air = 6 + 14 * seasonal + 5 * np.sin(2 * np.pi * (hour - 9) / 24) + rng.normal(0, 2, n)
+    temp_dew = temp_air - rng.gamma(4, 2, n)
+    ghi = np.round(900 * daylight * (0.7 + 0.3 * seasonal) * rng.uniform(0.3, 1, n))
+    dni = np.round(ghi * rng.uniform(0.3, 1, n))
+
+    data = {
+        'year': index.year.to_numpy(),
+        'month': index.month.to_numpy(),
+        'day': index.day.to_numpy(),
+        'hour': hour + 1,
+        'minute': np.zeros(n, dtype=int),
+        'data_source_unct': np.full(n, '?9?9?9?9E0?9?9?9?9?9?9?9?9?9?9?9?9?9?9?9*9*9*9*9*9'),
+        'temp_air': np.round(temp_air, 1),
+        'temp_dew': np.round(temp_dew, 1),
+        'relative_humidity': np.clip(np.round(100 - 5 * (temp_air - temp_dew)), 5, 100).astype(int),
+        'atmospheric_pressure': np.round(88800 + rng.normal(0, 300, n)).astype(int),
+        'etr': np.round(1300 * daylight).astype(int),
+        'etrn': np.where(daylight > 0, 1360, 0),
+        'ghi_infrared': np.round(250 + 3 * temp_air).astype(int),
+        'ghi': ghi.astype(int),
+        'dni': dni.astype(int),
+        'dhi': (ghi - np.round(dni * daylight)).clip(0).astype(int),
+        'global_hor_illum': np.round(110 * ghi).astype(int),
+        'direct_normal_illum': np.round(100 * dni).astype(int),
+        'diffuse_horizontal_illum': np.round(120 * (ghi - dni * daylight).clip(0)).astype(int),
+        'zenith_luminance': np.round(300 * daylight).astype(int),
+        'wind_direction': rng.integers(0, 36, n) * 10,
+        'wind_speed': np.round(rng.gamma(2, 2, n), 1),
+        'total_sky_cover': rng.integers(0, 11, n),
+        'opaque_sky_cover': rng.integers(0, 11, n),
+        'visibility': np.full(n, 24.1),
+        'ceiling_height': np.full(n, 77777),
+        'present_weather_observation': np.full(n, 9),
+        'present_weather_codes': np.full(n, 999999999),
+        'precipitable_water': rng.integers(30, 200, n),
+        'aerosol_optical_depth': np.full(n, 0.026),
+        'snow_depth': np.where(seasonal < -0.5, rng.integers(0, 20, n), 0),
+        'days_since_last_snowfall': np.full(n, 88),
+        'albedo': np.full(n, 999.),
+        'liquid_precipitation_depth': np.full(n, 999.),
+        'liquid_precipitation_quantity': np.full(n, 99.),
+    }
+
+    with open(path, 'w') as file:
+        file.write('LOCATION,Great Falls Intl Arpt,MT,USA,TMY3,727750,47.47,-111.38,-7.0,1117.0\n')
+        file.write('DESIGN CONDITIONS,0\n')
+        file.write('TYPICAL/EXTREME PERIODS,0\n')
+        file.write('GROUND TEMPERATURES,0\n')
+        file.write('HOLIDAYS/DAYLIGHT SAVINGS,No,0,0,0\n')
+        file.write(f'COMMENTS 1,Synthetic weather generated by utils.synth_utils.write_epw (seed {seed})\n')
+        file.write('COMMENTS 2,\n')
+        file.write(f'DATA PERIODS,1,1,Data,{index[0].day_name()}, 1/ 1,12/31\n')
+
+    pd.DataFrame(data, columns=EPW_COLUMNS).to_csv(path, mode='a', header=False, index=False)
+
+    return path
+
+
+def write_outputs(directory: str, meters=10, variables=0, timestep=60, years=1, year=2020,
+                  daily=0, seed=0) -> dict:
+    '''
+    Writes eplusout.mtr and, if variables > 0, eplusout.eso into directory
+
+    Returns:
+        dict: 'mtr' and 'eso' -> path of the written file
+    '''
+    os.makedirs(directory, exist_ok=True)
+
+    paths = {'mtr': write_mtr(os.path.join(directory, 'eplusout.mtr'), meters, timestep,
+                              years, year, daily, seed)}
+    if variables > 0:
+        paths['eso'] = write_eso(os.path.join(directory, 'eplusout.eso'), variables, timestep,
+                                 years, year, daily, seed)
+
+    return paths
@@ -0,0 +1,162 @@
+import calendar
+import numpy as np
+import pandas as pd
+
+
+# cumulative number of days before the first of each month, for (non-leap, leap) years
+_MONTH_START = {
+    leap: np.concatenate([[0], np.cumsum([calendar.monthrange(2019 + leap, month)[1]
+                                          for month in range(1, 13)])])
+    for leap in (False, True)
+}
+
+
+def hour_of_year(month, day, hour, year: int, hour_ending=True) -> np.ndarray:
+    '''
+    Returns the zero based hour of year of the interval given by month, day and hour
+
+    EnergyPlus and epw files label an hourly interval by the hour in which
+    it ends, i.e. 1 to 24. With hour_ending, hour 24 of a day is hence
+    mapped to the last hour of that same day rather than to the next day.
+
+    Args:
+        month(array-like): months 1 to 12
+        day(array-like): days of month
+        hour(array-like): hours of day
+        year(int): calendar year, decides whether February has 29 days
+        hour_ending(bool): if True hours are 1 to 24, otherwise 0 to 23
+    '''
+    month = np.asarray(month, dtype=np.int64)
+    day = np.asarray(day, dtype=np.int64)
+    hour = np.asarray(hour, dtype=np.int64) - int(hour_ending)
+
+    day_of_year = _MONTH_START[calendar.isleap(year)][month - 1] + day - 1
+
+    return day_of_year * 24 + hour
+
+
+def fields_to_index(years, months, days, hours=0, minutes=0, name='timestamp') -> pd.DatetimeIndex:
+    '''
+    Returns the timestamps given by arrays of calendar fields
+
+    Computed by datetime64 arithmetic on whole arrays, without building a
+    timestamp per row, so the fields may span several years.
+
+    Args:
+        years, months, days(array-like): calendar date of every row
+        hours, minutes(array-like or scalar): time of day, 0 to 23 and 0 to 59
+    '''
+    years = np.asarray(years, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+
+    first = ((years - 1970) * 12 + months - 1).astype('datetime64[M]').astype('datetime64[D]')
+    dates = first + np.asarray(days, dtype=np.int64) - 1
+    minutes = np.asarray(hours, dtype=np.int64) * 60 + np.asarray(minutes, dtype=np.float64).astype(np.int64)
+
+    return pd.DatetimeIndex((dates + minutes.astype('timedelta64[m]')).astype('datetime64[ns]'), name=name)
+
+
+def run_years(months, days, year: int, environments=None) -> np.ndarray:
+    '''
+    Returns the year of every record of a run that may span several years
+
+    EnergyPlus output carries month and day only. A run period starts in
+    year and every time the date goes back (December to January) a new
+    year begins; the count restarts at every environment (sizing or run
+    period), so design days before the run period do not shift it.
+
+    Args:
+        months, days(array-like): dates of the records in file order
+        year(int): year of the first record of every environment
+        environments(array-like): positions of the first records of environments
+    '''
+    keys = np.asarray(months, dtype=np.int64) * 32 + np.asarray(days, dtype=np.int64)
+    if not len(keys):
+        return np.empty(0, dtype=np.int64)
+
+    wraps = np.concatenate([[False], np.diff(keys) < 0])
+    starts = np.unique(np.concatenate([[0], np.asarray(environments if environments is not None else [],
+                                                        dtype=np.int64)]))
+    starts = starts[starts < len(keys)]
+    wraps[starts] = False
+
+    count = np.cumsum(wraps)
+    # years counted within the environment of every record
+    environment = np.searchsorted(starts, np.arange(len(keys)), 'right') - 1
+
+    return year + count - count[starts][environment]
+
+
+def keys_to_index(keys, year: int, step='1h', name='timestamp') -> pd.DatetimeIndex:
+    '''
+    Returns the timestamps of integer step of year keys
+
+    Args:
+        keys(array-like): zero based number of steps since the start of year
+        year(int): calendar year
+        step(str or pd.Timedelta): length of one step
+    '''
+    keys = np.asarray(keys, dtype=np.int64)
+    return pd.DatetimeIndex(pd.Timestamp(year, 1, 1) + keys * pd.Timedelta(step), name=name)
+
+
+def index_to_keys(index: pd.DatetimeIndex, step, year: int = None) -> np.ndarray:
+    '''
+    Returns the zero based step of year of every timestamp in index
+
+    Args:
+        index(pd.DatetimeIndex): timezone naive timestamps
+        step(str or pd.Timedelta): length of one step
+        year(int): year the keys count from, defaults to the year of the first timestamp
+    '''
+    year = year or index[0].year
+    return np.asarray((index - pd.Timestamp(year, 1, 1)) // pd.Timedelta(step), dtype=np.int64)
+
+
+def index_step(index: pd.DatetimeIndex) -> pd.Timedelta:
+    '''
+    Returns the reporting step of index, i.e. the smallest difference between timestamps
+    '''
+    if len(index) < 2:
+        return pd.Timedelta('1h')
+    return pd.Timedelta(np.diff(index.values).min())
+
+
+def align(left: pd.DataFrame, right: pd.DataFrame, year: int = None) -> pd.DataFrame:
+    '''
+    Inner join of two timestamp indexed frames on their integer step of year
+
+    Both frames are keyed on the coarser of their two reporting steps, so
+    e.g. 10-minute output can be joined with hourly weather: every output
+    row receives the weather of the hour it falls into. The frame with the
+    finer step determines the index of the result. Columns of right that
+    already exist in left are not copied.
+
+    Args:
+        left(pd.DataFrame): frame indexed by a timezone naive pd.DatetimeIndex
+        right(pd.DataFrame): frame indexed by a timezone naive pd.DatetimeIndex
+        year(int): year the keys count from, defaults to the year of left
+
+    Returns:
+        pd.DataFrame with the rows of both frames whose keys match
+    '''
+    year = year or left.index[0].year
+    step = max(index_step(left.index), index_step(right.index))
+
+    right = right.drop(columns=[col for col in right.columns if col in left.columns])
+
+    left_fine = index_step(left.index) <= index_step(right.index)
+    fine, coarse = (left, right) if left_fine else (right, left)
+
+    coarse_keys = index_to_keys(coarse.index, step, year)
+    if len(np.unique(coarse_keys)) != len(coarse_keys):
+        raise ValueError('Cannot align two frames that are both finer than their common step '
+                         f'{step}; resample one of them first.')
+
+    positions = pd.Index(coarse_keys).get_indexer(index_to_keys(fine.index, step, year))
+    matched = positions >= 0
+
+    fine = fine.iloc[matched]
+    coarse = coarse.iloc[positions[matched]].set_axis(fine.index, axis=0)
+
+    return pd.concat([fine, coarse] if left_fine else [coarse, fine], axis=1)